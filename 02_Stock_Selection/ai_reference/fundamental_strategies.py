@@ -4,6 +4,8 @@
 AI可以参考这些策略实现，但实际使用时需要根据具体需求调整
 """
 
+from factor_score_lib import *
+
 def fundamental_strategy_1_roe_pe():
     """
     策略1：ROE + PE 选股
@@ -106,10 +108,11 @@ def fundamental_strategy_5_industry_leader():
     
     return df['code'].tolist()
 
-def comprehensive_fundamental_selection():
+def comprehensive_fundamental_selection(factors=None, k=50):
     """
     综合基本面选股
     结合多个策略，按权重评分
+    factors 为自定义因子表（见 factor_score_lib.factor），用到的字段需在下面的查询中
     """
     # 获取基础数据
     q = query(
@@ -127,61 +130,10 @@ def comprehensive_fundamental_selection():
     if df.empty:
         return []
     
-    # 计算负债率
-    df['debt_ratio'] = df['total_liability'] / df['total_assets']
-    
-    # 评分系统
-    scores = []
-    for _, row in df.iterrows():
-        score = 0
-        
-        # ROE评分 (0-30分)
-        if row['roe'] > 20:
-            score += 30
-        elif row['roe'] > 15:
-            score += 20
-        elif row['roe'] > 10:
-            score += 10
-        
-        # PE评分 (0-20分)
-        if 0 < row['pe_ratio'] < 15:
-            score += 20
-        elif 15 <= row['pe_ratio'] < 25:
-            score += 15
-        elif 25 <= row['pe_ratio'] < 35:
-            score += 10
-        
-        # 营收增长评分 (0-20分)
-        if row['inc_revenue_year_on_year'] > 30:
-            score += 20
-        elif row['inc_revenue_year_on_year'] > 20:
-            score += 15
-        elif row['inc_revenue_year_on_year'] > 10:
-            score += 10
-        
-        # 负债率评分 (0-15分)
-        if row['debt_ratio'] < 0.3:
-            score += 15
-        elif row['debt_ratio'] < 0.5:
-            score += 10
-        elif row['debt_ratio'] < 0.7:
-            score += 5
-        
-        # PB评分 (0-15分)
-        if 0 < row['pb_ratio'] < 2:
-            score += 15
-        elif 2 <= row['pb_ratio'] < 4:
-            score += 10
-        elif 4 <= row['pb_ratio'] < 6:
-            score += 5
-        
-        scores.append((row['code'], score))
-    
-    # 按评分排序
-    scores.sort(key=lambda x: x[1], reverse=True)
-    
-    # 返回前50只股票
-    return [stock for stock, score in scores[:50]]
+    # 评分系统：ROE(0-30) + PE(0-20) + 营收增长(0-20) + 负债率(0-15) + PB(0-15)
+    # 分档规则见 factor_score_lib.COMPREHENSIVE_FACTORS，可替换为自定义因子表和权重
+    # 返回前 k 只股票（默认50只）
+    return select_by_factors(df, factors or COMPREHENSIVE_FACTORS, k)
 
 """
 使用说明：
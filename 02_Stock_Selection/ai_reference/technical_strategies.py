@@ -2,239 +2,188 @@
 """
 技术面选股策略参考
 AI可以参考这些策略实现，但实际使用时需要根据具体需求调整
+
+全市场选股不要逐只 get_price：一次取全部股票的日线宽表（price_panel_lib），
+均线/RSI/MACD/量比按列整表计算，5000只股票一次调用完成。
+每个策略函数都可以传入同一个 panel，综合选股与单项选股共用一次取数。
 """
 
-def technical_strategy_1_ma_cross():
+import numpy as np
+
+from price_panel_lib import price_panel
+
+# ==================== 向量化指标引擎 ====================
+# 数组第0维为交易日（最后一行为最近交易日），第1维为股票；停牌压缩后空值只出现在顶部
+
+def load_technical_panel(stocks=None, count=50, end_date=None):
     """
-    策略1：均线金叉选股
-    条件：5日均线上穿20日均线
+    一次取全部股票最近 count 个交易日的 close/high/volume 宽表
+
+    Args:
+        stocks: 股票列表，默认全部A股
+        count: 交易日数（各策略所需的最长窗口，MACD 为 50）
+        end_date: 截止日期，默认与 get_price 相同
+
+    Returns:
+        PricePanel: 列与 stocks 顺序一致，rows 为有成交的K线数
     """
-    selected_stocks = []
-    
-    # 获取所有A股
-    all_stocks = list(get_all_securities(['stock']).index)
-    
-    for stock in all_stocks:
-        try:
-            # 获取历史数据
-            hist = get_price(stock, count=30, frequency='daily', fields=['close'])
-            if len(hist) < 30:
-                continue
-            
-            # 计算均线
-            ma5 = hist['close'].rolling(window=5).mean()
-            ma20 = hist['close'].rolling(window=20).mean()
-            
-            # 检查金叉条件
-            if (ma5[-1] > ma20[-1] and  # 当前5日均线在20日均线上方
-                ma5[-2] <= ma20[-2]):  # 前一日5日均线在20日均线下方或相等
-                selected_stocks.append(stock)
-                
-        except:
-            continue
-    
-    return selected_stocks
+    if stocks is None:
+        stocks = list(get_all_securities(['stock']).index)
+    return price_panel(stocks, end_date, count, ['close', 'high', 'volume'],
+                       fill_paused=False, skip_paused=False).compact().reindex(stocks)
+
+def rolling_mean(x, window):
+    """按列滚动均值，窗口内有空值时为 NaN（与 rolling(window).mean() 一致）"""
+    valid = ~np.isnan(x)
+    zero = np.zeros((1, x.shape[1]))
+    total = np.vstack([zero, np.cumsum(np.where(valid, x, 0.0), axis=0)])
+    count = np.vstack([zero, np.cumsum(valid, axis=0)])
+    out = np.full(x.shape, np.nan)
+    if len(x) >= window:
+        sums = total[window:] - total[:-window]
+        full = (count[window:] - count[:-window]) == window
+        out[window - 1:] = np.where(full, sums / window, np.nan)
+    return out
+
+def ema(x, span):
+    """按列指数移动平均，与 ewm(span=span).mean()（adjust=True）一致；顶部空值之后开始计算"""
+    decay = 1.0 - 2.0 / (span + 1.0)
+    num = np.zeros(x.shape[1])
+    den = np.zeros(x.shape[1])
+    out = np.full(x.shape, np.nan)
+    for t in range(len(x)):
+        valid = ~np.isnan(x[t])
+        num = np.where(valid, x[t] + decay * num, num)
+        den = np.where(valid, 1.0 + decay * den, den)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[t] = np.where(den > 0, num / den, np.nan)
+    return out
+
+def rsi_panel(close, period=14):
+    """按列 RSI，与 calculate_rsi 一致"""
+    delta = np.vstack([np.full((1, close.shape[1]), np.nan), np.diff(close, axis=0)])
+    gain = np.where(delta > 0, delta, 0.0)
+    loss = np.where(delta < 0, -delta, 0.0)
+    gain[np.isnan(close)] = np.nan
+    loss[np.isnan(close)] = np.nan
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rs = rolling_mean(gain, period) / rolling_mean(loss, period)
+        return 100 - 100 / (1 + rs)
+
+def macd_panel(close, fast=12, slow=26, signal=9):
+    """按列 MACD，与 calculate_macd 一致，返回 (macd_line, signal_line, histogram)"""
+    macd_line = ema(close, fast) - ema(close, slow)
+    signal_line = ema(macd_line, signal)
+    return macd_line, signal_line, macd_line - signal_line
+
+def ranked(panel, mask, key, descending=True):
+    """mask 选中的股票按 key 排序（相同时保持原顺序）"""
+    idx = np.flatnonzero(mask)
+    order = np.argsort(-key[idx] if descending else key[idx], kind='stable')
+    return [panel.codes[i] for i in idx[order]]
 
-def technical_strategy_2_breakout():
+# ==================== 选股策略 ====================
+
+def technical_strategy_1_ma_cross(panel=None):
     """
-    策略2：突破选股
-    条件：价格突破20日最高价，成交量放大
+    策略1：均线金叉选股
+    条件：5日均线上穿20日均线，按 MA5/MA20 从大到小排序
+    """
+    panel = panel if panel is not None else load_technical_panel(count=30)
+    close = panel['close']
+    ma5, ma20 = rolling_mean(close, 5), rolling_mean(close, 20)
+    with np.errstate(invalid='ignore'):
+        mask = ((panel.rows >= 30) &
+                (ma5[-1] > ma20[-1]) &    # 当前5日均线在20日均线上方
+                (ma5[-2] <= ma20[-2]))    # 前一日5日均线在20日均线下方或相等
+        return ranked(panel, mask, ma5[-1] / ma20[-1])
+
+def technical_strategy_2_breakout(panel=None):
     """
-    selected_stocks = []
-    
-    all_stocks = list(get_all_securities(['stock']).index)
-    
-    for stock in all_stocks:
-        try:
-            # 获取历史数据
-            hist = get_price(stock, count=30, frequency='daily', 
-                           fields=['close', 'high', 'volume'])
-            if len(hist) < 30:
-                continue
-            
-            current_price = hist['close'][-1]
-            high_20 = hist['high'][-20:].max()
-            volume_avg = hist['volume'][-20:].mean()
-            current_volume = hist['volume'][-1]
-            
-            # 突破条件
-            if (current_price > high_20 and  # 价格突破20日最高
-                current_volume > volume_avg * 1.5):  # 成交量放大1.5倍
-                selected_stocks.append(stock)
-                
-        except:
-            continue
-    
-    return selected_stocks
+    策略2：突破选股
+    条件：价格突破前20日最高价（不含当日，收盘价不会高于当日最高价），成交量放大，按突破幅度排序
+    """
+    panel = panel if panel is not None else load_technical_panel(count=30)
+    close, high, volume = panel['close'], panel['high'], panel['volume']
+    high_20 = high[-21:-1].max(axis=0)
+    volume_avg = volume[-20:].mean(axis=0)
+    with np.errstate(invalid='ignore'):
+        mask = ((panel.rows >= 30) &
+                (close[-1] > high_20) &               # 价格突破20日最高
+                (volume[-1] > volume_avg * 1.5))      # 成交量放大1.5倍
+        return ranked(panel, mask, close[-1] / high_20)
 
-def technical_strategy_3_rsi_oversold():
+def technical_strategy_3_rsi_oversold(panel=None):
     """
     策略3：RSI超卖反弹选股
-    条件：RSI < 30，价格开始反弹
-    """
-    selected_stocks = []
-    
-    all_stocks = list(get_all_securities(['stock']).index)
-    
-    for stock in all_stocks:
-        try:
-            # 获取历史数据
-            hist = get_price(stock, count=30, frequency='daily', fields=['close'])
-            if len(hist) < 30:
-                continue
-            
-            # 计算RSI
-            rsi = calculate_rsi(hist['close'], 14)
-            if len(rsi) < 2:
-                continue
-            
-            current_rsi = rsi[-1]
-            prev_rsi = rsi[-2]
-            current_price = hist['close'][-1]
-            prev_price = hist['close'][-2]
-            
-            # RSI超卖反弹条件
-            if (current_rsi < 30 and  # RSI超卖
-                current_rsi > prev_rsi and  # RSI开始上升
-                current_price > prev_price):  # 价格开始上涨
-                selected_stocks.append(stock)
-                
-        except:
-            continue
-    
-    return selected_stocks
+    条件：RSI < 30，价格开始反弹，RSI 越低越靠前
+    """
+    panel = panel if panel is not None else load_technical_panel(count=30)
+    close = panel['close']
+    rsi = rsi_panel(close, 14)
+    with np.errstate(invalid='ignore'):
+        mask = ((panel.rows >= 30) &
+                (rsi[-1] < 30) &              # RSI超卖
+                (rsi[-1] > rsi[-2]) &         # RSI开始上升
+                (close[-1] > close[-2]))      # 价格开始上涨
+        return ranked(panel, mask, rsi[-1], descending=False)
 
-def technical_strategy_4_macd_golden_cross():
+def technical_strategy_4_macd_golden_cross(panel=None):
     """
     策略4：MACD金叉选股
-    条件：MACD线上穿信号线
-    """
-    selected_stocks = []
-    
-    all_stocks = list(get_all_securities(['stock']).index)
-    
-    for stock in all_stocks:
-        try:
-            # 获取历史数据
-            hist = get_price(stock, count=50, frequency='daily', fields=['close'])
-            if len(hist) < 50:
-                continue
-            
-            # 计算MACD
-            macd_line, signal_line, histogram = calculate_macd(hist['close'])
-            if len(macd_line) < 2:
-                continue
-            
-            # MACD金叉条件
-            if (macd_line[-1] > signal_line[-1] and  # 当前MACD线在信号线上方
-                macd_line[-2] <= signal_line[-2]):  # 前一日MACD线在信号线下方或相等
-                selected_stocks.append(stock)
-                
-        except:
-            continue
-    
-    return selected_stocks
+    条件：MACD线上穿信号线，按柱状图从大到小排序
+    """
+    panel = panel if panel is not None else load_technical_panel(count=50)
+    macd_line, signal_line, histogram = macd_panel(panel['close'])
+    with np.errstate(invalid='ignore'):
+        mask = ((panel.rows >= 50) &
+                (macd_line[-1] > signal_line[-1]) &   # 当前MACD线在信号线上方
+                (macd_line[-2] <= signal_line[-2]))   # 前一日MACD线在信号线下方或相等
+        return ranked(panel, mask, histogram[-1])
 
-def technical_strategy_5_volume_surge():
+def technical_strategy_5_volume_surge(panel=None):
     """
     策略5：成交量异动选股
-    条件：成交量突然放大，价格配合上涨
-    """
-    selected_stocks = []
-    
-    all_stocks = list(get_all_securities(['stock']).index)
-    
-    for stock in all_stocks:
-        try:
-            # 获取历史数据
-            hist = get_price(stock, count=20, frequency='daily', 
-                           fields=['close', 'volume'])
-            if len(hist) < 20:
-                continue
-            
-            current_volume = hist['volume'][-1]
-            volume_avg = hist['volume'][-20:].mean()
-            current_price = hist['close'][-1]
-            prev_price = hist['close'][-2]
-            
-            # 成交量异动条件
-            if (current_volume > volume_avg * 2 and  # 成交量放大2倍
-                current_price > prev_price):  # 价格上涨
-                selected_stocks.append(stock)
-                
-        except:
-            continue
-    
-    return selected_stocks
+    条件：成交量突然放大，价格配合上涨，按量比排序
+    """
+    panel = panel if panel is not None else load_technical_panel(count=20)
+    close, volume = panel['close'], panel['volume']
+    volume_ratio = volume[-1] / volume[-20:].mean(axis=0)
+    with np.errstate(invalid='ignore'):
+        mask = ((panel.rows >= 20) &
+                (volume_ratio > 2) &          # 成交量放大2倍
+                (close[-1] > close[-2]))      # 价格上涨
+        return ranked(panel, mask, volume_ratio)
 
-def comprehensive_technical_selection():
+def comprehensive_technical_selection(panel=None, top=30):
     """
     综合技术面选股
-    结合多个技术指标，按权重评分
-    """
-    all_stocks = list(get_all_securities(['stock']).index)
-    stock_scores = []
-    
-    for stock in all_stocks:
-        try:
-            # 获取历史数据
-            hist = get_price(stock, count=50, frequency='daily', 
-                           fields=['close', 'high', 'volume'])
-            if len(hist) < 50:
-                continue
-            
-            score = 0
-            
-            # 均线评分 (0-25分)
-            ma5 = hist['close'].rolling(window=5).mean()
-            ma20 = hist['close'].rolling(window=20).mean()
-            if ma5[-1] > ma20[-1]:
-                score += 25
-            elif ma5[-1] > ma20[-1] * 0.98:  # 接近金叉
-                score += 15
-            
-            # RSI评分 (0-20分)
-            rsi = calculate_rsi(hist['close'], 14)
-            if len(rsi) > 0:
-                current_rsi = rsi[-1]
-                if 30 < current_rsi < 70:  # 合理区间
-                    score += 20
-                elif current_rsi < 30:  # 超卖
-                    score += 15
-            
-            # MACD评分 (0-20分)
-            macd_line, signal_line, histogram = calculate_macd(hist['close'])
-            if len(macd_line) > 0:
-                if macd_line[-1] > signal_line[-1]:
-                    score += 20
-                elif histogram[-1] > 0:  # 柱状图为正
-                    score += 10
-            
+    结合多个技术指标，按权重评分，返回前 top 只
+    """
+    panel = panel if panel is not None else load_technical_panel(count=50)
+    close, volume = panel['close'], panel['volume']
+    ma5, ma20 = rolling_mean(close, 5), rolling_mean(close, 20)
+    rsi = rsi_panel(close, 14)[-1]
+    macd_line, signal_line, histogram = macd_panel(close)
+    volume_avg = volume[-20:].mean(axis=0)
+    price_change = (close[-1] - close[-20]) / close[-20]
+
+    with np.errstate(invalid='ignore'):
+        score = (
+            # 均线评分 (0-25分)：多头排列 / 接近金叉
+            np.select([ma5[-1] > ma20[-1], ma5[-1] > ma20[-1] * 0.98], [25, 15], 0) +
+            # RSI评分 (0-20分)：合理区间 / 超卖
+            np.select([(rsi > 30) & (rsi < 70), rsi < 30], [20, 15], 0) +
+            # MACD评分 (0-20分)：MACD线在信号线上方 / 柱状图为正
+            np.select([macd_line[-1] > signal_line[-1], histogram[-1] > 0], [20, 10], 0) +
             # 成交量评分 (0-20分)
-            volume_avg = hist['volume'][-20:].mean()
-            current_volume = hist['volume'][-1]
-            if current_volume > volume_avg * 1.5:
-                score += 20
-            elif current_volume > volume_avg:
-                score += 10
-            
-            # 价格动量评分 (0-15分)
-            price_change = (hist['close'][-1] - hist['close'][-20]) / hist['close'][-20]
-            if price_change > 0.1:  # 20日涨幅超过10%
-                score += 15
-            elif price_change > 0.05:  # 20日涨幅超过5%
-                score += 10
-            
-            stock_scores.append((stock, score))
-            
-        except:
-            continue
-    
-    # 按评分排序
-    stock_scores.sort(key=lambda x: x[1], reverse=True)
-    
-    # 返回前30只股票
-    return [stock for stock, score in stock_scores[:30]]
+            np.select([volume[-1] > volume_avg * 1.5, volume[-1] > volume_avg], [20, 10], 0) +
+            # 价格动量评分 (0-15分)：20日涨幅超过10% / 5%
+            np.select([price_change > 0.1, price_change > 0.05], [15, 10], 0)
+        )
+    return ranked(panel, panel.rows >= 50, score.astype(float))[:top]
+
+# ==================== 单只股票指标（pandas Series） ====================
 
 def calculate_rsi(prices, period=14):
     """
@@ -256,4 +205,4 @@ def calculate_macd(prices, fast=12, slow=26, signal=9):
     macd_line = ema_fast - ema_slow
     signal_line = macd_line.ewm(span=signal).mean()
     histogram = macd_line - signal_line
-    return macd_line, signal_line, histogram
\ No newline at end of file
+    return macd_line, signal_line, histogram
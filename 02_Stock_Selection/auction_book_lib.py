@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+聚宽集合竞价盘口库 - 整个候选列表一次取竞价五档，盘口因子整表计算
+原过滤逐只调用 get_call_auction，再对每只股票用 assign 拼五档买卖金额，
+候选几百只时 09:26 到 09:27 的一分钟内来不及算完
+
+功能模块：
+1. 批量读取 load_auction_book(codes, date)
+   - 一次 get_call_auction(codes, ...) 取全部候选当日的竞价快照（同一证券多行时取第一行，与原逐只 iloc[0] 一致）
+   - book.levels 为 (证券, 5档, 买/卖, 价/量) 的 float 数组，没有竞价数据的证券为 NaN
+   - 下标常量：BID=0 / ASK=1，PRICE=0 / VOLUME=1
+
+2. 盘口因子（整表计算）
+   - book.money(side)  # 五档金额合计 sum(价 * 量)
+   - bs_imbalance(book)  # (买盘金额 - 卖盘金额) / 卖盘金额，与原 b_s 一致
+   - filter_by_bs(codes, date, threshold=0)  # 保持原顺序，返回 b_s > threshold 的证券
+
+使用说明：
+1. 将本文件放在聚宽研究根目录
+2. 在策略中导入：from auction_book_lib import *
+3. 竞价后（09:25 之后）调用 filter_by_bs(codes, context.current_dt.date())
+"""
+
+# 聚宽API导入
+try:
+    from kuanke.user_space_api import *
+except:
+    pass
+
+import numpy as np
+
+LEVELS = 5
+BID, ASK = 0, 1
+PRICE, VOLUME = 0, 1
+_PREFIX = {BID: 'b', ASK: 'a'}
+BOOK_FIELDS = ['%s%d_%s' % (_PREFIX[side], level, suffix)
+               for level in range(1, LEVELS + 1) for side in (BID, ASK) for suffix in ('p', 'v')]
+
+
+class AuctionBook:
+    """
+    集合竞价五档盘口：levels[i, 档位, 买/卖, 价/量]
+    """
+
+    def __init__(self, codes, levels):
+        self.codes = list(codes)
+        self.levels = levels
+
+    @classmethod
+    def from_frame(cls, codes, df):
+        """get_call_auction 的结果 -> 与 codes 对齐的盘口数组"""
+        codes = list(codes)
+        levels = np.full((len(codes), LEVELS, 2, 2), np.nan)
+        if df is None or df.empty:
+            return cls(codes, levels)
+        first = df.drop_duplicates('code', keep='first').set_index('code').reindex(codes)
+        for level in range(LEVELS):
+            for side in (BID, ASK):
+                prefix = '%s%d' % (_PREFIX[side], level + 1)
+                levels[:, level, side, PRICE] = first[prefix + '_p'].values
+                levels[:, level, side, VOLUME] = first[prefix + '_v'].values
+        return cls(codes, levels)
+
+    def money(self, side):
+        """五档金额合计；任一档为空时为 NaN（与逐列相加一致）"""
+        return (self.levels[:, :, side, PRICE] * self.levels[:, :, side, VOLUME]).sum(axis=1)
+
+    def __len__(self):
+        return len(self.codes)
+
+
+def load_auction_book(codes, date):
+    """
+    一次读取 codes 在 date 的集合竞价盘口
+
+    Args:
+        codes: 证券列表
+        date: 交易日（str / date）
+
+    Returns:
+        AuctionBook
+    """
+    codes = list(codes)
+    if not codes:
+        return AuctionBook(codes, np.empty((0, LEVELS, 2, 2)))
+    df = get_call_auction(codes, start_date=date, end_date=date, fields=['time'] + BOOK_FIELDS)
+    return AuctionBook.from_frame(codes, df)
+
+
+def bs_imbalance(book):
+    """(买盘金额 - 卖盘金额) / 卖盘金额；卖盘为0时为 inf 或 NaN"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sell = book.money(ASK)
+        return (book.money(BID) - sell) / sell
+
+
+def filter_by_bs(codes, date, threshold=0.0):
+    """返回竞价 b_s > threshold 的证券，保持原顺序；没有竞价数据的证券不入选"""
+    book = load_auction_book(codes, date)
+    with np.errstate(invalid='ignore'):
+        keep = bs_imbalance(book) > threshold
+    return [c for c, k in zip(book.codes, keep) if k]
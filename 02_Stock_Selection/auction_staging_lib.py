@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+聚宽竞价下单预备库 - 竞价前备好候选与资金，竞价后一次向量化过滤并集中下单
+集合竞价类策略（弱转强 09:26 筛选、09:27 买入）在竞价结束后的几秒内逐只拉数据、逐只判断、逐只下单，
+其中只有开盘价相关的过滤真正依赖竞价结果
+
+功能模块：
+1. 竞价前备选（例如 09:20）
+   - stage_auction_orders(context, codes, prev_close, score, value_per_stock, slots)
+     候选已按竞价前可得的数据筛好；prev_close/score 为对齐的数组；资金按仓位数均分好
+
+2. 竞价后触发（例如 09:26）
+   - fire_auction_orders(context, low, high, auction_filter=None, send=order_value)
+     a. 一次读取全部候选的开盘价/涨跌停/停牌，向量化计算 开盘/昨收 比值并按 [low, high] 区间过滤
+     b. 按 score * 开盘/昨收 从大到小排序
+     c. 可选的竞价盘口过滤 auction_filter(codes) -> codes（只对过滤后剩下的候选调用）
+     d. 取前 slots 只，跳过停牌/涨跌停，集中下单；日志、名称、通知等记账在下单之后做
+
+3. 耗时统计
+   - 每次触发记录：竞价撮合(09:25) 到回调开始、过滤、下单三段耗时（毫秒）
+   - auction_staging_stats()  # 近期各段 p50/max
+   - 回测中系统时间与回测时间无关，不统计 竞价撮合 -> 回调开始
+
+使用说明：
+1. 将本文件放在聚宽研究根目录
+2. 在策略中导入：from auction_staging_lib import *
+3. 竞价前的定时任务中 stage_auction_orders，竞价后的定时任务中 fire_auction_orders
+"""
+
+# 聚宽API导入
+try:
+    from kuanke.user_space_api import *
+except:
+    pass
+
+import time
+import datetime as dt
+from collections import deque
+
+import numpy as np
+
+
+class AuctionStagingLib:
+    """
+    竞价前备选、竞价后一次过滤并下单
+    """
+
+    def __init__(self, auction_time='09:25', history=60):
+        """
+        Args:
+            auction_time: 集合竞价撮合时间
+            history: 保留最近多少次触发的耗时
+        """
+        self.auction_time = auction_time
+        self.date = None
+        self.codes = np.empty(0, dtype=object)
+        self.prev_close = np.empty(0)
+        self.score = np.empty(0)
+        self.value_per_stock = 0.0
+        self.slots = 0
+        self.fired = False
+        self.timings = deque(maxlen=history)
+
+    # ==================== 备选 ====================
+
+    def stage(self, context, codes, prev_close, score=None, value_per_stock=0.0, slots=0):
+        """
+        竞价前备好候选
+
+        Args:
+            context: 聚宽上下文对象
+            codes: 候选代码列表
+            prev_close: 昨收价（与 codes 对齐）
+            score: 竞价前可得的排序分（与 codes 对齐），默认全为1
+            value_per_stock: 每只股票的买入金额
+            slots: 最多买入只数
+        """
+        self.date = context.current_dt.date()
+        self.codes = np.asarray(list(codes), dtype=object)
+        self.prev_close = np.asarray(prev_close, dtype=float)
+        self.score = np.ones(len(self.codes)) if score is None else np.asarray(score, dtype=float)
+        self.value_per_stock = float(value_per_stock)
+        self.slots = int(slots)
+        self.fired = False
+
+    def staged(self, context):
+        """当日是否已备选且尚未触发"""
+        return self.date == context.current_dt.date() and not self.fired
+
+    # ==================== 触发 ====================
+
+    def filter(self, low, high, current_data=None):
+        """
+        向量化的开盘价过滤与排序
+
+        Returns:
+            tuple: (排序后的代码列表, 对应的开盘/昨收比值, 盘口快照 {code: (paused, last, high_limit, low_limit)})
+        """
+        n = len(self.codes)
+        if n == 0:
+            return [], np.empty(0), {}
+        current_data = current_data or get_current_data()
+        snap = np.full((n, 5), np.nan)
+        for i, c in enumerate(self.codes):
+            try:
+                cd = current_data[c]
+                snap[i] = (cd.day_open or np.nan, cd.last_price, cd.high_limit, cd.low_limit, cd.paused)
+            except Exception:
+                continue
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = snap[:, 0] / self.prev_close
+        mask = np.isfinite(ratio) & (ratio > low) & (ratio < high)
+        idx = np.flatnonzero(mask)
+        idx = idx[np.argsort(-(self.score[idx] * ratio[idx]), kind='stable')]
+        quotes = {self.codes[i]: (bool(snap[i, 4]), snap[i, 1], snap[i, 2], snap[i, 3]) for i in idx}
+        return self.codes[idx].tolist(), ratio[idx], quotes
+
+    def fire(self, context, low, high, auction_filter=None, send=None):
+        """
+        竞价后一次过滤并集中下单
+
+        Args:
+            context: 聚宽上下文对象
+            low/high: 开盘/昨收 比值的开区间
+            auction_filter: 可选的竞价盘口过滤 auction_filter(codes) -> codes（保持顺序）
+            send: 下单函数 send(code, value)，默认 order_value
+
+        Returns:
+            tuple: (过滤排序后的候选列表, [(code, order), ...] 实际下单)
+        """
+        started = time.perf_counter()
+        since_auction = self._since_auction(context)
+        self.fired = True
+        send = send or order_value
+
+        ranked, _, quotes = self.filter(low, high)
+        target = ranked
+        if auction_filter is not None and target:
+            target = auction_filter(target)
+        filtered = time.perf_counter()
+
+        sent = []
+        for c in target[:self.slots]:
+            paused, last, high_limit, low_limit = quotes[c]
+            if paused or last == low_limit or last == high_limit:
+                continue
+            sent.append((c, send(c, self.value_per_stock)))
+        done = time.perf_counter()
+
+        timing = {
+            'since_auction': since_auction,
+            'filter': (filtered - started) * 1000,
+            'submit': (done - filtered) * 1000,
+            'orders': len(sent),
+        }
+        self.timings.append(timing)
+        lead = f"竞价撮合后 {since_auction:.0f}ms 开始，" if since_auction is not None else ""
+        log.info(f"竞价下单：{lead}过滤 {timing['filter']:.1f}ms（候选 {len(self.codes)} -> {len(ranked)}），"
+                 f"下单 {timing['submit']:.1f}ms（{len(sent)} 笔）")
+        return ranked, sent
+
+    def _since_auction(self, context):
+        """实盘/模拟盘中竞价撮合到现在的毫秒数；回测（系统日期不是回测日期）返回 None"""
+        now = dt.datetime.now()
+        if now.date() != context.current_dt.date():
+            return None
+        auction = dt.datetime.combine(now.date(), dt.datetime.strptime(self.auction_time, '%H:%M').time())
+        return (now - auction).total_seconds() * 1000
+
+    # ==================== 统计 ====================
+
+    def stats(self):
+        """近期各段耗时 {段: (p50, max)}（毫秒）"""
+        out = {}
+        for key in ('since_auction', 'filter', 'submit'):
+            values = [t[key] for t in self.timings if t[key] is not None]
+            if values:
+                out[key] = (float(np.percentile(values, 50)), float(max(values)))
+        return out
+
+
+# 创建全局竞价下单预备实例
+auction_staging = AuctionStagingLib()
+
+# ==================== 导出函数 ====================
+
+def stage_auction_orders(context, codes, prev_close, score=None, value_per_stock=0.0, slots=0):
+    """竞价前备好候选、排序分与每只买入金额"""
+    auction_staging.stage(context, codes, prev_close, score, value_per_stock, slots)
+
+def auction_orders_staged(context):
+    """当日是否已备选且尚未触发"""
+    return auction_staging.staged(context)
+
+def fire_auction_orders(context, low, high, auction_filter=None, send=None):
+    """竞价后一次过滤并集中下单，返回 (候选列表, [(code, order), ...])"""
+    return auction_staging.fire(context, low, high, auction_filter, send)
+
+def auction_staging_stats():
+    """近期各段耗时 {段: (p50, max)}（毫秒）"""
+    return auction_staging.stats()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+聚宽多因子打分库 - 分档打分规则写成因子表，整表向量化计算并取前K只
+原综合打分用 df.iterrows() 逐行走 if/elif 阶梯，再对 Python 列表排序；
+全市场几千行时逐行开销远大于计算本身
+
+功能模块：
+1. 因子表
+   - factor(field, edges, points, right=False, positive=False, weight=1.0)
+     field   列名，或 func(df) -> 数组（例如负债率 = 总负债 / 总资产）
+     edges   分档边界（升序），points 比 edges 多一个，为各档得分
+     right   False：edges[i-1] <= x < edges[i]（"小于"阶梯）；True：edges[i-1] < x <= edges[i]（"大于"阶梯）
+     positive 为 True 时 x <= 0 不得分（例如 0 < PE < 15）
+     空值不得分
+   - COMPREHENSIVE_FACTORS  # ai_reference 综合基本面打分的规则（ROE/PE/营收增长/负债率/PB）
+
+2. 打分与取前K
+   - factor_points(df, factors)  # (行数, 因子数) 的各因子得分
+   - score_factors(df, factors, base=0)  # 加权总分 = base + sum(weight * 得分)
+   - top_k(scores, k)  # argpartition 取前K，总分相同按原行顺序（与稳定排序一致）
+   - select_by_factors(df, factors, k, code_col='code')  # 一步得到前K只的代码
+
+使用说明：
+1. 将本文件放在聚宽研究根目录
+2. 在策略中导入：from factor_score_lib import *
+3. select_by_factors(get_fundamentals(q), COMPREHENSIVE_FACTORS, 50)
+"""
+
+import numpy as np
+
+
+def factor(field, edges, points, right=False, positive=False, weight=1.0):
+    """
+    一条分档打分规则
+
+    Returns:
+        dict: 因子表中的一项
+    """
+    if len(points) != len(edges) + 1:
+        raise ValueError(f"因子 {field}: points 应比 edges 多一个")
+    return {'field': field, 'edges': np.asarray(edges, dtype=float), 'points': np.asarray(points, dtype=float),
+            'right': right, 'positive': positive, 'weight': weight}
+
+
+# 综合基本面打分（ai_reference/fundamental_strategies.comprehensive_fundamental_selection）
+COMPREHENSIVE_FACTORS = [
+    # ROE评分 (0-30分)：> 20 / > 15 / > 10
+    factor('roe', [10, 15, 20], [0, 10, 20, 30], right=True),
+    # PE评分 (0-20分)：0 < PE < 15 / 15 <= PE < 25 / 25 <= PE < 35
+    factor('pe_ratio', [15, 25, 35], [20, 15, 10, 0], positive=True),
+    # 营收增长评分 (0-20分)：> 30 / > 20 / > 10
+    factor('inc_revenue_year_on_year', [10, 20, 30], [0, 10, 15, 20], right=True),
+    # 负债率评分 (0-15分)：< 0.3 / < 0.5 / < 0.7
+    factor(lambda df: df['total_liability'] / df['total_assets'], [0.3, 0.5, 0.7], [15, 10, 5, 0]),
+    # PB评分 (0-15分)：0 < PB < 2 / 2 <= PB < 4 / 4 <= PB < 6
+    factor('pb_ratio', [2, 4, 6], [15, 10, 5, 0], positive=True),
+]
+
+
+def _values(df, field):
+    values = field(df) if callable(field) else df[field]
+    return np.asarray(values, dtype=float)
+
+
+def factor_points(df, factors):
+    """
+    各因子得分
+
+    Returns:
+        np.ndarray: (行数, 因子数)，未加权
+    """
+    out = np.zeros((len(df), len(factors)))
+    for j, f in enumerate(factors):
+        x = _values(df, f['field'])
+        points = f['points'][np.digitize(np.nan_to_num(x), f['edges'], right=f['right'])]
+        invalid = np.isnan(x)
+        if f['positive']:
+            with np.errstate(invalid='ignore'):
+                invalid |= x <= 0
+        out[:, j] = np.where(invalid, 0.0, points)
+    return out
+
+
+def score_factors(df, factors, base=0.0):
+    """加权总分：base + sum(weight * 因子得分)"""
+    weights = np.array([f['weight'] for f in factors], dtype=float)
+    return base + factor_points(df, factors) @ weights
+
+
+def top_k(scores, k):
+    """
+    总分最高的 k 个下标，从高到低；总分相同按原顺序
+
+    argpartition 找出第 k 高的分数，只对不低于它的行做稳定排序
+    """
+    scores = np.asarray(scores, dtype=float)
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        threshold = scores[np.argpartition(-scores, k - 1)[:k]].min()
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(-scores[candidates], kind='stable')][:k]
+
+
+def select_by_factors(df, factors, k, code_col='code', base=0.0):
+    """
+    按因子表打分并取前 k 只
+
+    Returns:
+        list: 代码列表（从高到低）
+    """
+    if df is None or len(df) == 0:
+        return []
+    scores = score_factors(df, factors, base)
+    return np.asarray(df[code_col])[top_k(scores, k)].tolist()
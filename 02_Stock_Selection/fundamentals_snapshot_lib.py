@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+"""
+聚宽基本面快照库 - 每个查询日期只取一次基本面宽表，query 的过滤/排序/limit 在本地数组上计算
+同一天里各子策略、各选股函数反复 get_fundamentals，查的是同一批股票同一天的重叠字段，
+每次都是一次远程查询；快照把用到的字段并集按表一次取回，之后的查询不再访问远程
+
+功能模块：
+1. 快照（按 (日期, 字段) 缓存）
+   - 每张表（valuation / indicator / income / balance / cash_flow ...）一次
+     get_fundamentals(query(表.code, 字段...), date) 取全部股票，按代码排序存为列数组
+   - 字段并集跨日保留：某天查过的字段，之后每天第一次查询时随表一起取回
+   - 新的一天第一次查询时取回并集内的全部表；当天出现新字段时只重取该表
+   - 只保留最近 keep 个日期的快照
+
+2. 本地执行 query
+   - 支持：比较 > >= < <= == !=、+ - * /、and_ / or_ / not_、in_ / notin_、between、
+     is_(None) / isnot(None)、label、order_by(asc/desc，可多列、可为表达式)、limit / offset
+   - 多表查询按代码内连接（与 get_fundamentals 一致，某张表没有数据的股票不出现）
+   - 空值按 SQL 三值逻辑：比较结果为空的行不通过过滤；除数为0结果为空；
+     升序空值在前、降序空值在后（与 MySQL 一致），排序相同时按代码顺序
+   - 没有 order_by 时按代码顺序返回（远程查询不保证顺序）
+   - 不支持的写法（整表实体、函数、未命名表达式、statDate 等）自动回退到远程 get_fundamentals
+
+3. 日期
+   - date 为 None 时与回测中 get_fundamentals 的默认日期相同：context.current_dt 的前一天，
+     需传入 context（或之前调用时传过）；从未传过 context 时直接走远程查询
+
+使用说明：
+1. 将本文件放在聚宽研究根目录
+2. 在策略中导入：from fundamentals_snapshot_lib import *
+3. 把 get_fundamentals(q) 换成 cached_fundamentals(q, context=context)，
+   get_fundamentals(q, date=d) 换成 cached_fundamentals(q, d)
+4. 远程查询单次最多返回 ROW_LIMIT 行；某张表取满时该表的查询回退到远程
+"""
+
+# 聚宽API导入
+try:
+    from kuanke.user_space_api import *
+except:
+    pass
+
+import datetime
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.sql import elements, operators
+
+ROW_LIMIT = 10000
+
+_COMPARE = {operators.gt, operators.ge, operators.lt, operators.le, operators.eq, operators.ne}
+_ARITH = {operators.add, operators.sub, operators.mul, operators.truediv}
+_IN = {getattr(operators, name) for name in ('in_op',) if hasattr(operators, name)}
+_NOT_IN = {getattr(operators, name) for name in ('notin_op', 'not_in_op') if hasattr(operators, name)}
+_IS = {getattr(operators, name) for name in ('is_',) if hasattr(operators, name)}
+_IS_NOT = {getattr(operators, name) for name in ('isnot', 'is_not') if hasattr(operators, name)}
+
+
+class _Unsupported(Exception):
+    """query 中有本地不能执行的写法，回退到远程"""
+
+
+def _known(x):
+    """非空掩码（标量返回 bool）"""
+    if isinstance(x, np.ndarray):
+        return ~np.isnan(x) if x.dtype.kind == 'f' else pd.notna(x)
+    return x is not None and not (isinstance(x, float) and np.isnan(x))
+
+
+def _truth(mask, known):
+    """布尔结果 -> 三值（1.0 / 0.0 / NaN）"""
+    return np.where(known, np.asarray(mask, dtype=float), np.nan)
+
+
+def _and(a, b):
+    return np.where((a == 0) | (b == 0), 0.0, np.where(np.isnan(a) | np.isnan(b), np.nan, 1.0))
+
+
+def _or(a, b):
+    return np.where((a == 1) | (b == 1), 1.0, np.where(np.isnan(a) | np.isnan(b), np.nan, 0.0))
+
+
+def _float(x):
+    return np.asarray(np.nan if x is None else x, dtype=float)
+
+
+def _sort_key(values, descending):
+    """lexsort 用的升序键：空值最小（升序在前、降序在后）"""
+    if values.dtype.kind == 'f':
+        key = np.where(np.isnan(values), -np.inf, values)
+    else:
+        key = pd.Series(values).rank(method='dense', na_option='top').values
+    return -key if descending else key
+
+
+class _Query:
+    """从 SQLAlchemy Query 中拆出的输出列、过滤条件、排序与 limit"""
+
+    def __init__(self, q):
+        # 模型类：{表名: 类}，部分版本 statement 的输出列不带 ORM 注解，从 column_descriptions 取
+        self.models = {d['entity'].__table__.name: d['entity'] for d in q.column_descriptions
+                       if isinstance(d.get('entity'), type) and hasattr(d['entity'], '__table__')}
+        if any(isinstance(d.get('expr'), type) for d in q.column_descriptions):
+            raise _Unsupported('不支持整表实体')
+        stmt = q.statement
+        self.outputs = []
+        for el in getattr(stmt, '_raw_columns', None) or list(stmt.inner_columns):
+            name = el.name if isinstance(el, elements.Label) else getattr(el, 'key', None)
+            if not name or (not isinstance(el, elements.Label) and getattr(el, 'table', None) is None):
+                raise _Unsupported('输出列必须是字段或 label')
+            self.outputs.append((name, el))
+        self.where = stmt.whereclause if hasattr(stmt, 'whereclause') else stmt._whereclause
+        self.order_by = []
+        for el in stmt._order_by_clause.clauses:
+            descending = False
+            if isinstance(el, elements.UnaryExpression) and el.modifier in (operators.asc_op, operators.desc_op):
+                descending = el.modifier is operators.desc_op
+                el = el.element
+            self.order_by.append((el, descending))
+        self.limit = stmt._limit
+        self.offset = stmt._offset or 0
+
+    def elements(self):
+        yield from (el for _, el in self.outputs)
+        if self.where is not None:
+            yield self.where
+        yield from (el for el, _ in self.order_by)
+
+    def _walk(self, el, found):
+        if isinstance(el, elements.ColumnClause) and getattr(el, 'table', None) is not None:
+            found.setdefault(el.table.name, {})[el.key] = el
+            mapper = el._annotations.get('parentmapper')
+            if mapper is not None:
+                self.models.setdefault(el.table.name, mapper.class_)
+            return
+        if isinstance(el, elements.BinaryExpression) and (el.operator in _IN or el.operator in _NOT_IN):
+            children = [el.left]          # 不遍历 in_ 的候选列表
+        else:
+            children = el.get_children()
+        for child in children:
+            self._walk(child, found)
+
+    def columns(self):
+        """引用到的字段：{表名: {字段名: 字段}}"""
+        found = {}
+        for root in self.elements():
+            self._walk(root, found)
+        if not found:
+            raise _Unsupported('没有引用任何表')
+        return found
+
+
+class FundamentalsSnapshot:
+    """
+    按日期缓存的基本面列数组，本地执行 query
+    """
+
+    def __init__(self, keep=3):
+        """
+        Args:
+            keep: 保留的快照日期数
+        """
+        self.keep = keep
+        self.context = None
+        self.fields = {}          # 表名 -> {字段名: ORM 字段}，各日共用的字段并集
+        self.models = {}          # 表名 -> 模型类（valuation、indicator ...）
+        self.days = OrderedDict() # 日期 -> {'tables': {表名: 列数组}, 'joins': {表组合: (代码, 各表下标)}}
+        self.remote = 0           # 为建快照发出的 get_fundamentals 次数
+        self.local = 0            # 本地执行的查询次数
+        self.fallback = 0         # 回退到远程的查询次数
+
+    def _resolve(self, date, context):
+        if context is not None:
+            self.context = context
+        if date is not None:
+            return str(pd.Timestamp(date).date())
+        if self.context is None:
+            return None
+        return str(self.context.current_dt.date() - datetime.timedelta(days=1))
+
+    def register(self, column):
+        """
+        把字段加入并集（取数时用模型类属性，与策略里写的 valuation.xxx 相同）
+
+        Returns:
+            bool: 是否为新字段
+        """
+        if hasattr(column, '__clause_element__'):
+            column = column.__clause_element__()
+        mapper = column._annotations.get('parentmapper')
+        model = mapper.class_ if mapper is not None else self.models.get(column.table.name)
+        field = getattr(model, column.key, None)
+        if field is None or not hasattr(model, 'code'):
+            raise _Unsupported('不是基本面表字段')
+        self.models.setdefault(column.table.name, model)
+        fields = self.fields.setdefault(column.table.name, {'code': model.code})
+        if column.key in fields:
+            return False
+        fields[column.key] = field
+        return True
+
+    def _fetch(self, date, table):
+        fields = self.fields[table]
+        others = [f for key, f in fields.items() if key != 'code']
+        df = get_fundamentals(query(fields['code'], *others), date=date)
+        self.remote += 1
+        df = df.drop_duplicates('code').sort_values('code')
+        return {
+            'codes': np.asarray(df['code'], dtype=object),
+            'values': {key: df[key].values for key in fields if key in df.columns},
+            'complete': len(df) < ROW_LIMIT,
+        }
+
+    def _day(self, date, needed):
+        """date 的快照，保证 needed 中的字段都已取回"""
+        changed = set()
+        for table, columns in needed.items():
+            for column in columns.values():
+                if self.register(column):
+                    changed.add(table)
+        day = self.days.get(date)
+        if day is None:
+            day = {'tables': {t: self._fetch(date, t) for t in self.fields}, 'joins': {}}
+            self.days[date] = day
+            while len(self.days) > self.keep:
+                self.days.popitem(last=False)
+        else:
+            for table in changed | (set(needed) - set(day['tables'])):
+                day['tables'][table] = self._fetch(date, table)
+                day['joins'] = {}
+        return day
+
+    @staticmethod
+    def _join(day, tables):
+        """多表按代码内连接：(代码, {表名: 各表中的行下标})"""
+        key = frozenset(tables)
+        if key not in day['joins']:
+            codes = None
+            for t in tables:
+                t_codes = day['tables'][t]['codes']
+                codes = t_codes if codes is None else np.intersect1d(codes, t_codes)
+            index = {t: pd.Index(day['tables'][t]['codes']).get_indexer(codes) for t in tables}
+            day['joins'][key] = (np.asarray(codes, dtype=object), index)
+        return day['joins'][key]
+
+    def query(self, q, date=None, context=None):
+        """
+        与 get_fundamentals(q, date) 相同的结果，能本地执行时不访问远程
+
+        Returns:
+            pd.DataFrame
+        """
+        date = self._resolve(date, context)
+        try:
+            if date is None:
+                raise _Unsupported('没有日期')
+            parsed = _Query(q)
+            needed = parsed.columns()
+            for table, model in parsed.models.items():
+                self.models.setdefault(table, model)
+            day = self._day(date, needed)
+            if not all(day['tables'][t]['complete'] for t in needed):
+                raise _Unsupported('快照不完整')
+            codes, index = self._join(day, needed)
+            result = _Evaluator(day['tables'], index, len(codes)).run(parsed)
+        except _Unsupported:
+            self.fallback += 1
+            return get_fundamentals(q, date=date)
+        self.local += 1
+        return result
+
+    def stats(self):
+        return {'remote': self.remote, 'local': self.local, 'fallback': self.fallback,
+                'days': list(self.days), 'fields': {t: sorted(f) for t, f in self.fields.items()}}
+
+
+class _Evaluator:
+    """在连接后的列数组上计算 query 的表达式"""
+
+    def __init__(self, tables, index, n):
+        self.tables = tables
+        self.index = index
+        self.n = n
+
+    def column(self, el):
+        table = self.tables[el.table.name]
+        values = table['values'][el.key]
+        if values.dtype.kind in 'iub':
+            values = values.astype(float)
+        return values[self.index[el.table.name]]
+
+    def values_list(self, el):
+        """in_ / between 的取值列表（新版本为一个 expanding 参数，旧版本为逐个参数的列表）"""
+        while isinstance(el, elements.Grouping):
+            el = el.element
+        if isinstance(el, elements.BindParameter):
+            value = el.effective_value
+            return list(value) if isinstance(value, (list, tuple, set)) else [value]
+        if not isinstance(el, elements.ClauseList):
+            raise _Unsupported(type(el).__name__)
+        values = []
+        for clause in el.clauses:
+            if isinstance(clause, elements.BindParameter):
+                values.append(clause.effective_value)
+            else:
+                values.extend(self.values_list(clause))
+        return values
+
+    def eval(self, el):
+        if isinstance(el, (elements.Grouping, elements.Label)):
+            return self.eval(el.element)
+        if isinstance(el, elements.BindParameter):
+            return el.effective_value
+        if isinstance(el, elements.Null):
+            return None
+        if isinstance(el, elements.True_):
+            return np.ones(self.n)
+        if isinstance(el, elements.False_):
+            return np.zeros(self.n)
+        if isinstance(el, elements.ColumnClause) and getattr(el, 'table', None) is not None:
+            return self.column(el)
+        if isinstance(el, elements.BooleanClauseList):
+            combine = {operators.and_: _and, operators.or_: _or}.get(el.operator)
+            if combine is None:
+                raise _Unsupported(str(el.operator))
+            result = None
+            for clause in el.clauses:
+                value = self.predicate(clause)
+                result = value if result is None else combine(result, value)
+            return result if result is not None else np.ones(self.n)
+        if isinstance(el, elements.UnaryExpression):
+            if el.operator is operators.inv:
+                return 1.0 - self.predicate(el.element)
+            if el.operator is operators.neg:
+                return -_float(self.eval(el.element))
+            raise _Unsupported(str(el.operator or el.modifier))
+        if isinstance(el, elements.BinaryExpression):
+            return self.binary(el)
+        raise _Unsupported(type(el).__name__)
+
+    def predicate(self, el):
+        """过滤条件 -> 三值数组"""
+        value = self.eval(el)
+        if not isinstance(value, np.ndarray) or value.dtype.kind != 'f' or value.shape != (self.n,):
+            raise _Unsupported('不是比较表达式')
+        return value
+
+    def binary(self, el):
+        op = el.operator
+        if op in _IN or op in _NOT_IN:
+            left = self.eval(el.left)
+            hit = pd.Series(left).isin(self.values_list(el.right)).values
+            return _truth(hit if op in _IN else ~hit, _known(left))
+        if op is operators.between_op:
+            low, high = self.values_list(el.right)
+            left = _float(self.eval(el.left))
+            with np.errstate(invalid='ignore'):
+                return _truth((left >= low) & (left <= high), _known(left) & _known(low) & _known(high))
+        if op in _IS or op in _IS_NOT:
+            if not isinstance(el.right, elements.Null):
+                raise _Unsupported('只支持 is_(None)')
+            known = _known(self.eval(el.left))
+            return np.asarray(~known if op in _IS else known, dtype=float)
+        left, right = self.eval(el.left), self.eval(el.right)
+        if op in _ARITH:
+            left, right = _float(left), _float(right)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                if op is operators.truediv:
+                    return np.where(right == 0, np.nan, left / right)
+                return op(left, right)
+        if op in _COMPARE:
+            known = np.broadcast_to(_known(left) & _known(right), (self.n,))
+            mask = np.zeros(self.n, dtype=bool)
+            if known.any():
+                pick = lambda x: x[known] if isinstance(x, np.ndarray) else x
+                mask[known] = op(pick(left), pick(right))
+            return _truth(mask, known)
+        raise _Unsupported(str(op))
+
+    def run(self, parsed):
+        rows = np.arange(self.n)
+        if parsed.where is not None:
+            rows = np.flatnonzero(self.predicate(parsed.where) == 1)
+        if parsed.order_by:
+            keys = [_sort_key(np.broadcast_to(self.eval(el), (self.n,))[rows], desc)
+                    for el, desc in parsed.order_by]
+            rows = rows[np.lexsort(keys[::-1])]
+        stop = None if parsed.limit is None else parsed.offset + parsed.limit
+        rows = rows[parsed.offset:stop]
+        return pd.DataFrame(OrderedDict(
+            (name, np.broadcast_to(self.eval(el), (self.n,))[rows]) for name, el in parsed.outputs))
+
+
+# 创建全局基本面快照实例
+fundamentals_snapshot = FundamentalsSnapshot()
+
+# ==================== 导出函数 ====================
+
+def cached_fundamentals(q, date=None, context=None):
+    """get_fundamentals 的快照版本；date 为 None 时用 context.current_dt 的前一天"""
+    return fundamentals_snapshot.query(q, date, context)
+
+def require_fundamentals(*fields):
+    """预先登记字段（如 valuation.pe_ratio），当天第一次查询时一并取回"""
+    for field in fields:
+        fundamentals_snapshot.register(field)
+
+def fundamentals_snapshot_stats():
+    """远程取数次数、本地执行次数、回退次数、缓存的日期与字段"""
+    return fundamentals_snapshot.stats()
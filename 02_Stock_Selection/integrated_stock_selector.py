@@ -6,6 +6,9 @@
 
 # 导入通知库
 from notification_lib import *
+# 导入多因子打分库与宽表库
+from factor_score_lib import *
+from price_panel_lib import price_panel
 
 import pandas as pd
 import numpy as np
@@ -167,42 +170,29 @@ def run_multi_factor_selection(context):
         # TODO: 在这里实现您的多因子选股逻辑
         # 参考 ai_reference/ 文件夹中的策略示例
         
-        # 示例：获取所有A股
-        all_stocks = list(get_all_securities(['stock']).index)
-        
-        # 示例：简单的多因子评分
-        stock_scores = []
-        for stock in all_stocks[:100]:  # 只处理前100只作为示例
-            try:
-                # 获取基本信息
-                stock_info = get_security_info(stock)
-                if not stock_info.display_name:
-                    continue
-                
-                # 简单的评分逻辑示例
-                score = 50  # 基础分
-                
-                # 获取历史数据
-                hist = get_price(stock, count=20, frequency='daily', fields=['close'])
-                if len(hist) >= 20:
-                    # 价格动量因子
-                    price_change = (hist['close'][-1] - hist['close'][-20]) / hist['close'][-20]
-                    if price_change > 0:
-                        score += 20
-                    
-                    # 波动率因子
-                    returns = hist['close'].pct_change().dropna()
-                    volatility = returns.std()
-                    if volatility < 0.05:  # 低波动
-                        score += 10
-                
-                stock_scores.append((stock, score))
-            except:
-                continue
-        
-        # 按评分排序
-        stock_scores.sort(key=lambda x: x[1], reverse=True)
-        selected_stocks = [stock for stock, score in stock_scores[:10]]
+        # 示例：获取所有A股（剔除没有名称的）
+        securities = get_all_securities(['stock'])
+        all_stocks = [c for c, name in zip(securities.index, securities['display_name']) if name]
+        
+        # 示例：一次取全部股票近20日收盘价，因子整表计算
+        panel = price_panel(all_stocks, None, 20, ['close']).compact().reindex(all_stocks)
+        close = panel['close']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            returns = close[1:] / close[:-1] - 1
+            factors_df = pd.DataFrame({
+                'code': all_stocks,
+                'price_change': (close[-1] - close[-20]) / close[-20],  # 价格动量因子
+                'volatility': np.nanstd(returns, axis=0, ddof=1),      # 波动率因子
+            })
+        # 数据不足20日的股票只有基础分
+        factors_df.loc[panel.rows < 20, ['price_change', 'volatility']] = np.nan
+        
+        # 简单的评分逻辑示例：基础分50，上涨 +20，低波动 +10
+        factor_table = [
+            factor('price_change', [0], [0, 20], right=True),
+            factor('volatility', [0.05], [10, 0]),
+        ]
+        selected_stocks = select_by_factors(factors_df, factor_table, 10, base=50)
         
         # 获取股票详细信息
         stock_details = get_stock_details(selected_stocks)
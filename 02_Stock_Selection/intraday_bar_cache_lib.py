@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+聚宽盘中分钟线缓存库 - 每日环形缓冲区
+盘中反复需要"开盘以来累计成交量 / 开盘以来最高价 / 近N分钟最高价"时，
+不再每次从开盘拉取全部分钟线，而是只增量拉取上次之后的新bar
+
+功能模块：
+1. 增量更新
+   - update_bar_cache(context, codes)  # 一次 get_bars 批量拉取新bar，跨日自动清空
+   - update_bar_cache(context, codes, include_now=True)  # 同时取当前未走完的bar（只读叠加，不写入缓冲区）
+
+2. O(1) 查询
+   - bar_cum_volume(code)  # 开盘以来累计成交量
+   - bar_day_high(code)  # 开盘以来最高价
+   - bar_high_n(code, n)  # 近n分钟最高价（n 在 windows 中登记时为 O(1)，否则扫描环形缓冲区）
+
+实现说明：
+- 每只证券一行环形缓冲区（默认容量240，即一个交易日的分钟数），按分钟序号写入
+- 累计成交量、当日最高价随写入滚动更新
+- 登记窗口的近N分钟最高价用单调队列维护，写入摊还 O(1)，查询 O(1)
+- 只把已完成的分钟bar写入缓冲区，避免未走完的bar重复计量；
+  include_now=True 时当前bar单独保存，每次更新整体替换，查询时叠加在已完成的bar之上
+
+使用说明：
+1. 将本文件放在聚宽研究根目录
+2. 在策略中导入：from intraday_bar_cache_lib import *
+3. 查询前先 update_bar_cache(context, codes)
+"""
+
+# 聚宽API导入
+try:
+    from kuanke.user_space_api import *
+except:
+    pass
+
+from collections import deque
+
+import numpy as np
+
+# 交易日分钟数（上午120 + 下午120）
+MINUTES_PER_DAY = 240
+
+
+def minute_of_day(t):
+    """
+    分钟bar时间 -> 当日分钟序号（09:31 为 1，11:30 为 120，13:01 为 121，15:00 为 240）
+    """
+    m = t.hour * 60 + t.minute
+    if m <= 11 * 60 + 30:
+        return max(0, min(m - (9 * 60 + 30), 120))
+    return max(120, min(m - 13 * 60 + 120, MINUTES_PER_DAY))
+
+
+class IntradayBarCache:
+    """
+    盘中分钟线环形缓存
+    """
+
+    def __init__(self, capacity=MINUTES_PER_DAY, windows=(5,)):
+        """
+        Args:
+            capacity: 每只证券保留的分钟bar数量
+            windows: 需要 O(1) 查询的近N分钟最高价窗口
+        """
+        self.capacity = capacity
+        self.windows = tuple(windows)
+        self.reset(None)
+
+    def reset(self, day):
+        """
+        清空缓存并切换到新的交易日
+        """
+        self.day = day
+        self.index = {}                                            # code -> 行号
+        self._high = np.zeros((0, self.capacity), dtype=np.float64)  # 环形缓冲区：分钟最高价
+        self._volume = np.zeros((0, self.capacity), dtype=np.float64)  # 环形缓冲区：分钟成交量
+        self._last = np.zeros(0, dtype=np.int64)                   # 已写入的最后分钟序号
+        self._cum_volume = np.zeros(0, dtype=np.float64)           # 开盘以来累计成交量
+        self._day_high = np.zeros(0, dtype=np.float64)             # 开盘以来最高价
+        self._now_high = np.zeros(0, dtype=np.float64)             # 当前未走完bar的最高价
+        self._now_volume = np.zeros(0, dtype=np.float64)           # 当前未走完bar的成交量
+        self._queues = {n: [] for n in self.windows}               # 窗口 -> 每行一个单调队列
+
+    def _add_rows(self, codes):
+        new = [c for c in codes if c not in self.index]
+        if not new:
+            return
+        n = len(new)
+        for c in new:
+            self.index[c] = len(self.index)
+        self._high = np.vstack([self._high, np.zeros((n, self.capacity))])
+        self._volume = np.vstack([self._volume, np.zeros((n, self.capacity))])
+        self._last = np.concatenate([self._last, np.zeros(n, dtype=np.int64)])
+        self._cum_volume = np.concatenate([self._cum_volume, np.zeros(n)])
+        self._day_high = np.concatenate([self._day_high, np.zeros(n)])
+        self._now_high = np.concatenate([self._now_high, np.zeros(n)])
+        self._now_volume = np.concatenate([self._now_volume, np.zeros(n)])
+        for q in self._queues.values():
+            q.extend(deque() for _ in range(n))
+
+    # ==================== 写入 ====================
+
+    def ingest(self, code, minute, high, volume):
+        """
+        写入一根分钟bar（分钟序号不大于已写入序号时忽略）
+
+        Args:
+            code: 证券代码
+            minute: 当日分钟序号，见 minute_of_day
+            high: 分钟最高价
+            volume: 分钟成交量
+        """
+        self._add_rows([code])
+        i = self.index[code]
+        if minute <= self._last[i]:
+            return
+        slot = (minute - 1) % self.capacity
+        self._high[i, slot] = high
+        self._volume[i, slot] = volume
+        self._last[i] = minute
+        # 已完成的bar写入后，之前保存的当前bar作废
+        self._set_now(i, 0.0, 0.0)
+        self._cum_volume[i] += volume
+        if high > self._day_high[i]:
+            self._day_high[i] = high
+        for n, queues in self._queues.items():
+            q = queues[i]
+            while q and q[-1][1] <= high:
+                q.pop()
+            q.append((minute, high))
+            while q[0][0] <= minute - n:
+                q.popleft()
+
+    def update(self, context, codes, include_now=False):
+        """
+        增量拉取 codes 自上次写入之后的已完成分钟bar
+
+        Args:
+            context: 聚宽上下文对象
+            codes: 证券列表
+            include_now: 是否同时取当前未走完的bar（如盘中突破参考价需要包含当前bar）
+        """
+        today = context.current_dt.date()
+        if self.day != today:
+            self.reset(today)
+        codes = list(codes)
+        if not codes:
+            return
+        self._add_rows(codes)
+
+        now_minute = minute_of_day(context.current_dt)
+        if include_now:
+            # 当前bar每次都要重取
+            stale = codes
+            for c in codes:
+                self._set_now(self.index[c], 0.0, 0.0)
+        else:
+            stale = [c for c in codes if self._last[self.index[c]] < now_minute]
+        if not stale:
+            return
+        # 需要补拉的bar数量：取落后最多的证券，多拉1根兜底（含当前bar时再多1根），已写入的按分钟序号忽略
+        count = now_minute - min(int(self._last[self.index[c]]) for c in stale) + 1 + int(include_now)
+
+        bars = get_bars(stale, count=min(count, self.capacity), unit='1m',
+                        fields=['date', 'high', 'volume'], include_now=include_now, df=False)
+        if not isinstance(bars, dict):
+            bars = {stale[0]: bars}
+        for c, arr in bars.items():
+            if arr is None or len(arr) == 0:
+                continue
+            rows = [row for row in arr
+                    if not (hasattr(row['date'], 'date') and row['date'].date() != today)]
+            # include_now 时最后一根为当前未走完的bar，不写入缓冲区
+            now_row = rows.pop() if include_now and rows else None
+            for row in rows:
+                self.ingest(c, minute_of_day(row['date']), float(row['high']), float(row['volume']))
+            if now_row is not None and minute_of_day(now_row['date']) > self._last[self.index[c]]:
+                self._set_now(self.index[c], float(now_row['high']), float(now_row['volume']))
+
+    def _set_now(self, i, high, volume):
+        self._now_high[i] = high
+        self._now_volume[i] = volume
+
+    # ==================== 查询 ====================
+
+    def cum_volume(self, code):
+        """开盘以来累计成交量"""
+        i = self.index.get(code)
+        return 0.0 if i is None else float(self._cum_volume[i] + self._now_volume[i])
+
+    def day_high(self, code):
+        """开盘以来最高价"""
+        i = self.index.get(code)
+        return 0.0 if i is None else float(max(self._day_high[i], self._now_high[i]))
+
+    def high_n(self, code, n):
+        """
+        近n分钟最高价（相对最后写入的bar）
+        """
+        i = self.index.get(code)
+        if i is None or self._last[i] == 0:
+            return 0.0
+        if n in self._queues:
+            q = self._queues[n][i]
+            return float(q[0][1]) if q else 0.0
+        last = int(self._last[i])
+        n = min(n, last, self.capacity)
+        slots = (np.arange(last - n, last)) % self.capacity
+        return float(self._high[i, slots].max())
+
+
+# 创建全局缓存实例
+intraday_bar_cache = IntradayBarCache()
+
+# ==================== 导出函数 ====================
+
+def update_bar_cache(context, codes, include_now=False):
+    """增量拉取 codes 的新分钟bar（include_now=True 时包含当前未走完的bar）"""
+    intraday_bar_cache.update(context, codes, include_now)
+
+def bar_cum_volume(code):
+    """开盘以来累计成交量"""
+    return intraday_bar_cache.cum_volume(code)
+
+def bar_day_high(code):
+    """开盘以来最高价"""
+    return intraday_bar_cache.day_high(code)
+
+def bar_high_n(code, n):
+    """近n分钟最高价"""
+    return intraday_bar_cache.high_n(code, n)
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+聚宽盘中触发器库 - 事件驱动的盘中调度
+把 every_bar 轮询改为"价格触发"：策略登记价格阈值，只有命中时才回调
+
+功能模块：
+1. 触发器登记
+   - register_trigger(code, op, level, callback)  # 价格阈值触发（<=, >=, <, >）
+   - register_drawdown_trigger(code, ratio, callback)  # 从最高价回撤触发
+   - cancel_triggers(code)  # 撤销某只股票的全部触发器
+
+2. 行情驱动
+   - on_trigger_bar(context)  # 在 every_bar 回调中调用，批量检查阈值
+   - feed_trigger_prices(context, codes, prices)  # 直接喂入一批价格（测试/回放用）
+
+实现说明：
+- 所有触发器按"证券索引 + 阈值"平铺成对齐的 numpy 数组，每根bar只做一次向量比较
+- level 可以是数字，也可以是 'low_limit' / 'high_limit'，涨跌停价每日只读取一次
+- 没有登记任何触发器时 on_trigger_bar 直接返回，不访问行情
+
+使用说明：
+1. 将本文件放在聚宽研究根目录
+2. 在策略中导入：from intraday_trigger_lib import *
+3. 每日开盘后登记触发器，run_daily(xxx, time='every_bar') 中调用 on_trigger_bar(context)
+
+示例：
+# 跌停打开卖出
+register_trigger(stock, '<=', 'low_limit', on_hit_low_limit, name='跌停')
+
+def on_hit_low_limit(context, code, hit):
+    register_trigger(code, '>', 'low_limit', on_open_low_limit, name='跌停打开')
+"""
+
+# 聚宽API导入
+try:
+    from kuanke.user_space_api import *
+except:
+    pass
+
+import numpy as np
+
+# 比较类型编码
+OP_LE = 0
+OP_GE = 1
+OP_LT = 2
+OP_GT = 3
+OP_DRAWDOWN = 4
+
+_OP_CODES = {'<=': OP_LE, '>=': OP_GE, '<': OP_LT, '>': OP_GT}
+
+# 阈值引用的涨跌停字段（-1 表示常数阈值）
+_LEVEL_FIELDS = ['low_limit', 'high_limit']
+
+
+class IntradayTriggerLib:
+    """
+    盘中触发器调度器
+    """
+
+    def __init__(self):
+        """
+        初始化触发器调度器
+        """
+        self.reset()
+
+    def reset(self):
+        """
+        清空全部触发器和当日缓存（每日开盘前调用）
+        """
+        self.triggers = {}        # trigger_id -> 触发器描述
+        self._next_id = 1
+        self._dirty = True
+        self._limit_day = None    # 涨跌停价缓存对应的日期
+        self._limits = {}         # code -> (low_limit, high_limit)
+        self._build_index()
+
+    # ==================== 触发器登记 ====================
+
+    def register(self, code, op, level, callback, name=None, once=True):
+        """
+        登记价格阈值触发器
+
+        Args:
+            code: 证券代码
+            op: 比较符 '<=', '>=', '<', '>'
+            level: 阈值，数字或 'low_limit' / 'high_limit'
+            callback: 命中回调 callback(context, code, hit)
+            name: 触发器名称（日志用）
+            once: 命中一次后是否自动撤销
+
+        Returns:
+            int: 触发器ID
+        """
+        if op not in _OP_CODES:
+            raise ValueError(f"不支持的比较符: {op}")
+        if isinstance(level, str) and level not in _LEVEL_FIELDS:
+            raise ValueError(f"不支持的阈值字段: {level}")
+        return self._add(code, _OP_CODES[op], level, callback, name, once)
+
+    def register_drawdown(self, code, ratio, callback, high=0.0, name=None, once=True):
+        """
+        登记回撤触发器：最新价 <= 登记后最高价 * (1 - ratio)
+
+        Args:
+            code: 证券代码
+            ratio: 回撤比例，例如 0.07
+            callback: 命中回调 callback(context, code, hit)
+            high: 初始最高价（例如持仓以来的最高价）
+            name: 触发器名称
+            once: 命中一次后是否自动撤销
+        """
+        return self._add(code, OP_DRAWDOWN, float(ratio), callback, name, once, high=float(high))
+
+    def _add(self, code, op, level, callback, name, once, high=0.0):
+        tid = self._next_id
+        self._next_id += 1
+        self.triggers[tid] = {
+            'id': tid,
+            'code': code,
+            'op': op,
+            'level': level,
+            'callback': callback,
+            'name': name or code,
+            'once': once,
+            'high': high,
+        }
+        self._dirty = True
+        return tid
+
+    def cancel(self, trigger_id):
+        """撤销单个触发器"""
+        if self.triggers.pop(trigger_id, None) is not None:
+            self._dirty = True
+
+    def cancel_code(self, code):
+        """撤销某只证券的全部触发器"""
+        ids = [tid for tid, t in self.triggers.items() if t['code'] == code]
+        for tid in ids:
+            del self.triggers[tid]
+        if ids:
+            self._dirty = True
+
+    def watched_codes(self):
+        """当前有触发器的证券列表"""
+        if self._dirty:
+            self._build_index()
+        return list(self.codes)
+
+    # ==================== 阈值索引 ====================
+
+    def _build_index(self):
+        """
+        把触发器字典平铺成对齐数组：
+        codes        - 需要取价的证券（去重）
+        _sec         - 每个触发器对应的证券下标
+        _op/_const   - 比较类型与常数阈值
+        _field       - 阈值引用的涨跌停字段下标（-1 为常数）
+        _high        - 回撤触发器的最高价
+        """
+        items = list(self.triggers.values())
+        codes = sorted({t['code'] for t in items})
+        self.codes = codes
+        self.code_index = {c: i for i, c in enumerate(codes)}
+
+        n = len(items)
+        self._tid = np.fromiter((t['id'] for t in items), dtype=np.int64, count=n)
+        self._sec = np.fromiter((self.code_index[t['code']] for t in items), dtype=np.int64, count=n)
+        self._op = np.fromiter((t['op'] for t in items), dtype=np.int8, count=n)
+        self._field = np.fromiter(
+            (_LEVEL_FIELDS.index(t['level']) if isinstance(t['level'], str) else -1 for t in items),
+            dtype=np.int8, count=n)
+        self._const = np.fromiter(
+            (0.0 if isinstance(t['level'], str) else float(t['level']) for t in items),
+            dtype=np.float64, count=n)
+        self._high = np.fromiter((t['high'] for t in items), dtype=np.float64, count=n)
+        self._dirty = False
+
+    def _sync_highs(self):
+        """把回撤触发器的最高价写回触发器字典，重建索引时不丢失"""
+        for tid, high in zip(self._tid[self._op == OP_DRAWDOWN], self._high[self._op == OP_DRAWDOWN]):
+            t = self.triggers.get(int(tid))
+            if t is not None:
+                t['high'] = float(high)
+
+    # ==================== 行情驱动 ====================
+
+    def _load_limits(self, context, codes):
+        """涨跌停价当日不变，每日每只证券只读取一次"""
+        today = context.current_dt.date()
+        if self._limit_day != today:
+            self._limit_day = today
+            self._limits = {}
+        missing = [c for c in codes if c not in self._limits]
+        if missing:
+            current_data = get_current_data()
+            for c in missing:
+                cd = current_data[c]
+                self._limits[c] = (float(cd.low_limit), float(cd.high_limit))
+
+    def on_bar(self, context):
+        """
+        每根bar调用一次：只读取有触发器的证券价格，批量比较阈值
+
+        Returns:
+            list: 本bar命中的触发器列表
+        """
+        if not self.triggers:
+            return []
+        if self._dirty:
+            self._build_index()
+
+        current_data = get_current_data()
+        prices = np.empty(len(self.codes), dtype=np.float64)
+        for i, c in enumerate(self.codes):
+            cd = current_data[c]
+            # 停牌不触发
+            prices[i] = np.nan if cd.paused else cd.last_price
+        return self.feed(context, prices)
+
+    def feed(self, context, prices, codes=None):
+        """
+        喂入一批价格并执行命中的回调
+
+        Args:
+            context: 聚宽上下文对象
+            prices: 与 codes 对齐的最新价数组
+            codes: 价格对应的证券列表，默认为 watched_codes() 的顺序
+
+        Returns:
+            list: 本bar命中的触发器列表
+        """
+        if not self.triggers:
+            return []
+        if self._dirty:
+            self._build_index()
+        if codes is not None and list(codes) != self.codes:
+            lookup = dict(zip(codes, prices))
+            prices = [lookup.get(c, np.nan) for c in self.codes]
+        prices = np.asarray(prices, dtype=np.float64)
+
+        # 阈值：常数直接取，涨跌停字段按证券展开
+        level = self._const.copy()
+        use_field = self._field >= 0
+        if use_field.any():
+            self._load_limits(context, self.codes)
+            limits = np.array([self._limits[c] for c in self.codes], dtype=np.float64).reshape(-1, 2)
+            level[use_field] = limits[self._sec[use_field], self._field[use_field]]
+
+        p = prices[self._sec]
+        valid = ~np.isnan(p)
+        p_safe = np.where(valid, p, 0.0)
+
+        # 回撤触发器：先更新最高价再比较
+        is_dd = self._op == OP_DRAWDOWN
+        if is_dd.any():
+            self._high[is_dd & valid] = np.maximum(self._high[is_dd & valid], p_safe[is_dd & valid])
+
+        hit = np.select(
+            [self._op == OP_LE, self._op == OP_GE, self._op == OP_LT, self._op == OP_GT, is_dd],
+            [p_safe <= level, p_safe >= level, p_safe < level, p_safe > level,
+             p_safe <= self._high * (1.0 - level)],
+            default=False) & valid
+
+        if is_dd.any():
+            self._sync_highs()
+        if not hit.any():
+            return []
+
+        fired = []
+        for k in np.flatnonzero(hit):
+            t = self.triggers.get(int(self._tid[k]))
+            if t is None:
+                continue
+            event = {
+                'id': t['id'],
+                'name': t['name'],
+                'price': float(p[k]),
+                'level': float(level[k]),
+                'high': float(self._high[k]),
+            }
+            fired.append(event)
+            if t['once']:
+                self.cancel(t['id'])
+            try:
+                t['callback'](context, t['code'], event)
+            except Exception as e:
+                log.error(f"触发器回调失败 {t['name']}({t['code']}): {e}")
+        return fired
+
+
+# 创建全局触发器实例
+intraday_triggers = IntradayTriggerLib()
+
+# ==================== 导出函数 ====================
+
+def register_trigger(code, op, level, callback, name=None, once=True):
+    """登记价格阈值触发器，level 可为数字或 'low_limit' / 'high_limit'"""
+    return intraday_triggers.register(code, op, level, callback, name, once)
+
+def register_drawdown_trigger(code, ratio, callback, high=0.0, name=None, once=True):
+    """登记从最高价回撤触发器"""
+    return intraday_triggers.register_drawdown(code, ratio, callback, high, name, once)
+
+def cancel_trigger(trigger_id):
+    """撤销单个触发器"""
+    intraday_triggers.cancel(trigger_id)
+
+def cancel_triggers(code):
+    """撤销某只证券的全部触发器"""
+    intraday_triggers.cancel_code(code)
+
+def reset_triggers():
+    """清空全部触发器"""
+    intraday_triggers.reset()
+
+def on_trigger_bar(context):
+    """every_bar 回调中调用，批量检查全部触发器"""
+    return intraday_triggers.on_bar(context)
+
+def feed_trigger_prices(context, codes, prices):
+    """直接喂入一批价格（回放/本地验证用）"""
+    return intraday_triggers.feed(context, prices, codes)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+聚宽定时任务时间预算库 - 软截止时间与降级执行
+紧挨着的定时任务（09:26 筛选 -> 09:27 买入，14:49 卖出 -> 14:50 买入/防御检测）
+一旦数据拉取变慢就会挤占下一个任务，导致下单滑点
+
+功能模块：
+1. 任务计时
+   - @budgeted_job('perpare', deadline='09:27')  # 装饰 run_daily 回调，记录每次耗时
+   - job_at_risk(reserve=5)  # 任务内检查：剩余时间不足 reserve 秒时进入降级模式
+   - job_degraded()  # 当前任务是否处于降级模式（跳过可选的打分/通知等）
+
+2. 统计与告警
+   - job_stats(name)  # 返回 {count, p50, p95, max, budget}
+   - 单次超出预算记录警告；近期 p95 达到预算的 alert_ratio 时每日告警一次
+     （通知库可用时同时发送邮件）
+
+降级规则：
+- 任务开始时，若近期 p95 已接近预算，直接以降级模式开始
+- 任务执行中调用 job_at_risk(reserve)，剩余时间不足则切换到降级模式
+- 降级只影响调用方主动检查的可选步骤，必要步骤始终执行
+
+使用说明：
+1. 将本文件放在聚宽研究根目录
+2. 在策略中导入：from job_budget_lib import *
+3. 用 @budgeted_job 装饰定时任务，任务内在可选步骤前检查 job_degraded()/job_at_risk()
+"""
+
+# 聚宽API导入
+try:
+    from kuanke.user_space_api import *
+except:
+    pass
+
+import time
+import functools
+import datetime as dt
+from collections import deque
+
+import numpy as np
+
+
+class JobTimer:
+    """
+    单次任务执行的计时器
+    """
+
+    def __init__(self, name, budget, degraded=False):
+        self.name = name
+        self.budget = budget          # 预算秒数，None 表示不限
+        self.degraded = degraded      # 是否处于降级模式
+        self.started = time.perf_counter()
+
+    def elapsed(self):
+        """已用秒数"""
+        return time.perf_counter() - self.started
+
+    def remaining(self):
+        """剩余秒数（无预算时为 inf）"""
+        if self.budget is None:
+            return float('inf')
+        return self.budget - self.elapsed()
+
+    def at_risk(self, reserve=0.0):
+        """
+        剩余时间不足 reserve 秒时切换到降级模式
+
+        Returns:
+            bool: 是否处于降级模式
+        """
+        if not self.degraded and self.remaining() < reserve:
+            self.degraded = True
+            log.warning(f"[{self.name}] 剩余时间 {self.remaining():.1f}s 不足 {reserve}s，切换降级模式")
+        return self.degraded
+
+
+class JobBudgetLib:
+    """
+    定时任务时间预算管理
+    """
+
+    def __init__(self, history=60, alert_ratio=0.8, min_samples=5):
+        """
+        Args:
+            history: 每个任务保留的最近耗时样本数
+            alert_ratio: p95 达到预算的该比例时告警并预先降级
+            min_samples: 计算 p95 所需的最少样本数
+        """
+        self.history = history
+        self.alert_ratio = alert_ratio
+        self.min_samples = min_samples
+        self.durations = {}   # name -> deque[秒]
+        self.budgets = {}     # name -> 最近一次的预算秒数
+        self.alerted = {}     # name -> 最近告警日期
+        self.stack = []       # 正在执行的任务（支持嵌套）
+
+    @staticmethod
+    def budget_from_deadline(context, deadline):
+        """
+        由截止时间 'HH:MM' 与当前调度时间计算预算秒数
+        """
+        now = context.current_dt
+        h, m = [int(x) for x in deadline.split(':')]
+        end = now.replace(hour=h, minute=m, second=0, microsecond=0)
+        return max((end - now).total_seconds(), 0.0)
+
+    def p95(self, name):
+        """近期耗时的 p95，样本不足时返回 None"""
+        samples = self.durations.get(name)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        return float(np.percentile(np.fromiter(samples, dtype=np.float64), 95))
+
+    def start(self, name, context, deadline=None, budget=None):
+        """
+        开始计时；近期 p95 已接近预算时直接以降级模式开始
+        """
+        if budget is None and deadline is not None:
+            budget = self.budget_from_deadline(context, deadline)
+        p95 = self.p95(name)
+        degraded = budget is not None and p95 is not None and p95 >= self.alert_ratio * budget
+        if degraded:
+            log.warning(f"[{name}] 近期p95耗时 {p95:.1f}s 接近预算 {budget:.0f}s，本次以降级模式执行")
+        timer = JobTimer(name, budget, degraded)
+        self.budgets[name] = budget
+        self.stack.append(timer)
+        return timer
+
+    def finish(self, timer, context=None):
+        """
+        结束计时：记录耗时，超预算警告，p95 接近预算时告警
+        """
+        if self.stack and self.stack[-1] is timer:
+            self.stack.pop()
+        cost = timer.elapsed()
+        self.durations.setdefault(timer.name, deque(maxlen=self.history)).append(cost)
+
+        if timer.budget is not None and cost > timer.budget:
+            log.warning(f"[{timer.name}] 耗时 {cost:.1f}s 超出预算 {timer.budget:.0f}s")
+
+        p95 = self.p95(timer.name)
+        if timer.budget and p95 is not None and p95 >= self.alert_ratio * timer.budget:
+            today = context.current_dt.date() if context is not None else dt.date.today()
+            if self.alerted.get(timer.name) != today:
+                self.alerted[timer.name] = today
+                self._alert(timer.name, p95, timer.budget, context)
+        return cost
+
+    def _alert(self, name, p95, budget, context):
+        message = f"定时任务 {name} 近期p95耗时 {p95:.1f}s，已达预算 {budget:.0f}s 的 {p95 / budget:.0%}"
+        log.warning(message)
+        try:
+            from notification_lib import send_email
+            send_email(message, context)
+        except Exception:
+            pass
+
+    def current(self):
+        """当前正在执行的任务计时器"""
+        return self.stack[-1] if self.stack else None
+
+    def stats(self, name):
+        """任务耗时统计"""
+        samples = np.fromiter(self.durations.get(name, ()), dtype=np.float64)
+        if len(samples) == 0:
+            return {'count': 0, 'budget': self.budgets.get(name)}
+        return {
+            'count': int(len(samples)),
+            'p50': float(np.percentile(samples, 50)),
+            'p95': float(np.percentile(samples, 95)),
+            'max': float(samples.max()),
+            'budget': self.budgets.get(name),
+        }
+
+
+# 创建全局预算实例
+job_budget = JobBudgetLib()
+
+# ==================== 导出函数 ====================
+
+def budgeted_job(name, deadline=None, budget=None):
+    """
+    定时任务装饰器：记录耗时并按截止时间设置软预算
+
+    Args:
+        name: 任务名称
+        deadline: 软截止时间 'HH:MM'（例如下一个任务的调度时间）
+        budget: 直接指定预算秒数（优先于 deadline）
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(context, *args, **kwargs):
+            timer = job_budget.start(name, context, deadline, budget)
+            try:
+                return func(context, *args, **kwargs)
+            finally:
+                job_budget.finish(timer, context)
+        return wrapper
+    return decorator
+
+def job_degraded():
+    """当前任务是否处于降级模式（不在预算任务中时返回 False）"""
+    timer = job_budget.current()
+    return timer is not None and timer.degraded
+
+def job_at_risk(reserve=0.0):
+    """当前任务剩余时间不足 reserve 秒时切换降级模式并返回 True"""
+    timer = job_budget.current()
+    return timer is not None and timer.at_risk(reserve)
+
+def job_stats(name):
+    """任务耗时统计 {count, p50, p95, max, budget}"""
+    return job_budget.stats(name)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+聚宽涨跌停状态位图库 - 每只证券近 N 个交易日的涨停/跌停/触板标记压缩为位
+多个策略各自用 get_price 拉 close/high_limit 判断"近几日涨停过"（多策略社区 5 日、3 日，三马昨日，
+弱转强 昨日/前日，微盘股 昨日接近涨停），同一份数据每天被反复拉取和比较
+
+功能模块：
+1. 状态位图（交易日 × 证券）
+   - 每个标记、每只证券一个 uint64：第 k 位表示最近交易日之前第 k 天（第0位为最近交易日）
+   - 标记：LIMIT_UP 收盘涨停 / LIMIT_DOWN 收盘跌停 / TOUCHED_UP 最高价触及涨停 /
+           TOUCHED_DOWN 最低价触及跌停 / NEAR_UP 收盘 >= 涨停价*0.997 / TRADED 当日有成交（未停牌）
+   - 新交易日：已跟踪证券一次 get_price 拉取新的一天，整列左移一位后写入第0位
+   - 新证券：一次 get_price 回填 history 天
+
+2. 查询（按位运算，单只证券 O(1)）
+   - limit_bits(codes, flag, end_date)  # 以 end_date 为第0位的位串数组，可直接做位运算组合条件
+   - limit_hit_in(codes, flag, days, end_date)  # 近 days 日内是否出现过该标记
+   - filter_limit_up(codes, days, end_date)  # 去掉近 days 日涨停过的证券
+   - limit_up_stocks(codes, days, end_date, flag=LIMIT_UP)  # 近 days 日出现过该标记的证券
+
+判定与原策略一致：涨停/跌停为收盘价等于涨跌停价；停牌日（fill_paused=False 时价格为空）所有标记为0。
+
+使用说明：
+1. 将本文件放在聚宽研究根目录
+2. 在策略中导入：from limit_state_lib import *
+3. 直接调用查询函数；位图在首次查询或交易日变化时自动维护，也可在盘前调用 update_limit_state(context, codes) 预热
+"""
+
+# 聚宽API导入
+try:
+    from kuanke.user_space_api import *
+except:
+    pass
+
+import datetime as dt
+
+import numpy as np
+
+# 标记
+LIMIT_UP = 0
+LIMIT_DOWN = 1
+TOUCHED_UP = 2
+TOUCHED_DOWN = 3
+NEAR_UP = 4
+TRADED = 5
+FLAG_NAMES = ('涨停', '跌停', '触及涨停', '触及跌停', '接近涨停', '有成交')
+
+
+def _to_date(value):
+    """str / datetime / date -> date"""
+    if isinstance(value, str):
+        return dt.datetime.strptime(value[:10], '%Y-%m-%d').date()
+    if isinstance(value, dt.datetime):
+        return value.date()
+    return value
+
+
+def recent_mask(days):
+    """最近 days 天（第0位起）的位掩码"""
+    return np.uint64((1 << min(days, 64)) - 1)
+
+
+class LimitStateLib:
+    """
+    涨跌停状态位图
+    """
+
+    def __init__(self, history=60, near_ratio=0.997):
+        """
+        Args:
+            history: 保留的交易日数（不超过64）
+            near_ratio: NEAR_UP 的阈值（收盘价 >= 涨停价 * near_ratio）
+        """
+        self.history = min(int(history), 64)
+        self.near_ratio = near_ratio
+        self.codes = []
+        self.index = {}
+        self.bits = np.zeros((len(FLAG_NAMES), 0), dtype=np.uint64)
+        self.days = []            # 已覆盖的交易日，最近的在前
+        self.fetches = 0          # get_price 调用次数
+
+    # ==================== 维护 ====================
+
+    def _fetch(self, codes, days):
+        """
+        拉取 codes 在 days（升序交易日）上的日线，返回 (标记数, 天数, 证券数) 的布尔数组
+        """
+        fields = ['close', 'high', 'low', 'high_limit', 'low_limit']
+        shape = (len(days), len(codes))
+        panels = {f: np.full(shape, np.nan) for f in fields}
+        df = get_price(codes, start_date=days[0], end_date=days[-1], frequency='daily', fields=fields,
+                       panel=False, fill_paused=False, skip_paused=False)
+        self.fetches += 1
+        if df is not None and not df.empty:
+            times = [_to_date(t) for t in df['time']]
+            for f in fields:
+                panel = df.assign(time=times).pivot(index='time', columns='code', values=f)
+                panels[f] = panel.reindex(index=days, columns=codes).values.astype(float)
+        close, high, low = panels['close'], panels['high'], panels['low']
+        high_limit, low_limit = panels['high_limit'], panels['low_limit']
+        with np.errstate(invalid='ignore'):
+            return np.stack([
+                close == high_limit,
+                close == low_limit,
+                high == high_limit,
+                low == low_limit,
+                close >= high_limit * self.near_ratio,
+                ~np.isnan(close),
+            ])
+
+    @staticmethod
+    def _pack(flags):
+        """(标记, 天数升序, 证券) 布尔数组 -> (标记, 证券) uint64，最后一天为第0位"""
+        n_days = flags.shape[1]
+        ages = np.arange(n_days - 1, -1, -1, dtype=np.uint64)
+        weighted = flags.astype(np.uint64) << ages[None, :, None]
+        return np.bitwise_or.reduce(weighted, axis=1) if n_days else np.zeros(
+            (flags.shape[0], flags.shape[2]), dtype=np.uint64)
+
+    def _reset(self, end_date):
+        self.days = [_to_date(d) for d in get_trade_days(end_date=end_date, count=self.history)][::-1]
+        self.codes, self.index = [], {}
+        self.bits = np.zeros((len(FLAG_NAMES), 0), dtype=np.uint64)
+
+    def _advance(self, end_date):
+        """已跟踪证券前进到 end_date；跨度超过保留天数时重建"""
+        new_days = [_to_date(d) for d in get_trade_days(start_date=self.days[0] + dt.timedelta(days=1),
+                                                         end_date=end_date)]
+        if not new_days:
+            return
+        if len(new_days) >= self.history or not self.codes:
+            self._reset(end_date)
+            return
+        words = self._pack(self._fetch(self.codes, new_days))
+        self.bits = ((self.bits << np.uint64(len(new_days))) | words) & recent_mask(self.history)
+        self.days = (new_days[::-1] + self.days)[:self.history]
+
+    def ensure(self, codes, end_date):
+        """保证 codes 在 end_date 及之前 history 天的状态已在位图中"""
+        end_date = _to_date(end_date)
+        if not self.days or end_date > self.days[0]:
+            if self.days:
+                self._advance(end_date)
+            else:
+                self._reset(end_date)
+        elif end_date < self.days[-1]:
+            # 回看早于保留范围（例如回测重新开始）：重建
+            self._reset(end_date)
+        missing = [c for c in dict.fromkeys(codes) if c not in self.index]
+        if missing:
+            words = self._pack(self._fetch(missing, self.days[::-1]))
+            for c in missing:
+                self.index[c] = len(self.codes)
+                self.codes.append(c)
+            self.bits = np.concatenate([self.bits, words], axis=1)
+
+    # ==================== 查询 ====================
+
+    def words(self, codes, flag, end_date):
+        """
+        以 end_date 为第0位的位串
+
+        Returns:
+            np.ndarray: uint64 数组，与 codes 对齐
+        """
+        codes = list(codes)
+        end_date = _to_date(end_date)
+        self.ensure(codes, end_date)
+        if not codes:
+            return np.empty(0, dtype=np.uint64)
+        # 与 get_price(end_date=...) 一致：end_date 不是交易日时以之前最近的交易日为第0位
+        offset = np.uint64(sum(d > end_date for d in self.days))
+        idx = np.fromiter((self.index[c] for c in codes), dtype=np.int64, count=len(codes))
+        return self.bits[flag, idx] >> offset
+
+    def hit_in(self, codes, flag, days, end_date):
+        """近 days 个交易日（含 end_date）内是否出现过该标记"""
+        return (self.words(codes, flag, end_date) & recent_mask(days)) != 0
+
+    def stats(self):
+        return {'codes': len(self.codes), 'days': len(self.days),
+                'latest': self.days[0] if self.days else None, 'fetches': self.fetches}
+
+
+# 创建全局涨跌停状态实例
+limit_state = LimitStateLib()
+
+# ==================== 导出函数 ====================
+
+def update_limit_state(context, codes=(), end_date=None):
+    """盘前预热：codes 在 end_date（默认前一交易日）的状态"""
+    limit_state.ensure(codes, end_date or context.previous_date)
+
+def limit_bits(codes, flag, end_date):
+    """以 end_date 为第0位的位串数组（uint64），第 k 位为 end_date 之前第 k 个交易日；可按位组合多个标记"""
+    return limit_state.words(codes, flag, end_date)
+
+def limit_hit_in(codes, flag, days, end_date):
+    """近 days 个交易日内是否出现过该标记（布尔数组，与 codes 对齐）"""
+    return limit_state.hit_in(codes, flag, days, end_date)
+
+def filter_limit_up(codes, days, end_date):
+    """去掉近 days 个交易日内收盘涨停过的证券"""
+    codes = list(codes)
+    hit = limit_state.hit_in(codes, LIMIT_UP, days, end_date)
+    return [c for c, h in zip(codes, hit) if not h]
+
+def limit_up_stocks(codes, days, end_date, flag=LIMIT_UP):
+    """近 days 个交易日内出现过该标记的证券"""
+    codes = list(codes)
+    hit = limit_state.hit_in(codes, flag, days, end_date)
+    return [c for c, h in zip(codes, hit) if h]
+
+def limit_state_stats():
+    """跟踪证券数、覆盖交易日数、最近交易日与 get_price 调用次数"""
+    return limit_state.stats()
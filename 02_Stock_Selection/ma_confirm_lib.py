@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+聚宽均线确认库 - 整批计算 MA_N 与现价，同一回调内筛选和开仓共用结果
+小市值类策略在筛选（filter_ma_stock / check_ma_condition）和开仓（open_position）中
+逐只各调两次 get_bars：一次日线算均线，一次1分钟线取现价，同一只股票在两处重复计算
+
+功能模块：
+1. 批量计算
+   - 一次 get_price 取全部股票最近的日线（不含当日），按停牌压缩后取最后 N 根有成交K线的收盘均价，
+     与 get_bars(count, unit='1d', include_now=False) 的均线一致
+   - 现价取自一次 get_current_data() 快照（分钟回测中为上一分钟收盘价，与 1m include_now=False 一致）
+
+2. 回调内缓存
+   - 以 (context.current_dt, N) 为键，同一回调内已计算过的股票直接命中，回调时间变化后清空
+   - 先 prefetch_ma(context, 全部候选, N) 一次算好，之后逐只 ma_confirmed 不再取数
+
+3. 判断
+   - ma_confirm(context, codes, N)  # 现价 > MA_N 的股票（保持顺序，对应筛选）
+   - ma_confirmed(context, code, N, strict=False)  # 单只现价 >= MA_N（对应开仓前确认）
+   - 不足 N 根有成交日线、停牌无现价的股票不通过
+
+使用说明：
+1. 将本文件与 price_panel_lib.py 放在聚宽研究根目录
+2. 在策略中导入：from ma_confirm_lib import *
+3. 调仓前 prefetch_ma(context, buy_stocks, g.ma_period)，开仓时 ma_confirmed(context, stock, g.ma_period)
+"""
+
+# 聚宽API导入
+try:
+    from kuanke.user_space_api import *
+except:
+    pass
+
+import numpy as np
+
+from price_panel_lib import price_panel
+
+
+class MaConfirmLib:
+    """
+    均线确认：{股票: (MA_N, 现价)}，同一回调内缓存
+    """
+
+    def __init__(self, pad=10):
+        """
+        Args:
+            pad: 日线多取的交易日数，用于停牌压缩后仍有 N 根有成交K线
+        """
+        self.pad = pad
+        self.key = None
+        self.values = {}          # 股票 -> (MA_N, 现价)
+        self.fetches = 0          # get_price 调用次数
+        self.hits = 0             # 缓存命中的股票数
+
+    def _cache(self, context, period):
+        key = (context.current_dt, period)
+        if key != self.key:
+            self.key, self.values = key, {}
+        return self.values
+
+    def prefetch(self, context, codes, period):
+        """批量计算 codes 中尚未缓存的股票"""
+        values = self._cache(context, period)
+        unique = list(dict.fromkeys(codes))
+        missing = [c for c in unique if c not in values]
+        self.hits += len(unique) - len(missing)
+        if not missing:
+            return values
+        panel = price_panel(missing, context.previous_date, period + self.pad, ['close'],
+                            fill_paused=False, skip_paused=False).compact().reindex(missing)
+        self.fetches += 1
+        close = panel['close']
+        ma = close[-period:].mean(axis=0) if len(close) >= period else np.full(len(missing), np.nan)
+        ma = np.where(panel.rows >= period, ma, np.nan)
+        current_data = get_current_data()
+        for code, value in zip(missing, ma.tolist()):
+            price = current_data[code].last_price
+            values[code] = (value, np.nan if price is None else float(price))
+        return values
+
+    def above(self, context, codes, period, strict=True):
+        """
+        现价是否站上 MA_N
+
+        Returns:
+            np.ndarray: 与 codes 对齐的布尔数组
+        """
+        codes = list(codes)
+        values = self.prefetch(context, codes, period)
+        pairs = np.array([values[c] for c in codes], dtype=float).reshape(-1, 2)
+        ma, price = pairs[:, 0], pairs[:, 1]
+        with np.errstate(invalid='ignore'):
+            return (price > ma) if strict else (price >= ma)
+
+    def stats(self):
+        return {'fetches': self.fetches, 'hits': self.hits, 'cached': len(self.values)}
+
+
+# 创建全局均线确认实例
+ma_confirmation = MaConfirmLib()
+
+# ==================== 导出函数 ====================
+
+def prefetch_ma(context, codes, period):
+    """本回调内批量算好 codes 的 MA_N 与现价"""
+    ma_confirmation.prefetch(context, codes, period)
+
+def ma_confirm(context, codes, period, strict=True):
+    """现价站上 MA_N 的股票，保持原顺序"""
+    codes = list(codes)
+    return [c for c, ok in zip(codes, ma_confirmation.above(context, codes, period, strict)) if ok]
+
+def ma_confirmed(context, code, period, strict=False):
+    """单只股票现价是否站上 MA_N（默认 >=，对应开仓前"现价低于均线不买"）"""
+    return bool(ma_confirmation.above(context, [code], period, strict)[0])
+
+def ma_value(context, code, period):
+    """(MA_N, 现价)，用于日志"""
+    return ma_confirmation.prefetch(context, [code], period)[code]
+
+def ma_confirm_stats():
+    """get_price 调用次数、缓存命中股票数、当前回调缓存的股票数"""
+    return ma_confirmation.stats()
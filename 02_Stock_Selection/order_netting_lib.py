@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+聚宽跨策略委托轧差库 - 同一回调窗口内按证券合并委托
+多子策略组合中，不同子策略（以及 get_cash/end_trade 对货币ETF的买卖）可能在同一个回调里
+对同一证券先卖后买，逐笔下单会多付手续费、多走交易所往返
+
+功能模块：
+1. 收集意图
+   - @order_netted  # 装饰定时任务：回调内的委托先登记为意图，回调结束时统一下单
+   - begin_netting_window() / end_netting_window(context)  # 跨多个同一时间的回调开启窗口
+   - add_amount_intent(security, owner, amount, on_fill)  # 按股数增减（order 语义）
+   - add_target_intent(security, owner, value, on_fill)  # 按目标市值（order_target_value 语义）
+
+2. 轧差下单与分摊
+   - 股数意图：同一证券各子策略的增减量求和，只下净额委托；
+     对冲部分视为内部划转，净额委托数量按比例（整手）分摊回各子策略；
+     下单返回时委托可能尚未成交，实际成交的差额由持仓核对（position_reconcile_lib）修正
+   - 目标市值意图：同一证券以最后一个目标为准，只下一笔委托
+   - 先下净卖出，再下净买入，保证资金可用
+   - on_fill(owner_amount, order) 回调把分摊结果写回子策略账本
+
+3. 资金估计
+   - netting_pending_amount(security)  # 窗口内尚未下单的净股数
+   - netting_pending_cash()  # 窗口内尚未下单的净现金流（卖出为正）
+
+窗口外（未开启窗口）登记的意图立即下单，行为与直接下单一致。
+
+使用说明：
+1. 将本文件放在聚宽研究根目录
+2. 在策略中导入：from order_netting_lib import *
+3. 下单处改为登记意图，在 on_fill 中更新子策略账本
+"""
+
+# 聚宽API导入
+try:
+    from kuanke.user_space_api import *
+except:
+    pass
+
+import functools
+from collections import OrderedDict
+
+import numpy as np
+
+
+def split_fill(deltas, filled, lot=100):
+    """
+    把净额委托的实际成交分摊回各子策略
+
+    Args:
+        deltas: 各子策略的意图股数（买正卖负）
+        filled: 净额委托实际成交股数（买正卖负，未成交为0）
+        lot: 最小交易单位
+
+    Returns:
+        list: 各子策略实际变动股数
+    """
+    d = np.asarray(deltas, dtype=np.int64)
+    net = int(d.sum())
+    if net == 0 or filled == net:
+        return d.tolist()
+    sign = 1 if net > 0 else -1
+    filled = min(max(int(filled) * sign, 0), abs(net))
+
+    # 反方向的意图由内部划转全部满足，同方向按比例分享 内部划转量 + 市场成交量
+    same = d * sign > 0
+    want = np.where(same, np.abs(d), 0)
+    available = int(np.abs(d[~same]).sum()) + filled
+    out = np.where(same, 0, d)
+
+    raw = want * (available / want.sum())
+    lots = (raw // lot).astype(np.int64)
+    left = available // lot - int(lots.sum())
+    if left > 0:
+        rank = np.argsort(-(raw / lot - lots), kind='stable')
+        for i in rank[:left]:
+            if same[i] and (lots[i] + 1) * lot <= want[i]:
+                lots[i] += 1
+    alloc = lots * lot
+    # 不足一手的零头给意图最大的子策略
+    rest = available - int(alloc.sum())
+    if rest > 0:
+        i = int(np.argmax(want - alloc))
+        alloc[i] += min(rest, int(want[i] - alloc[i]))
+    out = np.where(same, alloc * sign, out)
+    return out.tolist()
+
+
+class OrderNettingLib:
+    """
+    回调窗口内的委托意图聚合器
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.amounts = OrderedDict()   # security -> [[owner, amount, on_fill], ...]
+        self.targets = OrderedDict()   # security -> [[owner, value, on_fill], ...]
+        self.senders = {}              # security -> 下单函数
+        self.intent_count = 0          # 累计登记的意图数
+        self.order_count = 0           # 累计实际发出的委托数
+
+    @property
+    def active(self):
+        return self.depth > 0
+
+    # ==================== 窗口 ====================
+
+    def begin(self):
+        """开启窗口（可嵌套）"""
+        self.depth += 1
+
+    def end(self, context=None):
+        """关闭窗口，最外层关闭时统一下单"""
+        self.depth = max(self.depth - 1, 0)
+        if self.depth == 0:
+            self.flush(context)
+
+    # ==================== 登记意图 ====================
+
+    def add_amount(self, security, owner, amount, on_fill=None, send=None):
+        """
+        登记按股数增减的意图
+
+        Args:
+            security: 证券代码
+            owner: 子策略标识（None 表示不属于任何子策略账本，例如货币ETF）
+            amount: 增减股数（买正卖负）
+            on_fill: 回调 on_fill(owner_amount, order)，owner_amount 为分摊到的实际变动股数
+            send: 下单函数 send(security, amount)，默认 order
+        """
+        if security in self.targets:
+            raise ValueError(f"{security} 在同一窗口内同时登记了股数意图和目标市值意图")
+        self.amounts.setdefault(security, []).append([owner, int(amount), on_fill])
+        self.senders[security] = send or order
+        self.intent_count += 1
+        if not self.active:
+            self.flush()
+
+    def add_target(self, security, owner, value, on_fill=None, send=None):
+        """
+        登记目标市值意图
+
+        Args:
+            security: 证券代码
+            owner: 子策略标识
+            value: 目标市值
+            on_fill: 回调 on_fill(order)，order 为净额委托（未下单或失败为 None）
+            send: 下单函数 send(security, value)，默认 order_target_value
+        """
+        if security in self.amounts:
+            raise ValueError(f"{security} 在同一窗口内同时登记了股数意图和目标市值意图")
+        self.targets.setdefault(security, []).append([owner, float(value), on_fill])
+        self.senders[security] = send or order_target_value
+        self.intent_count += 1
+        if not self.active:
+            self.flush()
+
+    # ==================== 资金估计 ====================
+
+    def pending_amount(self, security):
+        """窗口内尚未下单的净股数"""
+        return sum(x[1] for x in self.amounts.get(security, ()))
+
+    def pending_cash(self):
+        """窗口内尚未下单的股数意图的净现金流估计（卖出为正，按最新价）"""
+        if not self.amounts:
+            return 0.0
+        current_data = get_current_data()
+        return -sum(current_data[s].last_price * self.pending_amount(s) for s in self.amounts)
+
+    # ==================== 下单 ====================
+
+    def flush(self, context=None):
+        """
+        按证券轧差下单并分摊成交
+
+        Returns:
+            int: 本次发出的委托数
+        """
+        amounts, self.amounts = self.amounts, OrderedDict()
+        targets, self.targets = self.targets, OrderedDict()
+        senders, self.senders = self.senders, {}
+        sent = 0
+
+        # 股数意图：先净卖出后净买入
+        nets = [(s, sum(x[1] for x in v)) for s, v in amounts.items()]
+        for security, net in sorted(nets, key=lambda x: x[1] > 0):
+            intents = amounts[security]
+            o = None
+            filled = 0
+            if net != 0:
+                o = senders[security](security, net)
+                sent += 1
+                if o:
+                    # 按委托数量分摊（下单返回时 o.filled 可能为 0），成交差额留给持仓核对
+                    filled = o.amount if o.is_buy else -o.amount
+            alloc = split_fill([x[1] for x in intents], filled)
+            for (owner, _, on_fill), got in zip(intents, alloc):
+                if on_fill is not None:
+                    on_fill(got, o)
+
+        # 目标市值意图：最后一个目标为准；目标为0的卖出优先
+        for security, intents in sorted(targets.items(), key=lambda x: x[1][-1][1] > 0):
+            o = senders[security](security, intents[-1][1])
+            sent += 1
+            for owner, _, on_fill in intents:
+                if on_fill is not None:
+                    on_fill(o)
+
+        total = sum(len(v) for v in amounts.values()) + sum(len(v) for v in targets.values())
+        if total > sent:
+            log.info(f"委托轧差：合并意图 {total} 条，实际下单 {sent} 笔")
+        self.order_count += sent
+        return sent
+
+
+# 创建全局轧差实例
+order_netting = OrderNettingLib()
+
+# ==================== 导出函数 ====================
+
+def order_netted(func):
+    """
+    定时任务装饰器：回调内登记的意图在回调结束时轧差下单
+    """
+    @functools.wraps(func)
+    def wrapper(context, *args, **kwargs):
+        order_netting.begin()
+        try:
+            return func(context, *args, **kwargs)
+        finally:
+            order_netting.end(context)
+    return wrapper
+
+def begin_netting_window(context=None):
+    """
+    开启跨回调的轧差窗口（与 end_netting_window 成对注册在同一时间）
+    注意：同一时间的 run_monthly / run_weekly 任务先于 run_daily 执行，跨频率的任务应放进一个 order_netted 回调
+    """
+    order_netting.begin()
+
+def end_netting_window(context=None):
+    """关闭轧差窗口并统一下单"""
+    order_netting.end(context)
+
+def add_amount_intent(security, owner, amount, on_fill=None, send=None):
+    """登记按股数增减的意图"""
+    order_netting.add_amount(security, owner, amount, on_fill, send)
+
+def add_target_intent(security, owner, value, on_fill=None, send=None):
+    """登记目标市值意图"""
+    order_netting.add_target(security, owner, value, on_fill, send)
+
+def netting_pending_amount(security):
+    """窗口内尚未下单的净股数"""
+    return order_netting.pending_amount(security)
+
+def netting_pending_cash():
+    """窗口内尚未下单的净现金流估计（卖出为正）"""
+    return order_netting.pending_cash()
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+聚宽持仓核对引擎 - 子策略账本与账户持仓逐分钟核对
+多子策略组合在一个账户里交易，子策略各自记账（多策略社区 g.positions、三马 g.stock_strategy），
+送股、部分成交后撤单、手工交易都会让账本与账户持仓悄悄偏离
+
+功能模块：
+1. 子策略账本 PositionLedger
+   - 代码与股数为按代码排序的对齐数组，查找为二分查找
+   - 实现 dict 接口（get/pop/keys/items/[]），可直接替换 g.positions[i] 这样的字典，保存在 g 中
+   - as_ledgers({策略: dict}) 把已有的字典账本（模拟盘 g 中恢复的旧数据）转换为账本
+
+2. 核对 PositionReconciler.diff
+   - 全部账本拼接后按代码排序、分组求和，与账户持仓按代码合并比较，O(n log n)
+   - 有在途委托（get_open_orders）的证券和 ignore 中的证券（例如货币ETF）不比较
+   - 差异分类：
+       missed_fill       当日有该证券的委托：账本按委托数量记账，实际成交不同（部分成交后撤单、废单）
+       corporate_action  当日无委托且账户多于账本（送股/转增），或在 ex_rights 中
+       manual_trade      其他：账户与账本不同且当日策略没有交易该证券
+
+3. 修正意图
+   - 有归属的差异：'adopt'，账户股数按各子策略账本占比分摊回账本（零头给持仓最多的子策略）
+   - 无归属的持仓（账本中没有任何子策略持有）：'sell'，由调用方在合适的时间卖出
+   - reconcile_ledgers(context, ledgers) 一次完成 核对 -> 生成意图 -> 应用 'adopt'，返回全部意图
+
+每次核对只对账本与持仓做几次数组排序/查找，几十只持仓耗时在毫秒以内，可以用 run_daily(..., 'every_bar') 每分钟运行。
+
+使用说明：
+1. 将本文件放在聚宽研究根目录
+2. 在策略中导入：from position_reconcile_lib import *
+3. g.positions = {i: PositionLedger() for i in range(n)}；每分钟 reconcile_ledgers(context, g.positions)，
+   尾盘对返回的 'sell' 意图下单
+"""
+
+# 聚宽API导入
+try:
+    from kuanke.user_space_api import *
+except:
+    pass
+
+import time
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+import numpy as np
+
+CODE_DTYPE = 'U16'
+
+# 差异分类
+MISSED_FILL = 'missed_fill'
+CORPORATE_ACTION = 'corporate_action'
+MANUAL_TRADE = 'manual_trade'
+KIND_NAMES = {MISSED_FILL: '成交未记账', CORPORATE_ACTION: '送转/公司行为', MANUAL_TRADE: '手工交易'}
+
+
+class PositionLedger(MutableMapping):
+    """
+    子策略账本：按代码排序的 代码/股数 对齐数组，dict 接口
+    """
+
+    def __init__(self, mapping=None):
+        self.codes = np.empty(0, dtype=CODE_DTYPE)
+        self.amounts = np.empty(0, dtype=np.int64)
+        if mapping:
+            items = sorted(dict(mapping).items())
+            self.codes = np.array([c for c, _ in items], dtype=CODE_DTYPE)
+            self.amounts = np.array([a for _, a in items], dtype=np.int64)
+
+    def _find(self, code):
+        i = int(np.searchsorted(self.codes, code))
+        return i, i < len(self.codes) and self.codes[i] == code
+
+    def __getitem__(self, code):
+        i, found = self._find(code)
+        if not found:
+            raise KeyError(code)
+        return int(self.amounts[i])
+
+    def __setitem__(self, code, amount):
+        i, found = self._find(code)
+        if found:
+            self.amounts[i] = amount
+        else:
+            self.codes = np.insert(self.codes, i, code)
+            self.amounts = np.insert(self.amounts, i, amount)
+
+    def __delitem__(self, code):
+        i, found = self._find(code)
+        if not found:
+            raise KeyError(code)
+        self.codes = np.delete(self.codes, i)
+        self.amounts = np.delete(self.amounts, i)
+
+    def __iter__(self):
+        return iter(self.codes.tolist())
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __repr__(self):
+        return f"PositionLedger({dict(zip(self.codes.tolist(), self.amounts.tolist()))})"
+
+
+def as_ledgers(ledgers):
+    """{策略: dict 或 PositionLedger} -> {策略: PositionLedger}，已是账本的原样保留"""
+    return {k: v if isinstance(v, PositionLedger) else PositionLedger(v) for k, v in ledgers.items()}
+
+
+def _actual_amounts(positions):
+    """
+    账户持仓 -> (排序后的代码数组, 股数数组)
+
+    positions 可以是 context.portfolio.positions（Position.total_amount）、{代码: 股数}，
+    或 QMT query_stock_positions 的列表（stock_code/volume）
+    """
+    if hasattr(positions, 'items'):
+        pairs = [(c, getattr(p, 'total_amount', p)) for c, p in positions.items()]
+    else:
+        pairs = [(p.stock_code, p.volume) for p in positions]
+    pairs = sorted((c, int(a)) for c, a in pairs if a)
+    return (np.array([c for c, _ in pairs], dtype=CODE_DTYPE),
+            np.array([a for _, a in pairs], dtype=np.int64))
+
+
+class PositionReconciler:
+    """
+    子策略账本与账户持仓核对
+    """
+
+    def __init__(self):
+        self.runs = 0
+        self.elapsed_ms = 0.0     # 最近一次核对耗时
+        self.counts = {MISSED_FILL: 0, CORPORATE_ACTION: 0, MANUAL_TRADE: 0}
+        self.last = []            # 最近一次的修正意图
+
+    def diff(self, ledgers, positions, pending=(), traded=(), ex_rights=(), ignore=()):
+        """
+        比较账本合计与账户持仓
+
+        Args:
+            ledgers: {策略: PositionLedger}
+            positions: 账户持仓，见 _actual_amounts
+            pending: 有在途委托的证券（不比较）
+            traded: 当日有委托的证券（差异归为 missed_fill）
+            ex_rights: 当日除权除息的证券（差异归为 corporate_action）
+            ignore: 不归属任何子策略、不比较的证券
+
+        Returns:
+            list: [{'code', 'kind', 'ledger', 'actual', 'owners': {策略: 股数}}, ...]
+        """
+        keys = list(ledgers)
+        parts = [ledgers[k] for k in keys]
+        codes = np.concatenate([p.codes for p in parts] + [np.empty(0, dtype=CODE_DTYPE)])
+        amounts = np.concatenate([p.amounts for p in parts] + [np.empty(0, dtype=np.int64)])
+        owners = np.repeat(np.arange(len(parts)), [len(p) for p in parts])
+        order = np.argsort(codes, kind='stable')
+        codes, amounts, owners = codes[order], amounts[order], owners[order]
+        book, start = np.unique(codes, return_index=True)
+        totals = np.add.reduceat(amounts, start) if len(codes) else np.empty(0, dtype=np.int64)
+
+        held, actual = _actual_amounts(positions)
+        universe = np.union1d(book, held)
+        ledger_total = np.zeros(len(universe), dtype=np.int64)
+        ledger_total[np.searchsorted(universe, book)] = totals
+        actual_total = np.zeros(len(universe), dtype=np.int64)
+        actual_total[np.searchsorted(universe, held)] = actual
+
+        skip = list(pending) + list(ignore)
+        mask = ledger_total != actual_total
+        if skip:
+            mask &= ~np.isin(universe, np.array(skip, dtype=CODE_DTYPE))
+        rows = np.flatnonzero(mask)
+        if len(rows) == 0:
+            return []
+
+        was_traded = np.isin(universe[rows], np.array(list(traded), dtype=CODE_DTYPE))
+        is_ex = np.isin(universe[rows], np.array(list(ex_rights), dtype=CODE_DTYPE))
+        grew = (ledger_total[rows] > 0) & (actual_total[rows] > ledger_total[rows])
+        kinds = np.where(was_traded, MISSED_FILL, np.where(is_ex | grew, CORPORATE_ACTION, MANUAL_TRADE))
+
+        # 只对有差异的证券回查各子策略的股数
+        slot = np.searchsorted(universe, codes)
+        diffs = []
+        for r, kind in zip(rows.tolist(), kinds.tolist()):
+            members = np.flatnonzero(slot == r)
+            diffs.append({
+                'code': str(universe[r]),
+                'kind': kind,
+                'ledger': int(ledger_total[r]),
+                'actual': int(actual_total[r]),
+                'owners': {keys[owners[m]]: int(amounts[m]) for m in members},
+            })
+        return diffs
+
+    @staticmethod
+    def corrections(diffs):
+        """
+        差异 -> 修正意图
+
+        Returns:
+            list: [{'strategy', 'code', 'kind', 'action', 'ledger', 'target'}, ...]
+                  action 为 'adopt'（账本改为 target）或 'sell'（无归属持仓，strategy 为 None）
+        """
+        intents = []
+        for d in diffs:
+            owners = {k: a for k, a in d['owners'].items() if a > 0}
+            if not owners:
+                intents.append({'strategy': None, 'code': d['code'], 'kind': d['kind'], 'action': 'sell',
+                                'ledger': 0, 'target': 0, 'actual': d['actual']})
+                continue
+            total = sum(owners.values())
+            targets = {k: a * d['actual'] // total for k, a in owners.items()}
+            largest = max(owners, key=owners.get)
+            targets[largest] += d['actual'] - sum(targets.values())
+            for k, a in owners.items():
+                if targets[k] != a:
+                    intents.append({'strategy': k, 'code': d['code'], 'kind': d['kind'], 'action': 'adopt',
+                                    'ledger': a, 'target': targets[k], 'actual': d['actual']})
+        return intents
+
+    @staticmethod
+    def apply(ledgers, intents):
+        """把 'adopt' 意图写回账本"""
+        for i in intents:
+            if i['action'] != 'adopt':
+                continue
+            ledger = ledgers[i['strategy']]
+            if i['target'] > 0:
+                ledger[i['code']] = i['target']
+            else:
+                ledger.pop(i['code'], None)
+
+    def reconcile(self, context, ledgers, ignore=(), ex_rights=(), apply=True, positions=None):
+        """
+        核对并应用 'adopt' 修正
+
+        Args:
+            context: 聚宽上下文对象
+            ledgers: {策略: PositionLedger}
+            ignore: 不比较的证券（例如货币ETF）
+            ex_rights: 当日除权除息的证券
+            apply: 是否把 'adopt' 写回账本
+            positions: 账户持仓，默认 context.portfolio.positions
+
+        Returns:
+            list: 修正意图，见 corrections
+        """
+        started = time.perf_counter()
+        pending = {o.security for o in get_open_orders().values()}
+        traded = {o.security for o in get_orders().values()}
+        positions = context.portfolio.positions if positions is None else positions
+        diffs = self.diff(ledgers, positions, pending, traded, ex_rights, ignore)
+        intents = self.corrections(diffs)
+        if apply:
+            self.apply(ledgers, intents)
+        self.runs += 1
+        self.elapsed_ms = (time.perf_counter() - started) * 1000
+        for d in diffs:
+            self.counts[d['kind']] += 1
+            log.warning(f"持仓核对 {d['code']} [{KIND_NAMES[d['kind']]}] 账本 {d['ledger']} 账户 {d['actual']} "
+                        f"归属 {d['owners'] or '无'}")
+        self.last = intents
+        return intents
+
+
+# 创建全局持仓核对实例
+position_reconciler = PositionReconciler()
+
+# ==================== 导出函数 ====================
+
+def reconcile_ledgers(context, ledgers, ignore=(), ex_rights=(), apply=True):
+    """核对子策略账本与账户持仓，应用 'adopt' 修正并返回全部修正意图"""
+    return position_reconciler.reconcile(context, ledgers, ignore, ex_rights, apply)
+
+def unowned_positions(intents):
+    """修正意图中需要卖出的无归属持仓代码"""
+    return [i['code'] for i in intents if i['action'] == 'sell']
+
+def reconcile_stats():
+    """核对次数、最近一次耗时（毫秒）与各类差异累计次数"""
+    return {'runs': position_reconciler.runs, 'elapsed_ms': position_reconciler.elapsed_ms,
+            'counts': dict(position_reconciler.counts)}
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+聚宽持仓风控引擎 - 止盈/止损/移动止损/持有天数
+整本持仓的入场价、最高价、止盈价、止损价保存为对齐的 numpy 数组，
+每根bar一次向量运算完成全部退出规则判断
+
+功能模块：
+1. 持仓登记
+   - book.upsert(code, entry_price, entry_date)  # 新开仓/补登记
+   - book.remove(code)  # 平仓后移除
+   - book.sync(context)  # 与 context.portfolio 对齐（补登历史持仓、移除已平仓）
+   - book.rebase(entry_prices)  # 入场价变化（加仓摊薄成本）时批量重算止盈止损价
+
+2. 风控判断
+   - book.evaluate(context)  # 更新最高价并返回 [(code, 'TP'|'SL'|'TRAIL'|'TIME'), ...]
+
+判定优先级与原策略一致：TP > SL > TRAIL > TIME，每只证券只返回一个原因。
+规则参数为 None 时对应规则关闭（内部以 NaN 存储，比较结果恒为 False）。
+
+使用说明：
+1. 将本文件放在聚宽研究根目录
+2. 在策略中导入：from position_risk_lib import *
+3. initialize 中创建：g.risk_book = PositionRiskBook(tp=0.10, sl=0.05, trail=0.07, max_hold_days=5)
+   （保存在 g 中，模拟盘重启后持仓状态不丢失）
+"""
+
+# 聚宽API导入
+try:
+    from kuanke.user_space_api import *
+except:
+    pass
+
+import numpy as np
+
+# 退出原因
+EXIT_TAGS = np.array(['TP', 'SL', 'TRAIL', 'TIME'])
+
+
+def _ratio(value):
+    """None 表示关闭该规则"""
+    return np.nan if value is None else float(value)
+
+
+class PositionRiskBook:
+    """
+    持仓风控簿：一行一只证券，全部字段为对齐数组
+    """
+
+    def __init__(self, tp=None, sl=None, trail=None, max_hold_days=None):
+        """
+        Args:
+            tp: 默认止盈比例（相对入场价，例如 0.10 表示 +10%）
+            sl: 默认止损比例（相对入场价，例如 0.05 表示 -5%）
+            trail: 默认移动止损回撤比例（相对持仓以来最高价）
+            max_hold_days: 默认最长持有天数（自然日，T+1计数）
+        """
+        self.default_tp = tp
+        self.default_sl = sl
+        self.default_trail = trail
+        self.default_max_hold = max_hold_days
+        self.codes = []
+        self.index = {}
+        self.entry = np.empty(0, dtype=np.float64)     # 入场价
+        self.high = np.empty(0, dtype=np.float64)      # 持仓以来最高价
+        self.target = np.empty(0, dtype=np.float64)    # 止盈价
+        self.stop = np.empty(0, dtype=np.float64)      # 止损价
+        self.tp = np.empty(0, dtype=np.float64)        # 止盈比例
+        self.sl = np.empty(0, dtype=np.float64)        # 止损比例
+        self.trail = np.empty(0, dtype=np.float64)     # 移动止损回撤比例
+        self.entry_day = np.empty(0, dtype=np.int64)   # 入场日（date.toordinal）
+        self.max_hold = np.empty(0, dtype=np.float64)  # 最长持有天数
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.index
+
+    # ==================== 持仓登记 ====================
+
+    def upsert(self, code, entry_price, entry_date, high=None, tp='default', sl='default',
+               trail='default', max_hold_days='default'):
+        """
+        登记或更新一只持仓
+
+        Args:
+            code: 证券代码
+            entry_price: 入场价（止盈止损基准）
+            entry_date: 入场日期（datetime.date）
+            high: 初始最高价，默认等于入场价
+            tp/sl/trail/max_hold_days: 覆盖默认参数，None 表示关闭该规则
+        """
+        tp = self.default_tp if tp == 'default' else tp
+        sl = self.default_sl if sl == 'default' else sl
+        trail = self.default_trail if trail == 'default' else trail
+        max_hold_days = self.default_max_hold if max_hold_days == 'default' else max_hold_days
+
+        entry_price = float(entry_price)
+        row = (
+            entry_price,
+            entry_price if high is None else max(float(high), entry_price),
+            entry_price * (1.0 + _ratio(tp)),
+            entry_price * (1.0 - _ratio(sl)),
+            _ratio(tp),
+            _ratio(sl),
+            _ratio(trail),
+            entry_date.toordinal(),
+            _ratio(max_hold_days),
+        )
+        i = self.index.get(code)
+        if i is None:
+            self.index[code] = len(self.codes)
+            self.codes.append(code)
+            self.entry = np.append(self.entry, row[0])
+            self.high = np.append(self.high, row[1])
+            self.target = np.append(self.target, row[2])
+            self.stop = np.append(self.stop, row[3])
+            self.tp = np.append(self.tp, row[4])
+            self.sl = np.append(self.sl, row[5])
+            self.trail = np.append(self.trail, row[6])
+            self.entry_day = np.append(self.entry_day, row[7])
+            self.max_hold = np.append(self.max_hold, row[8])
+        else:
+            (self.entry[i], self.high[i], self.target[i], self.stop[i], self.tp[i],
+             self.sl[i], self.trail[i], self.entry_day[i], self.max_hold[i]) = row
+
+    def remove(self, codes):
+        """
+        移除持仓（单个代码或代码列表）
+        """
+        if isinstance(codes, str):
+            codes = [codes]
+        drop = [self.index[c] for c in codes if c in self.index]
+        if not drop:
+            return
+        keep = np.ones(len(self.codes), dtype=bool)
+        keep[drop] = False
+        self.codes = [c for c, k in zip(self.codes, keep) if k]
+        self.index = {c: i for i, c in enumerate(self.codes)}
+        for name in ('entry', 'high', 'target', 'stop', 'tp', 'sl', 'trail', 'entry_day', 'max_hold'):
+            setattr(self, name, getattr(self, name)[keep])
+
+    def sync(self, context, positions=None):
+        """
+        与账户持仓对齐：未登记的持仓按成本价补登，已平仓的移除
+
+        Args:
+            context: 聚宽上下文对象
+            positions: 持仓字典，默认 context.portfolio.long_positions
+        """
+        if positions is None:
+            positions = context.portfolio.long_positions
+        today = context.current_dt.date()
+        self.remove([c for c in self.codes if c not in positions])
+        for c, pos in positions.items():
+            if c not in self.index:
+                # 历史持仓或缓存丢失：以成本价补登，最高价取成本与现价较大者
+                self.upsert(c, pos.avg_cost, today, high=max(pos.avg_cost, pos.price))
+
+    def rebase(self, entry_prices):
+        """
+        批量更新入场价并重算止盈止损价（最高价保留）
+
+        Args:
+            entry_prices: 与 self.codes 对齐的入场价数组，例如持仓成本价
+        """
+        self.entry = np.asarray(entry_prices, dtype=np.float64)
+        self.target = self.entry * (1.0 + self.tp)
+        self.stop = self.entry * (1.0 - self.sl)
+
+    # ==================== 风控判断 ====================
+
+    def prices(self, codes=None):
+        """
+        读取当前价，停牌证券返回 NaN（不更新最高价、不触发退出）
+        """
+        codes = self.codes if codes is None else codes
+        current_data = get_current_data()
+        out = np.empty(len(codes), dtype=np.float64)
+        for i, c in enumerate(codes):
+            cd = current_data[c]
+            out[i] = np.nan if cd.paused else cd.last_price
+        return out
+
+    def evaluate(self, context=None, prices=None, today=None, check_time=True, mask=None):
+        """
+        一次向量运算：更新最高价并判定全部退出规则
+
+        Args:
+            context: 聚宽上下文对象（prices/today 未给出时用于取价和日期）
+            prices: 与 self.codes 对齐的最新价数组
+            today: 当前日期（datetime.date）
+            check_time: 是否判定持有天数上限（例如只在 14:50 之后判定）
+            mask: 与 self.codes 对齐的布尔数组，False 的持仓跳过 TP/SL 判定
+
+        Returns:
+            list: [(code, 'TP'|'SL'|'TRAIL'|'TIME'), ...]
+        """
+        if not self.codes:
+            return []
+        if prices is None:
+            prices = self.prices()
+        p = np.asarray(prices, dtype=np.float64)
+        valid = ~np.isnan(p)
+
+        # 更新持仓以来最高价
+        self.high = np.where(valid, np.fmax(self.high, p), self.high)
+
+        fixed = valid if mask is None else valid & np.asarray(mask, dtype=bool)
+        with np.errstate(invalid='ignore'):
+            tp = fixed & (self.entry > 0) & (p >= self.target)
+            sl = fixed & (self.entry > 0) & (p <= self.stop)
+            trail = valid & (self.high > 0) & (p <= self.high * (1.0 - self.trail))
+            if check_time:
+                if today is None:
+                    today = context.current_dt.date()
+                hold_days = today.toordinal() - self.entry_day + 1
+                time_ = valid & (hold_days >= self.max_hold)
+            else:
+                time_ = np.zeros(len(p), dtype=bool)
+
+        reason = np.select([tp, sl, trail, time_], [0, 1, 2, 3], default=-1)
+        hit = np.flatnonzero(reason >= 0)
+        return [(self.codes[i], str(EXIT_TAGS[reason[i]])) for i in hit]
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+聚宽宽表筛选库 - 日线长表转为 (交易日 × 证券) 宽表，技术条件整表一次比较
+原筛选按 df.groupby('code') 逐只 copy、rolling、shift，全指数几百上千只股票时
+大部分时间花在每组的 pandas 开销上；宽表上同样的条件只是几次数组运算
+
+功能模块：
+1. 宽表 PricePanel
+   - PricePanel.from_frame(df)  # get_price(panel=False) 的长表 -> 宽表
+   - panel.codes 按代码排序（与 groupby 顺序一致），panel.rows 为每只证券在长表中的行数
+   - panel['close'] 为 (交易日, 证券) 的 float 数组，最后一行为最近交易日
+   - price_panel(stocks, end_date, count, fields)  # 一次 get_price 并转为宽表
+   - panel.compact()  # 每只证券的停牌行移到顶部，底部为最近的有成交K线（相当于逐只 skip_paused=True）
+   - panel.reindex(codes)  # 列按 codes 的顺序排列（例如按市值排好的候选顺序），缺少的证券为空列
+
+2. 弱转强技术筛选
+   - rzq_technical_filter(panel, ma_period, volume_ratio)  # 宽表向量化版本
+   - rzq_technical_filter_loop(df, ma_period, volume_ratio)  # 原逐只版本（对照用）
+   - 条件：收盘 > 前日最低、收盘 > MA、成交量 > 前日成交量且 < volume_ratio 倍前日成交量、收盘 > 1，
+     MA/前日最低/前日成交量不能为空，行数不足 ma_period + 1 的证券不参与
+
+3. 研究环境对照
+   - benchmark_rzq_filter(date, index='399101.XSHE')  # 同一份数据分别用两种方式计算，比较耗时与结果
+
+使用说明：
+1. 将本文件放在聚宽研究根目录
+2. 在策略中导入：from price_panel_lib import *
+3. 研究中运行 benchmark_rzq_filter('2024-06-03') 核对结果一致
+"""
+
+# 聚宽API导入
+try:
+    from kuanke.user_space_api import *
+except:
+    pass
+
+import time
+
+import numpy as np
+import pandas as pd
+
+
+class PricePanel:
+    """
+    日线宽表：每个字段一个 (交易日, 证券) 数组
+    """
+
+    def __init__(self, codes, days, fields, rows=None):
+        self.codes = codes
+        self.days = days
+        self.fields = fields
+        self.rows = rows if rows is not None else np.full(len(codes), len(days), dtype=np.int64)
+
+    @classmethod
+    def from_frame(cls, df, fields=None):
+        """
+        get_price(panel=False) 的长表 -> 宽表
+
+        Args:
+            df: 含 time、code 列的长表
+            fields: 需要的字段，默认除 time/code 以外的全部列
+        """
+        if df is None or df.empty:
+            return cls(np.empty(0, dtype=object), [], {f: np.empty((0, 0)) for f in fields or []},
+                       np.empty(0, dtype=np.int64))
+        fields = fields or [c for c in df.columns if c not in ('time', 'code', 'index')]
+        wide = df.pivot(index='time', columns='code', values=fields)
+        codes = wide.columns.levels[1] if isinstance(wide.columns, pd.MultiIndex) else wide.columns
+        codes = pd.Index(sorted(codes))
+        rows = df['code'].value_counts().reindex(codes).fillna(0).values.astype(np.int64)
+        arrays = {f: wide[f].reindex(columns=codes).values.astype(float) for f in fields}
+        return cls(np.asarray(codes, dtype=object), list(wide.index), arrays, rows)
+
+    def compact(self, field='close'):
+        """
+        每列把 field 为空的行（停牌、未上市）移到顶部，有成交的K线按原顺序排在底部
+
+        多只证券一次 get_price 不能逐只跳过停牌，用 fill_paused=False 多取几天后压缩，
+        底部 k 行即为 attribute_history(count=k, skip_paused=True)；rows 为有成交的行数
+
+        Returns:
+            PricePanel: 新宽表（days 不再对应具体交易日）
+        """
+        valid = ~np.isnan(self.fields[field])
+        order = np.argsort(valid, axis=0, kind='stable')
+        arrays = {f: np.take_along_axis(a, order, axis=0) for f, a in self.fields.items()}
+        return PricePanel(self.codes, self.days, arrays, valid.sum(axis=0))
+
+    def reindex(self, codes):
+        """列按 codes 重新排列；宽表中没有的证券为空列，rows 为0"""
+        codes = list(codes)
+        pos = pd.Index(self.codes).get_indexer(codes)
+        present = pos >= 0
+        arrays = {}
+        for f, a in self.fields.items():
+            out = np.full((len(self.days), len(codes)), np.nan)
+            out[:, present] = a[:, pos[present]]
+            arrays[f] = out
+        rows = np.zeros(len(codes), dtype=np.int64)
+        rows[present] = self.rows[pos[present]]
+        return PricePanel(np.asarray(codes, dtype=object), self.days, arrays, rows)
+
+    def __getitem__(self, field):
+        return self.fields[field]
+
+    def __len__(self):
+        return len(self.codes)
+
+
+def price_panel(stocks, end_date, count, fields, **kwargs):
+    """
+    一次 get_price 取 count 个交易日并转为宽表（默认 fq='pre'、fill_paused=True，与 get_price 相同）
+    """
+    df = get_price(stocks, end_date=end_date, count=count, frequency='1d', fields=fields, panel=False, **kwargs)
+    return PricePanel.from_frame(df, fields)
+
+
+# ==================== 弱转强技术筛选 ====================
+
+def rzq_technical_filter(panel, ma_period=10, volume_ratio=10):
+    """
+    宽表向量化的弱转强技术筛选
+
+    Args:
+        panel: 至少含 close/low/volume、ma_period + 1 个交易日的 PricePanel
+        ma_period: 均线周期
+        volume_ratio: 成交量相对前日的倍数上限
+
+    Returns:
+        list: 满足条件的证券，按代码排序
+    """
+    if len(panel) == 0 or len(panel.days) < ma_period + 1:
+        return []
+    close, low, volume = panel['close'], panel['low'], panel['volume']
+    ma = close[-ma_period:].mean(axis=0)      # 窗口内有空值时为 NaN，与 rolling 默认 min_periods 一致
+    last_close, last_volume = close[-1], volume[-1]
+    prev_low, prev_volume = low[-2], volume[-2]
+    with np.errstate(invalid='ignore'):
+        ok = ((panel.rows >= ma_period + 1)
+              & ~np.isnan(ma) & ~np.isnan(prev_low) & ~np.isnan(prev_volume)
+              & (last_close > prev_low)
+              & (last_close > ma)
+              & (last_volume > prev_volume)
+              & (last_volume < volume_ratio * prev_volume)
+              & (last_close > 1))
+    return panel.codes[ok].tolist()
+
+
+def rzq_technical_filter_loop(df, ma_period=10, volume_ratio=10):
+    """原逐只 groupby 版本，保留用于对照"""
+    valid_stocks = []
+    for code, group in df.groupby('code'):
+        if len(group) < ma_period + 1:
+            continue
+        group = group.copy()
+        group['ma'] = group['close'].rolling(ma_period).mean()
+        group['prev_low'] = group['low'].shift(1)
+        group['prev_volume'] = group['volume'].shift(1)
+        last_row = group.iloc[-1]
+        if (not pd.isna(last_row['ma']) and
+                not pd.isna(last_row['prev_low']) and
+                not pd.isna(last_row['prev_volume']) and
+                last_row['close'] > last_row['prev_low'] and
+                last_row['close'] > last_row['ma'] and
+                last_row['volume'] > last_row['prev_volume'] and
+                last_row['volume'] < volume_ratio * last_row['prev_volume'] and
+                last_row['close'] > 1):
+            valid_stocks.append(code)
+    return valid_stocks
+
+
+def _best_ms(func, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def benchmark_rzq_filter(date, index='399101.XSHE', ma_period=10, volume_ratio=10, repeat=3):
+    """
+    研究环境对照：同一份日线分别用逐只 groupby 与宽表计算，比较耗时与结果
+
+    Args:
+        date: 数据截止日（策略中的 previous_date）
+        index: 指数代码，默认中小综指全部成分股
+
+    Returns:
+        dict: {'stocks', 'fetch_ms', 'loop_ms', 'panel_ms', 'selected', 'equal', 'only_loop', 'only_panel'}
+    """
+    stocks = get_index_stocks(index, date=date)
+    fields = ['close', 'low', 'volume']
+    fetch_ms, df = _best_ms(lambda: get_price(stocks, count=ma_period + 1, frequency='1d', fields=fields,
+                                              end_date=date, panel=False).reset_index(), 1)
+    loop_ms, old = _best_ms(lambda: rzq_technical_filter_loop(df, ma_period, volume_ratio), repeat)
+    panel_ms, new = _best_ms(lambda: rzq_technical_filter(PricePanel.from_frame(df, fields), ma_period,
+                                                          volume_ratio), repeat)
+    result = {
+        'stocks': len(stocks),
+        'fetch_ms': fetch_ms,
+        'loop_ms': loop_ms,
+        'panel_ms': panel_ms,
+        'selected': len(new),
+        'equal': old == new,
+        'only_loop': sorted(set(old) - set(new)),
+        'only_panel': sorted(set(new) - set(old)),
+    }
+    print(f"{index} {date} 成分股 {len(stocks)} 只，取数 {fetch_ms:.0f}ms；逐只 {loop_ms:.1f}ms，"
+          f"宽表 {panel_ms:.1f}ms（含转宽表），入选 {len(new)} 只，结果{'一致' if result['equal'] else '不一致'}")
+    if not result['equal']:
+        print(f"  仅逐只: {result['only_loop']}\n  仅宽表: {result['only_panel']}")
+    return result
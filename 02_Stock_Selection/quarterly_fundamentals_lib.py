@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+聚宽季度财务数据库 - 多季度财报存为 (季度 × 股票 × 字段) 数组，只在有新财报时增量更新
+原做法每次调用 get_history_fundamentals 取几年的季度数据，再 groupby('code').apply / rolling 逐只计算；
+同一批股票的加权利润率、净利润波动率各取一遍，窗口大部分重叠
+
+功能模块：
+1. 季度数组
+   - values[季度, 股票, 字段]，季度为绝对季度序号（年 * 4 + 季度 - 1），缺失为 NaN
+   - latest[股票] 为截至观察日已发布的最近一期；窗口取每只股票自己最近的 count 期（与 get_history_fundamentals 一致）
+   - 新股票、新字段、窗口不够深、观察日回退时按 max(count, depth) 期回补
+   - 观察日变化时只取每只股票最近一期（count=1）判断是否有新财报；
+     跳过了若干期（如年报与一季报同时发布）时再补齐中间几期
+
+2. 向量化计算
+   - quarterly_window(stocks, fields, watch_date, count)  # (有数据的股票, {字段: (count, 股票) 数组})
+   - weighted_mean(weights, values)  # 按列加权平均，空值不计（与 pandas sum 一致）
+   - growth_volatility(values, window=4)  # 滚动 window 期合计的环比增长率标准差
+
+使用说明：
+1. 将本文件放在聚宽研究根目录
+2. 在策略中导入：from quarterly_fundamentals_lib import *
+3. codes, w = quarterly_window(stocks, [income.operating_revenue, indicator.net_profit_margin], date, 4)
+4. 窗口按日历季度对齐：某只股票中间缺一期时该期为 NaN，原按行滚动的写法会跨过缺失期
+5. 增量更新假定财报按季度顺序发布（年报不晚于次年一季报）；更正以前各期的财报不会被发现，
+   需要时调用 reset_quarterly_store() 清空重取
+"""
+
+# 聚宽API导入
+try:
+    from kuanke.user_space_api import *
+except:
+    pass
+
+import numpy as np
+import pandas as pd
+
+_NO_DATA = np.iinfo(np.int64).min // 2     # latest/first：没有数据
+_UNKNOWN = np.iinfo(np.int64).max          # first：需要回补
+
+
+def _quarter(stat_dates):
+    """statDate（季度末日期）-> 绝对季度序号"""
+    ts = pd.to_datetime(pd.Series(stat_dates))
+    return (ts.dt.year * 4 + (ts.dt.month - 1) // 3).values.astype(np.int64)
+
+
+def _field_name(field):
+    return getattr(field, 'key', None) or str(field).split('.')[-1]
+
+
+class QuarterlyStore:
+    """
+    季度财务数组：values[季度, 股票, 字段]
+    """
+
+    def __init__(self, depth=12):
+        """
+        Args:
+            depth: 回补时至少取的期数（默认3年，覆盖常用窗口，避免窗口变长时重取）
+        """
+        self.depth = depth
+        self.fields = {}                              # 字段名 -> 字段
+        self.codes = {}                               # 股票 -> 列号
+        self.q0 = None                                # values 第0行对应的季度序号
+        self.values = np.empty((0, 0, 0))
+        self.latest = np.empty(0, dtype=np.int64)     # 最近一期季度序号，_NO_DATA 为没有数据
+        self.first = np.empty(0, dtype=np.int64)      # 已取到的最早季度序号（之前的期已确认不在窗口内）
+        self.watch = np.empty(0, dtype=object)        # 每只股票最近一次更新时的观察日
+        self.fetches = 0                              # get_history_fundamentals 调用次数
+
+    def _add_fields(self, fields):
+        new = [f for f in fields if _field_name(f) not in self.fields]
+        if not new:
+            return
+        for f in new:
+            self.fields[_field_name(f)] = f
+        # 已存的股票没有新字段，全部标记为需要回补
+        self.values = np.concatenate([self.values, np.full(self.values.shape[:2] + (len(new),), np.nan)], axis=2)
+        self.first[:] = _UNKNOWN
+
+    def _add_codes(self, stocks):
+        new = [c for c in dict.fromkeys(stocks) if c not in self.codes]
+        if not new:
+            return
+        for c in new:
+            self.codes[c] = len(self.codes)
+        n = len(new)
+        self.values = np.concatenate([self.values, np.full((self.values.shape[0], n, len(self.fields)), np.nan)], axis=1)
+        self.latest = np.concatenate([self.latest, np.full(n, _NO_DATA, dtype=np.int64)])
+        self.first = np.concatenate([self.first, np.full(n, _UNKNOWN, dtype=np.int64)])
+        self.watch = np.concatenate([self.watch, np.full(n, None, dtype=object)])
+
+    def _reserve(self, q_min, q_max):
+        """季度轴覆盖 [q_min, q_max]"""
+        if self.q0 is None:
+            self.q0 = q_min
+        before = max(self.q0 - q_min, 0)
+        after = max(q_max - (self.q0 + self.values.shape[0] - 1), 0)
+        if before or after:
+            n, f = self.values.shape[1:]
+            self.values = np.concatenate([np.full((before, n, f), np.nan), self.values,
+                                          np.full((after, n, f), np.nan)], axis=0)
+            self.q0 -= before
+
+    def _fetch(self, stocks, watch_date, count):
+        """
+        取 stocks 最近 count 期并写入
+
+        Returns:
+            (np.ndarray, np.ndarray): 有数据的股票列号、其中每只返回的最近一期季度序号
+        """
+        df = get_history_fundamentals(stocks, fields=list(self.fields.values()), watch_date=watch_date,
+                                      count=count, interval='1q', stat_by_year=False)
+        self.fetches += 1
+        if df is None or len(df) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        quarters = _quarter(df['statDate'])
+        cols = np.array([self.codes[c] for c in df['code']], dtype=np.int64)
+        self._reserve(quarters.min(), quarters.max())
+        data = np.column_stack([pd.to_numeric(df[name], errors='coerce').values.astype(float)
+                                for name in self.fields])
+        self.values[quarters - self.q0, cols] = data
+        latest = np.full(len(self.codes), _NO_DATA, dtype=np.int64)
+        np.maximum.at(latest, cols, quarters)
+        got = np.unique(cols)
+        return got, latest[got]
+
+    def _backfill(self, cols, watch_date, count):
+        count = max(count, self.depth)
+        self.values[:, cols] = np.nan
+        self.latest[cols] = _NO_DATA
+        got, latest = self._fetch(self.code_list(cols), watch_date, count)
+        self.latest[got] = latest
+        self.first[cols] = _NO_DATA                   # 没有数据的股票：之前各期都不存在
+        self.first[got] = latest - count + 1
+
+    def _refresh(self, cols, watch_date):
+        """观察日变化：取最近一期，有新财报时写入，跳期时补齐中间各期"""
+        got, latest = self._fetch(self.code_list(cols), watch_date, 1)
+        old = self.latest[got]
+        gap = np.where(old == _NO_DATA, 0, latest - old)
+        self.latest[got] = np.maximum(old, latest)
+        # 第一次有财报的股票（如新股）之前各期可能也有数据，改为回补
+        self.first[got[old == _NO_DATA]] = _UNKNOWN
+        skipped = got[gap > 1]
+        if len(skipped):
+            self._fetch(self.code_list(skipped), watch_date, int(gap.max()))
+
+    def code_list(self, cols):
+        names = np.empty(len(self.codes), dtype=object)
+        names[list(self.codes.values())] = list(self.codes)
+        return names[cols].tolist()
+
+    def ensure(self, stocks, fields, watch_date, count):
+        """保证 stocks 截至 watch_date 的最近 count 期已在数组中"""
+        watch_date = str(pd.Timestamp(watch_date).date())
+        self._add_fields(fields)
+        self._add_codes(stocks)
+        cols = np.array([self.codes[c] for c in dict.fromkeys(stocks)], dtype=np.int64)
+        if len(cols) == 0:
+            return cols
+        watch = self.watch[cols]
+        stale = np.array([w is None or w > watch_date for w in watch], dtype=bool) | (self.first[cols] == _UNKNOWN)
+        refresh = cols[~stale & (watch != watch_date)]
+        if len(refresh):
+            self._refresh(refresh, watch_date)
+        shallow = (self.latest[cols] != _NO_DATA) & (self.first[cols] > self.latest[cols] - count + 1)
+        backfill = cols[stale | shallow]
+        if len(backfill):
+            self._backfill(backfill, watch_date, count)
+        self.watch[cols] = watch_date
+        return cols
+
+    def window(self, stocks, fields, watch_date, count):
+        """
+        每只股票最近 count 期
+
+        Returns:
+            (list, dict): 有数据的股票（按代码排序，与 groupby('code') 一致），{字段名: (count, 股票) 数组}
+        """
+        cols = self.ensure(stocks, fields, watch_date, count)
+        codes = np.array(self.code_list(cols), dtype=object)
+        has = self.latest[cols] != _NO_DATA
+        order = np.argsort(codes[has], kind='stable')
+        cols, codes = cols[has][order], codes[has][order]
+        names = list(self.fields)
+        if len(cols) == 0:
+            return [], {_field_name(f): np.empty((count, 0)) for f in fields}
+        # 每只股票自己的最近 count 期：(count, 股票) 的季度行号
+        quarters = self.latest[cols][None, :] - np.arange(count - 1, -1, -1)[:, None] - self.q0
+        inside = (quarters >= 0) & (quarters < self.values.shape[0])
+        rows = np.clip(quarters, 0, self.values.shape[0] - 1)
+        result = {}
+        for f in fields:
+            block = self.values[rows, cols[None, :], names.index(_field_name(f))]
+            result[_field_name(f)] = np.where(inside, block, np.nan)
+        return codes.tolist(), result
+
+    def stats(self):
+        return {'fetches': self.fetches, 'stocks': len(self.codes), 'quarters': self.values.shape[0],
+                'fields': list(self.fields)}
+
+
+# 创建全局季度财务实例
+quarterly_store = QuarterlyStore()
+
+# ==================== 导出函数 ====================
+
+def quarterly_window(stocks, fields, watch_date, count):
+    """stocks 截至 watch_date 的最近 count 期：(有数据的股票, {字段名: (count, 股票) 数组})"""
+    return quarterly_store.window(stocks, fields, watch_date, count)
+
+def reset_quarterly_store():
+    """清空季度数组，下次查询时全部重取"""
+    quarterly_store.__init__(quarterly_store.depth)
+
+def weighted_mean(weights, values):
+    """按列加权平均：sum(w * v) / sum(w)，空值不计"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nansum(weights * values, axis=0) / np.nansum(weights, axis=0)
+
+def growth_volatility(values, window=4):
+    """
+    按列：滚动 window 期合计 -> 环比增长率（空值沿用上一期，与 pct_change 一致）-> 标准差(ddof=1)
+    """
+    count = len(values)
+    n = values.shape[1]
+    if count < window:
+        return np.full(n, np.nan)
+    valid = ~np.isnan(values)
+    total = np.vstack([np.zeros((1, n)), np.cumsum(np.where(valid, values, 0.0), axis=0)])
+    filled = np.vstack([np.zeros((1, n)), np.cumsum(valid, axis=0)])
+    full = (filled[window:] - filled[:-window]) == window
+    rolling = np.where(full, total[window:] - total[:-window], np.nan)
+    # 前向填充
+    idx = np.where(~np.isnan(rolling), np.arange(len(rolling))[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    padded = rolling[idx, np.arange(n)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        growth = padded[1:] / padded[:-1] - 1
+        enough = (~np.isnan(growth)).sum(axis=0) >= 2
+        std = np.nanstd(np.where(enough, growth, 0.0), axis=0, ddof=1)
+    return np.where(enough, std, np.nan)
@@ -37,6 +37,13 @@ except ImportError:
     NOTIFICATION_AVAILABLE = False
     log.warning("通知库未找到，将跳过通知功能")
 
+# 导入信号日志（实盘中每个子账户对应独立的QMT资金账号，调仓后写出子账户目标权重）
+try:
+    from signal_log import SignalLogWriter, SIDE_WEIGHT
+    SIGNAL_LOG_AVAILABLE = True
+except ImportError:
+    SIGNAL_LOG_AVAILABLE = False
+
 # ========= 初始化 =========
 def initialize(context):
     # 设定基准
@@ -118,7 +125,9 @@ def strategy_trade(context):
     # 执行子策略交易
     for strategy_name, strategy in g.strategys.items():
         log.info(f"=== 执行 {strategy_name} 交易 ===")
+        held_before = get_subportfolio_amounts(context, strategy.subportfolio_index)
         strategy.my_trade(context)
+        publish_target_weights(context, strategy, held_before)
         
         # 记录交易摘要
         subportfolio = context.subportfolios[strategy.subportfolio_index]
@@ -139,6 +148,32 @@ def strategy_trade(context):
     else:
         log.info("今日无交易，跳过交易信号通知")
 
+def get_subportfolio_amounts(context, index):
+    """子账户持仓数量 {代码: 数量}"""
+    sub = context.subportfolios[index]
+    return {s: p.total_amount for s, p in sub.long_positions.items()}
+
+def publish_target_weights(context, strategy, held_before):
+    """
+    子账户持仓有变化时写出目标权重（SIDE_WEIGHT，占子账户总值的比例，卖出的代码权重为0），
+    QMT端 account_fanout 按每个实盘账户的权益换算成目标市值并行下单
+    """
+    if not SIGNAL_LOG_AVAILABLE:
+        return
+    sub = context.subportfolios[strategy.subportfolio_index]
+    held_after = get_subportfolio_amounts(context, strategy.subportfolio_index)
+    if held_after == held_before or sub.total_value <= 0:
+        return
+    if getattr(g, 'signal_writer', None) is None:
+        g.signal_writer = SignalLogWriter('signals', use_jq_file=True)
+    # 每个子账户一个回调ID：模拟盘重启重跑调仓时写出相同的幂等键，QMT端不会重复下单
+    with g.signal_writer.callback(f"strategy_trade-{strategy.subportfolio_index}", context.current_dt):
+        for code in sorted(set(held_before) | set(held_after)):
+            weight = sub.long_positions[code].value / sub.total_value if code in held_after else 0.0
+            g.signal_writer.append(strategy.subportfolio_index, code, SIDE_WEIGHT, weight,
+                                   reason='rebalance', ts=context.current_dt)
+            log.info(f"{strategy.name} 目标权重 {code}: {weight:.2%}")
+
 def print_trade_info(context):
     """打印交易信息"""
     orders = get_orders()
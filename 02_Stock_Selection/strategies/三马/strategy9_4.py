@@ -53,6 +53,93 @@ from prettytable import PrettyTable
 
 # from nredistrade import *  # 导入实盘依赖
 
+# 导入Redis委托意图通道(与 nredistrade 的 setup_redis_trade 调用方式一致, 未 setup 时不发布)
+try:
+    from redis_channel import publish_order_intent, redis_batched
+    REDIS_CHANNEL_AVAILABLE = True
+except ImportError:
+    REDIS_CHANNEL_AVAILABLE = False
+
+    def redis_batched(func):
+        return func
+
+# 导入端到端延迟追踪(开平仓时分配追踪ID, 随委托意图传到QMT端)
+try:
+    from latency_trace import new_trace, trace_hop, flush_trace
+    TRACE_AVAILABLE = True
+except ImportError:
+    TRACE_AVAILABLE = False
+
+    def new_trace(hop='intent'):
+        return 0
+
+    def trace_hop(trace_id, hop, ts_ns=None):
+        pass
+
+    def flush_trace(context=None):
+        pass
+
+# 导入持仓风控引擎（整本持仓向量化判定止盈止损）
+try:
+    from position_risk_lib import *
+    RISK_ENGINE_AVAILABLE = True
+except ImportError:
+    RISK_ENGINE_AVAILABLE = False
+
+# 导入盘中分钟线缓存(当日累计成交量增量更新)
+try:
+    from intraday_bar_cache_lib import *
+    BAR_CACHE_AVAILABLE = True
+except ImportError:
+    BAR_CACHE_AVAILABLE = False
+
+# 导入定时任务时间预算库(14:49/14:50 紧挨的任务记录耗时并设置软截止)
+try:
+    from job_budget_lib import *
+    JOB_BUDGET_AVAILABLE = True
+except ImportError:
+    JOB_BUDGET_AVAILABLE = False
+
+    def budgeted_job(name, deadline=None, budget=None):
+        return lambda func: func
+
+    def job_degraded():
+        return False
+
+# 导入委托轧差库(同一回调内各策略对同一证券的委托合并为一笔)
+try:
+    from order_netting_lib import *
+    ORDER_NETTING_AVAILABLE = True
+except ImportError:
+    ORDER_NETTING_AVAILABLE = False
+
+    def order_netted(func):
+        return func
+
+# 导入持仓核对引擎(各策略账本与账户持仓逐分钟核对, 保持 g.stock_strategy 与实际持仓一致)
+try:
+    from position_reconcile_lib import *
+    POSITION_RECONCILE_AVAILABLE = True
+except ImportError:
+    POSITION_RECONCILE_AVAILABLE = False
+
+# 导入涨跌停状态位图(昨日涨停判断改为位运算, 每天只增量拉取一天)
+try:
+    from limit_state_lib import *
+    LIMIT_STATE_AVAILABLE = True
+except ImportError:
+    LIMIT_STATE_AVAILABLE = False
+
+# 导入基本面快照(同一天的 get_fundamentals 共用一份按表取回的快照, 过滤/排序在本地计算)
+try:
+    from fundamentals_snapshot_lib import *
+    FUNDAMENTALS_SNAPSHOT_AVAILABLE = True
+except ImportError:
+    FUNDAMENTALS_SNAPSHOT_AVAILABLE = False
+
+    def cached_fundamentals(q, date=None, context=None):
+        return get_fundamentals(q, date=date)
+
 """ ====================== 基础配置 ====================== """
 
 
@@ -99,6 +186,7 @@ def set_params(context):
     g.starting_cash = 500000 if 1 in g.portfolio_value_proportion else 200000  # 策略初始资金
     g.stock_strategy = {}  # 记录股票对应的策略, 反向映射方便检索
     g.strategy_holdings = {1: [], 2: [], 3: [], 4: []}
+    g.position_ledgers = None  # 各策略持仓股数账本(持仓核对引擎可用时首次核对前创建)
     # 记录策略初始的金额, 用于计算各策略收益
     g.strategy_starting_cash = {
         1: g.starting_cash * g.portfolio_value_proportion[0],  # 小市值 初始资金
@@ -127,6 +215,11 @@ def set_params(context):
     g.use_move_stoploss = False  # 是否使用移动止损, 不太适用, 先做保留
     g.stoploss_limit = 0.12  # 止损线
     g.stop_loss_tracking = {}  # 移动止损跟踪字典, 记录持仓最高收益价格
+    if RISK_ENGINE_AVAILABLE:
+        # 风控簿: 盈利100%止盈, 移动止损与固定止损二选一
+        g.risk_book = PositionRiskBook(tp=1.0,
+                                       sl=None if g.use_move_stoploss else g.stoploss_limit,
+                                       trail=g.stoploss_limit if g.use_move_stoploss else None)
 
     # 异常处理窗口期检查
     g.check_after_no_buy = False  # 检查后不再买入时间
@@ -274,7 +367,7 @@ def set_params(context):
 def initialize(context):
     set_backtest()  # 设置回测条件
     set_params(context)  # 设置参数
-    # setup_redis_trade(context, 'strategy1')  # 设置实盘
+    # setup_redis_trade(context, 'strategy1')  # 设置实盘(nredistrade, 或 from redis_channel import setup_redis_trade)
 
     # 过滤日志
     log.set_level('order', 'error')
@@ -327,6 +420,11 @@ def initialize(context):
     run_daily(make_record, '15:01')  # 记录各策略每日收益
     run_daily(print_summary, '15:02')  # 打印每日收益
 
+    # 持仓核对: 每分钟修正策略账本, 尾盘卖出不属于任何策略的持仓(送股、手工买入)
+    if POSITION_RECONCILE_AVAILABLE:
+        run_daily(reconcile_positions, 'every_bar')
+        run_daily(sell_unowned_positions, '14:55')
+
 
 """ ====================== 策略1: 小市值策略 ====================== """
 
@@ -354,7 +452,7 @@ def _xsz_get_stock_list(context):
     # 获取流通市值最小的50个股票
     q = query(valuation.code).filter(valuation.code.in_(initial_list)).order_by(
         valuation.circulating_market_cap.asc()).limit(50)
-    initial_list = list(get_fundamentals(q).code)
+    initial_list = list(cached_fundamentals(q, context=context).code)
     # 选取每股收益>0的股票
     # q = query(valuation.code, indicator.eps) \
     #     .filter(valuation.code.in_(initial_list)) \
@@ -364,7 +462,7 @@ def _xsz_get_stock_list(context):
     #     .order_by(valuation.market_cap.asc())
 
     q = query(valuation.code).filter(valuation.code.in_(initial_list)).order_by(valuation.market_cap.asc())
-    initial_list = list(get_fundamentals(q).code)
+    initial_list = list(cached_fundamentals(q, context=context).code)
     initial_list = initial_list[:30]
     # 每个行业获取1个股票，总共获取g.stock_num个行业的股票
     final_list = filter_industry_stock(initial_list)[:g.xsz_stock_num]
@@ -395,7 +493,7 @@ def xsz_get_stock_list(context):
         fundamentals.indicator.roa > 0.10,
         # indicator.inc_revenue_year_on_year > 0.20,  # v7 新增营收增长率, 屏蔽则为 v6
     ).order_by(valuation.market_cap.asc()).limit(50)
-    df = get_fundamentals(q)
+    df = cached_fundamentals(q, context=context)
     if df.empty:
         return []
     final_list = list(df.code)
@@ -407,6 +505,8 @@ def xsz_get_stock_list(context):
 
 
 # 调整持仓
+@redis_batched
+@order_netted
 def xsz_adjustment(context):
     # 近期有顶背离信号时暂停调仓（规避系统性风险）
     if g.DBL_control and True in g.dbl[-g.check_dbl_days:]:
@@ -463,8 +563,8 @@ def xsz_adjustment(context):
     if buy_list and available_cash > 0:
         cash_per_stock = available_cash / len(buy_list)
         for stock in buy_list:
-            if open_position(context, stock, cash_per_stock, 1):
-                print(f"小市值策略买入: {stock}, 金额: {cash_per_stock:.2f}")
+            open_position(context, stock, cash_per_stock, 1,
+                          on_filled=lambda o, s=stock: print(f"小市值策略买入: {s}, 金额: {cash_per_stock:.2f}"))
 
 
 """ ====================== 策略2: ETF反弹策略 ====================== """
@@ -507,6 +607,9 @@ def zz_2000_trade(context):
         print(f"符合中证2000买入条件：{etf_index}")
 
 
+@budgeted_job('strategy_2_sell', deadline='14:50')
+@redis_batched
+@order_netted
 def strategy_2_sell(context):
     g.buy_list = []
     sell_list = []
@@ -556,6 +659,9 @@ def strategy_2_sell(context):
         print(f"策略2今日无反弹可购买选项")
 
 
+@budgeted_job('strategy_2_buy', budget=30)
+@redis_batched
+@order_netted
 def strategy_2_buy(context):
     g.buy_list = list(set(g.buy_list) - set(g.strategy_holdings[2]))
     if len(g.buy_list) > 0:
@@ -602,6 +708,8 @@ def get_etf_rank(context, etf_pool):
 
 
 # ETF交易
+@redis_batched
+@order_netted
 def trade(context):
     # 获取动量最高的ETF
     rank_df = get_etf_rank(context, g.etf_pool_3)
@@ -641,6 +749,8 @@ def trade(context):
 
 
 """ ====================== 策略: 白马攻防策略 ====================== """
+@redis_batched
+@order_netted
 def bm_adjust_position(context):
     #if context.current_dt.month != context.previous_date.month or len(context.portfolio.positions) == 0:
     print(f"调仓时间 {context.current_dt}" )
@@ -667,9 +777,10 @@ def bm_adjust_position(context):
         value = context.portfolio.total_value * g.portfolio_value_proportion[3] / g.stock_num_2
         for stock in buy_stocks:
             if stock not in g.strategy_holdings[4]:
-                if open_position(context, stock, value, 4):
-                    if len(g.strategy_holdings[4]) >= g.stock_num_2:
-                        break
+                # 轧差窗口内已登记未发出的买入也占用持仓名额
+                open_position(context, stock, value, 4)
+                if len(g.strategy_holdings[4]) >= g.stock_num_2:
+                    break
         
 def track_back_market_temp(context):# 数据回滚两年判断市场温度       
     long_index300 = list(attribute_history('000300.XSHG', 220 * 3, '1d', ('close'), df=False)['close'])
@@ -788,7 +899,7 @@ def bm_before_market_open(context):
         )
 
     """*****************************************************************************************"""
-    df = get_fundamentals(q)
+    df = cached_fundamentals(q, context=context)
     df.index = df['code'].values
 
     # 按照因子给股票排序（相当于各因子平权）
@@ -845,6 +956,8 @@ def moment_rank(stock_pool, days, ll, hh):
 
 
 # 大盘顶背离
+@redis_batched
+@order_netted
 def check_dbl(context, market_index='399101.XSHE'):
     """
         大盘顶背离检测：通过MACD判断市场潜在反转风险
@@ -931,6 +1044,8 @@ def check_dbl(context, market_index='399101.XSHE'):
 
 # 尾盘记录各个策略的收益
 def make_record(context):
+    # 收盘后写出未经 redis_batched 回调写出的追踪跳点
+    flush_trace(context)
     positions = context.portfolio.positions
     if not positions:
         return
@@ -1039,11 +1154,15 @@ def print_summary(context):
 
 
 # 小市值换手检测
+@redis_batched
+@order_netted
 def xsz_huanshou_check(context):
     huanshou(context, stock_list=g.strategy_holdings[1][:])
 
 
 # ETF轮动成交量检测
+@redis_batched
+@order_netted
 def etf_volume_check(context):
     # 检测7日均值的双倍成交量
     # print(f"ETF轮动成交量检测: 当前持仓 {g.strategy_holdings[3]}")
@@ -1056,6 +1175,8 @@ def etf_volume_check(context):
 
 
 # ETF轮动日内止损检测
+@redis_batched
+@order_netted
 def etf_stop_loss_by_cur_day(context):
     holdings = set(g.strategy_holdings[3])
     # 检测日内亏损
@@ -1075,8 +1196,11 @@ def get_stock_name(security):
 
 
 # 封装实盘下单函数
-def my_order_target_value(context, security, value):
+def my_order_target_value(context, security, value, trace_id=0):
     o = order_target_value(security, value)
+    trace_hop(trace_id, 'order')
+    if o and REDIS_CHANNEL_AVAILABLE:
+        publish_order_intent(context, security, value, o, trace_id=trace_id)
     if o:
         security_name = get_stock_name(security)
         stock_show = f"{security} {security_name[:8]}: "
@@ -1099,18 +1223,78 @@ def my_order_target_value(context, security, value):
                 return o
 
 
-# 开仓买入并记录策略持仓
-def open_position(context, security, value, strategy_id):
-    order = my_order_target_value(context, security, value)
+# 账户中该证券的持仓股数
+def held_amount(context, security):
+    positions = context.portfolio.positions
+    return positions[security].total_amount if security in positions else 0
+
+
+# 各策略持仓股数账本, 首次使用时按 g.stock_strategy 与当前持仓建立
+def get_position_ledgers(context):
+    if getattr(g, 'position_ledgers', None) is None:
+        g.position_ledgers = {strategy_id: PositionLedger() for strategy_id in g.strategy_holdings}
+        for stock, strategy_id in g.stock_strategy.items():
+            amount = held_amount(context, stock)
+            if amount > 0:
+                g.position_ledgers[strategy_id][stock] = amount
+    return g.position_ledgers
+
+
+# 下单后按委托数量记账(一只证券只属于一个策略), 实际成交不同时由每分钟的持仓核对修正
+def record_ledger(context, security, strategy_id, held_before, order):
+    if not POSITION_RECONCILE_AVAILABLE or not order:
+        return
+    target = held_before + (order.amount if order.is_buy else -order.amount)
+    for sid, ledger in get_position_ledgers(context).items():
+        if sid == strategy_id and target > 0:
+            ledger[security] = target
+        else:
+            ledger.pop(security, None)
+
+
+# 每分钟核对策略账本与账户持仓, 账本归零的证券同步移出策略持仓列表
+def reconcile_positions(context):
+    intents = reconcile_ledgers(context, get_position_ledgers(context))
+    for intent in intents:
+        if intent['action'] == 'adopt' and intent['target'] == 0:
+            stock, strategy_id = intent['code'], intent['strategy']
+            stock in g.strategy_holdings[strategy_id] and g.strategy_holdings[strategy_id].remove(stock)
+            if g.stock_strategy.get(stock) == strategy_id:
+                g.stock_strategy.pop(stock)
+    return intents
+
+
+# 尾盘卖出不属于任何策略的持仓(涨停不卖)
+@redis_batched
+def sell_unowned_positions(context):
+    current_data = get_current_data()
+    for stock in unowned_positions(reconcile_positions(context)):
+        if current_data[stock].last_price < current_data[stock].high_limit:
+            if my_order_target_value(context, stock, 0, new_trace()):
+                log.info(f"卖出{stock}因未记录在策略持仓中(送股/手工买入)")
+
+
+# 开仓买入并记录策略持仓; on_filled(order) 在委托成功后调用(轧差窗口内在净额委托发出后调用)
+def open_position(context, security, value, strategy_id, on_filled=None):
+    if ORDER_NETTING_AVAILABLE and order_netting.active:
+        return open_position_netted(context, security, value, strategy_id, on_filled)
+    held_before = held_amount(context, security)
+    order = my_order_target_value(context, security, value, new_trace())
+    record_ledger(context, security, strategy_id, held_before, order)
     if order:
         security not in g.strategy_holdings[strategy_id] and g.strategy_holdings[strategy_id].append(security)
         g.stock_strategy[security] = strategy_id
+        on_filled and on_filled(order)
     return order
 
 
 # 闭仓卖出并清空策略持仓
 def close_position(context, security):
-    order = my_order_target_value(context, security, 0)
+    if ORDER_NETTING_AVAILABLE and order_netting.active:
+        return close_position_netted(context, security)
+    held_before = held_amount(context, security)
+    order = my_order_target_value(context, security, 0, new_trace())
+    record_ledger(context, security, g.stock_strategy.get(security), held_before, order)
     if order:
         strategy_id = g.stock_strategy[security]
         # 持仓列表移除
@@ -1122,7 +1306,61 @@ def close_position(context, security):
     return order
 
 
+# 轧差窗口内开仓: 先记录策略持仓(占用持仓名额), 净额委托未成交时回滚
+# 委托在窗口关闭时才发出, 此处返回 None, 成功后的处理放在 on_filled
+def open_position_netted(context, security, value, strategy_id, on_filled=None):
+    trace_id = new_trace()
+    was_held = security in g.strategy_holdings[strategy_id]
+    prev_strategy = g.stock_strategy.get(security)
+    held_before = held_amount(context, security)
+    was_held or g.strategy_holdings[strategy_id].append(security)
+    g.stock_strategy[security] = strategy_id
+
+    def on_fill(order):
+        if order:
+            record_ledger(context, security, strategy_id, held_before, order)
+            on_filled and on_filled(order)
+            return
+        if not was_held and security in g.strategy_holdings[strategy_id]:
+            g.strategy_holdings[strategy_id].remove(security)
+        if g.stock_strategy.get(security) == strategy_id:
+            if prev_strategy is None:
+                g.stock_strategy.pop(security, None)
+            else:
+                g.stock_strategy[security] = prev_strategy
+
+    add_target_intent(security, strategy_id, value, on_fill,
+                      send=lambda s, v: my_order_target_value(context, s, v, trace_id))
+
+
+# 轧差窗口内平仓: 先移出策略持仓, 净额委托未成交时恢复; 与其他策略买入对冲的部分按最新价计盈亏
+# 委托在窗口关闭时才发出, 此处返回 None
+def close_position_netted(context, security):
+    trace_id = new_trace()
+    strategy_id = g.stock_strategy[security]
+    position = context.portfolio.positions[security] if security in context.portfolio.positions else None
+    held_amount = position.total_amount if position else 0
+    avg_cost = position.avg_cost if position else 0
+    security in g.strategy_holdings[strategy_id] and g.strategy_holdings[strategy_id].remove(security)
+
+    def on_fill(order):
+        if not order:
+            security not in g.strategy_holdings[strategy_id] and g.strategy_holdings[strategy_id].append(security)
+            return
+        record_ledger(context, security, strategy_id, held_amount, order)
+        if not order.is_buy and order.amount >= held_amount:
+            pnl_value = (order.price - order.avg_cost) * order.amount
+        else:
+            pnl_value = (get_current_data()[security].last_price - avg_cost) * held_amount
+        g.strategy_value[strategy_id] += pnl_value
+
+    add_target_intent(security, strategy_id, 0, on_fill,
+                      send=lambda s, v: my_order_target_value(context, s, v, trace_id))
+
+
 # 止盈止损
+@redis_batched
+@order_netted
 def take_profit_stop_loss(context):
     if not g.run_stoploss:
         return
@@ -1135,6 +1373,10 @@ def take_profit_stop_loss(context):
             no_buy_stocks[k] = v
     g.no_buy_stocks = no_buy_stocks
 
+    if RISK_ENGINE_AVAILABLE:
+        take_profit_stop_loss_by_book(context)
+        return
+
     # 计算移动止损
     current_data = get_current_data()
     if g.use_move_stoploss:
@@ -1170,6 +1412,26 @@ def take_profit_stop_loss(context):
             print(f"止损卖出 {stock}, 亏损:{(1 - pos.price / pos.avg_cost):.2%}")
 
 
+# 止盈止损(风控簿版本): 整本持仓一次向量判定, 以持仓成本为基准
+def take_profit_stop_loss_by_book(context):
+    positions = context.portfolio.positions
+    book = g.risk_book
+    book.sync(context, positions)
+    book.rebase([positions[s].avg_cost for s in book.codes])
+    # 白马不进行止盈止损(移动止损仍然生效)
+    not_bm = [s not in g.strategy_holdings[4] for s in book.codes]
+    for stock, reason in book.evaluate(context, check_time=False, mask=not_bm):
+        pos = positions[stock]
+        close_position(context, stock)
+        g.no_buy_stocks[stock] = 1
+        if reason == 'TP':
+            print(f"止盈卖出 {stock}, 收益率:{(pos.price / pos.avg_cost - 1):.2%}")
+        elif reason == 'TRAIL':
+            print(f"移动止损卖出 {stock}, 亏损:{(1 - pos.price / pos.avg_cost):.2%}")
+        else:
+            print(f"止损卖出 {stock}, 亏损:{(1 - pos.price / pos.avg_cost):.2%}")
+
+
 # 日内止损
 def stop_loss_by_cur_day(context, stock_list, ratio=-0.03):
     for stock in stock_list:
@@ -1180,6 +1442,8 @@ def stop_loss_by_cur_day(context, stock_list, ratio=-0.03):
 
 
 # 检查昨日涨停股今日表现
+@redis_batched
+@order_netted
 def check_limit_up(context):
     # 获取当前持仓
     # holdings = list(context.portfolio.positions.keys())
@@ -1189,7 +1453,12 @@ def check_limit_up(context):
     if holdings:
         # 确保所有持仓股票代码都是字符串
         valid_holdings = [s for s in holdings if isinstance(s, str) and '.' in s]
-        if valid_holdings:
+        if valid_holdings and LIMIT_STATE_AVAILABLE:
+            near_up = limit_hit_in(valid_holdings, NEAR_UP, 1, context.previous_date)
+            g.yesterday_HL_list = np.flatnonzero(near_up).tolist()
+            if g.yesterday_HL_list:
+                print(f"昨日涨停股: {[holdings[i] for i in g.yesterday_HL_list]}")
+        elif valid_holdings:
             df = get_price(valid_holdings, end_date=context.previous_date,
                            frequency='daily', fields=['close', 'high_limit'],
                            count=1, panel=False)
@@ -1415,10 +1684,13 @@ def huanshou(context, stock_list):
             return df_volume['turnover_ratio'].mean()
         else:
             # 计算实时换手率
-            date_now = context.current_dt
-            df_vol = get_price(_stock, start_date=date_now.date(), end_date=date_now, frequency='1m', fields=['volume'],
-                               skip_paused=False, fq='pre', panel=True, fill_paused=False)
-            volume = df_vol['volume'].sum()
+            if BAR_CACHE_AVAILABLE:
+                volume = bar_cum_volume(_stock)
+            else:
+                date_now = context.current_dt
+                df_vol = get_price(_stock, start_date=date_now.date(), end_date=date_now, frequency='1m', fields=['volume'],
+                                   skip_paused=False, fq='pre', panel=True, fill_paused=False)
+                volume = df_vol['volume'].sum()
             date_pre = context.previous_date
             df_circulating_cap = get_valuation(_stock, end_date=date_pre, fields=['circulating_cap'], count=1)
             circulating_cap = df_circulating_cap['circulating_cap'].iloc[0] if not df_circulating_cap.empty else 0
@@ -1429,6 +1701,9 @@ def huanshou(context, stock_list):
 
     current_data = get_current_data()
     shrink, expand = 0.003, 0.1
+    if BAR_CACHE_AVAILABLE:
+        # 一次批量增量拉取当日分钟线
+        update_bar_cache(context, [s for s in stock_list if not current_data[s].paused])
     # for stock in context.portfolio.positions:
     for stock in stock_list:
         if current_data[stock].paused == True:
@@ -1475,12 +1750,15 @@ def filter_volume(context, stock_list, days=7, volume_threshold=2, check_only=Tr
             if hist_data.empty or len(hist_data) < days:
                 return
             avg_volume = hist_data['volume'].mean()
-            df_vol = get_price(security, start_date=context.current_dt.date(), end_date=context.current_dt,
-                               frequency='1m', fields=['volume'], skip_paused=False, fq='pre', panel=True,
-                               fill_paused=False)
-            if df_vol is None or df_vol.empty:
-                return
-            current_volume = df_vol['volume'].sum()
+            if BAR_CACHE_AVAILABLE:
+                current_volume = bar_cum_volume(security)
+            else:
+                df_vol = get_price(security, start_date=context.current_dt.date(), end_date=context.current_dt,
+                                   frequency='1m', fields=['volume'], skip_paused=False, fq='pre', panel=True,
+                                   fill_paused=False)
+                if df_vol is None or df_vol.empty:
+                    return
+                current_volume = df_vol['volume'].sum()
             _volume_ratio = current_volume / avg_volume
             print(f"{security} 成交量较近{days}日均值 x{_volume_ratio:.2f}")
             # 检测到异常, 返回异常倍数
@@ -1491,6 +1769,9 @@ def filter_volume(context, stock_list, days=7, volume_threshold=2, check_only=Tr
             return
 
     res = []
+    if BAR_CACHE_AVAILABLE:
+        # 一次批量增量拉取当日分钟线
+        update_bar_cache(context, stock_list)
     for stock in stock_list:
         if check_only:
             ratio = _get_volume_ratio(stock)
@@ -1597,6 +1878,9 @@ def filter_rsrs(stock_list):
 
 
 # 成交量宽度防御检测
+@budgeted_job('check_defense_trigger', budget=60)
+@redis_batched
+@order_netted
 def check_defense_trigger(context):
     """改进后的防御条件检查"""
 
@@ -1735,6 +2019,9 @@ def check_defense_trigger(context):
         else:
             g.defense_signal = False
             print("触发防御: False, 未处于历史触发范围内")
+    # 近期耗时逼近预算: 跳过全市场宽度计算, 沿用上次防御信号
+    elif job_degraded() and g.defense_signal is not None:
+        print(f"防御检测降级: 沿用上次信号 {g.defense_signal}")
     # 超过时间则手动计算, 用于实盘
     else:
         if g.defense_signal:
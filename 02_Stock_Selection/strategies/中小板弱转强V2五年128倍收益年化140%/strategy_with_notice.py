@@ -34,6 +34,72 @@ except ImportError:
     NOTIFICATION_AVAILABLE = False
     log.warning("通知库未找到，将跳过通知功能")
 
+# 导入盘中触发器库（跌停监控改为事件驱动）
+try:
+    from intraday_trigger_lib import *
+    TRIGGER_AVAILABLE = True
+except ImportError:
+    TRIGGER_AVAILABLE = False
+    log.warning("盘中触发器库未找到，跌停监控使用逐bar轮询")
+
+# 导入盘前预热库（收盘后生成次日候选池）
+try:
+    from universe_warmup_lib import *
+    WARMUP_AVAILABLE = True
+except ImportError:
+    WARMUP_AVAILABLE = False
+    log.warning("盘前预热库未找到，候选池在09:26现场计算")
+
+# 导入定时任务时间预算库（09:26筛选必须在09:27买入前完成）
+try:
+    from job_budget_lib import *
+    JOB_BUDGET_AVAILABLE = True
+except ImportError:
+    JOB_BUDGET_AVAILABLE = False
+    def budgeted_job(name, deadline=None, budget=None):
+        return lambda func: func
+    def job_at_risk(reserve=0.0):
+        return False
+
+# 导入竞价下单预备库（竞价前备好候选与资金，竞价后一次过滤并集中下单）
+try:
+    from auction_staging_lib import *
+    AUCTION_STAGING_AVAILABLE = True
+except ImportError:
+    AUCTION_STAGING_AVAILABLE = False
+    log.warning("竞价下单预备库未找到，09:26筛选、09:27买入")
+
+# 导入涨跌停状态位图（昨日/前日涨停判断改为位运算，每天只增量拉取一天）
+try:
+    from limit_state_lib import *
+    LIMIT_STATE_AVAILABLE = True
+except ImportError:
+    LIMIT_STATE_AVAILABLE = False
+
+# 导入宽表筛选库（技术指标筛选整表一次比较，不再逐只 groupby）
+try:
+    from price_panel_lib import *
+    PRICE_PANEL_AVAILABLE = True
+except ImportError:
+    PRICE_PANEL_AVAILABLE = False
+
+# 导入集合竞价盘口库（全部候选一次取竞价五档，b_s 整表计算）
+try:
+    from auction_book_lib import *
+    AUCTION_BOOK_AVAILABLE = True
+except ImportError:
+    AUCTION_BOOK_AVAILABLE = False
+
+# 导入基本面快照（同一天的 get_fundamentals 共用一份按表取回的快照，过滤/排序在本地计算）
+try:
+    from fundamentals_snapshot_lib import *
+    FUNDAMENTALS_SNAPSHOT_AVAILABLE = True
+except ImportError:
+    FUNDAMENTALS_SNAPSHOT_AVAILABLE = False
+
+    def cached_fundamentals(q, date=None, context=None):
+        return get_fundamentals(q, date=date)
+
 def initialize(context):
 
     # ==========================全局参数设置============================
@@ -65,6 +131,8 @@ def initialize(context):
     g.today_list=[]  #当日观测股票
     g.buy_dates={}  #记录股票买入日期
     g.dieting_stocks = []  # 跌停股票列表（用于监控卖出）
+    g.dieting_armed_date = None  # 跌停触发器登记日期
+    g.initial_constituents = 0  # 竞价前备选时的成分股数量
 
     # 初始化通知相关变量
     g.last_notification_date = None
@@ -76,13 +144,19 @@ def initialize(context):
         'positions': []
     }
 
-    run_daily(perpare,time="09:26")      # 筛选时间
-    run_daily(buy,time="09:27")          # 买入时间
+    if AUCTION_STAGING_AVAILABLE:
+        run_daily(stage_auction, time="09:20")  # 竞价前备好候选、昨收、换手率与每只买入金额
+        run_daily(fire_auction, time="09:26")   # 竞价后一次过滤开盘价、竞价盘口并集中下单
+    else:
+        run_daily(perpare,time="09:26")      # 筛选时间
+        run_daily(buy,time="09:27")          # 买入时间
     run_daily(sell,time='13:00')         # 盘中卖出时间
     run_daily(sell,time='14:55')         # 尾盘卖出时间
     run_daily(check_dieting, time="every_bar") # 监控跌停板
     run_daily(print_date_separator, time="15:05") # 收盘后打印日期分隔线
     run_daily(send_daily_summary, time="15:10") # 发送每日摘要通知
+    if WARMUP_AVAILABLE:
+        run_daily(warm_up_universe, time="15:30") # 收盘后预热次日候选池
 
     # 过滤系统订单日志
     log.set_level('order', 'error')
@@ -97,6 +171,7 @@ def initialize(context):
         log.info(f"邮件配置: {NOTIFICATION_CONFIG['email_config']['sender_email']}")
         log.info(f"收件人数量: {len(NOTIFICATION_CONFIG['email_config']['recipients'])}")
     
+@budgeted_job('perpare', deadline='09:27')
 def perpare(context):#筛选
     # 检查是否在1、4、12月空仓期
     if g.avoid_jan_apr_dec and is_avoid_period(context):
@@ -108,23 +183,14 @@ def perpare(context):#筛选
     current_data = get_current_data()
     g.yesterday_high_dict = {}
     g.today_list=[]
-    stk_list=get_st(context)
-    
-    # 记录初始成分股数量
-    initial_constituents = len(stk_list)
-    
-    # 国九条筛选
-    stk_list=GJT_filter_stocks(stk_list)
-    if len(stk_list)==0:
-        return
-    
-    # 技术指标筛选
-    stk_list=filter_stocks(context,stk_list)
-    if len(stk_list)==0:
-        return
-    
-    # 弱转强模式筛选（昨日不涨停，前日涨停）
-    stk_list=rzq_list(context,stk_list)
+
+    # 优先使用收盘后预热的候选池，只剩开盘价等盘中过滤在这里完成
+    artifact = load_warmup('rzq', context.current_dt.date()) if WARMUP_AVAILABLE else None
+    if artifact is not None:
+        stk_list = artifact['universes']['rzq']
+        initial_constituents = artifact['meta'].get('constituents', 0)
+    else:
+        stk_list, initial_constituents = build_rzq_universe(context, context.previous_date)
     if len(stk_list)==0:
         return
 
@@ -192,6 +258,18 @@ def perpare(context):#筛选
     # 更新今日选股列表
     g.today_list = list(df_sorted['code'])
     
+    # 打印成分股和候选股数量
+    remaining_positions = g.stock_num - len(hold_list)
+    log.info(f"今日成分股数量：{initial_constituents}只，候选股票数量：{len(g.today_list)}只，可买仓位：{remaining_positions}个")
+
+    # 选股详情和候选名称只用于通知与日志，09:27买入前时间不足时跳过
+    if job_at_risk(reserve=15):
+        log.warning("筛选耗时逼近买入时间，跳过选股详情记录")
+        return
+    record_selection_summary(context)
+
+def record_selection_summary(context):
+    """记录选股详情到通知摘要，并打印候选股名称"""
     # 记录选股信息到通知摘要
     g.daily_trading_summary['date'] = context.current_dt.strftime('%Y-%m-%d')
     g.daily_trading_summary['selected_stocks'] = []
@@ -220,10 +298,6 @@ def perpare(context):#筛选
         except Exception as e:
             log.warning(f"获取股票信息失败 {code}: {e}")
     
-    # 打印成分股和候选股数量
-    remaining_positions = g.stock_num - len(hold_list)
-    log.info(f"今日成分股数量：{initial_constituents}只，候选股票数量：{len(g.today_list)}只，可买仓位：{remaining_positions}个")
-    
     # 如果候选股数量小于等于10只，打印所有候选股名称
     if len(g.today_list) <= 10 and len(g.today_list) > 0:
         try:
@@ -238,6 +312,117 @@ def perpare(context):#筛选
         except:
             log.info(f"前10只候选股票：{', '.join(g.today_list[:10])}")
 
+def build_rzq_universe(context, date):
+    """
+    以 date 收盘数据生成弱转强候选池（不依赖当日盘中数据）
+    返回 (候选列表, 初始成分股数量)
+    """
+    stk_list=get_st(context, date)
+    
+    # 记录初始成分股数量
+    initial_constituents = len(stk_list)
+    
+    # 国九条筛选
+    stk_list=GJT_filter_stocks(stk_list, context, date)
+    if len(stk_list)==0:
+        return [], initial_constituents
+    
+    # 技术指标筛选
+    stk_list=filter_stocks(context,stk_list,date)
+    if len(stk_list)==0:
+        return [], initial_constituents
+    
+    # 弱转强模式筛选（昨日不涨停，前日涨停）
+    stk_list=rzq_list(context,stk_list,date)
+    return stk_list, initial_constituents
+
+def warm_up_universe(context):
+    """收盘后预热：用今日收盘数据算好下一交易日的候选池"""
+    today = context.current_dt.date()
+    for_date = next_trade_date(today)
+    if for_date is None:
+        return
+    stk_list, initial_constituents = build_rzq_universe(context, today)
+    save_warmup('rzq', for_date, {'rzq': stk_list}, data_date=today,
+                meta={'constituents': initial_constituents})
+
+@budgeted_job('stage_auction', deadline='09:25')
+def stage_auction(context):
+    """竞价前备选：候选池、昨收、换手率都只依赖上一交易日数据"""
+    stage_rzq_orders(context)
+
+def stage_rzq_orders(context):
+    """备好弱转强候选（排除持仓）、昨收、换手率和每只买入金额"""
+    g.today_list = []
+    if g.avoid_jan_apr_dec and is_avoid_period(context):
+        log.info("当前处于1、4、12月空仓期，今日不交易")
+        stage_auction_orders(context, [], [])
+        return
+
+    artifact = load_warmup('rzq', context.current_dt.date()) if WARMUP_AVAILABLE else None
+    if artifact is not None:
+        stk_list = artifact['universes']['rzq']
+        g.initial_constituents = artifact['meta'].get('constituents', 0)
+    else:
+        stk_list, g.initial_constituents = build_rzq_universe(context, context.previous_date)
+
+    hold_list = list(context.portfolio.positions)
+    stk_list = [s for s in stk_list if s not in hold_list]
+    num = max(g.stock_num - len(hold_list), 0)
+    if len(stk_list) == 0:
+        stage_auction_orders(context, [], [])
+        return
+
+    df = get_price(stk_list, end_date=context.previous_date, frequency='daily', fields=['close'], count=1,
+                   panel=False, fill_paused=False, skip_paused=True).set_index('code')
+    df_val = get_valuation(stk_list, start_date=context.previous_date, end_date=context.previous_date,
+                           fields=['turnover_ratio']).set_index('code')
+    df = df.join(df_val['turnover_ratio'], how='inner')
+
+    value_per_stock = context.portfolio.available_cash / num if num > 0 else 0
+    stage_auction_orders(context, list(df.index), df['close'].values, df['turnover_ratio'].values,
+                         value_per_stock, num)
+
+@budgeted_job('fire_auction', deadline='09:27')
+def fire_auction(context):
+    """竞价后：开盘价区间与竞价盘口一次过滤，集中下单后再记账、打印和通知"""
+    if g.avoid_jan_apr_dec and is_avoid_period(context):
+        return
+    if not auction_orders_staged(context):
+        # 模拟盘重启等原因错过竞价前备选时现场备选
+        stage_rzq_orders(context)
+
+    g.today_list, sent = fire_auction_orders(
+        context, g.open_down_threshold, g.open_up_threshold,
+        auction_filter=lambda codes: filter_stocks_by_b_s(context, codes))
+
+    log.info(f"今日成分股数量：{g.initial_constituents}只，候选股票数量：{len(g.today_list)}只，"
+             f"可买仓位：{auction_staging.slots}个")
+
+    current_data = get_current_data()
+    for stock, o in sent:
+        try:
+            stock_name = get_security_info(stock).display_name
+        except:
+            stock_name = stock
+        log.info(f"买入 {stock_name}({stock})")
+        g.buy_dates[stock] = context.current_dt.date()
+        g.daily_trading_summary['trades'].append({
+            'action': '买入',
+            'stock': stock,
+            'stock_name': stock_name,
+            'amount': auction_staging.value_per_stock,
+            'price': current_data[stock].last_price,
+            'reason': '弱转强模式选股',
+            'notified': False,  # 标记未通知
+            'timestamp': context.current_dt.strftime('%H:%M:%S')
+        })
+
+    if sent and NOTIFICATION_AVAILABLE and NOTIFICATION_CONFIG['enabled'] and NOTIFICATION_CONFIG['trading_notification']:
+        send_trading_notification(context)
+    if g.today_list and not job_at_risk(reserve=15):
+        record_selection_summary(context)
+
 def sell(context):
     hold_list = list(context.portfolio.positions)
     if not hold_list:
@@ -352,6 +537,7 @@ def sell(context):
     if sell_list and NOTIFICATION_AVAILABLE and NOTIFICATION_CONFIG['enabled'] and NOTIFICATION_CONFIG['trading_notification']:
         send_trading_notification(context)
 
+@budgeted_job('buy', deadline='09:28')
 def buy(context):
     # 检查是否在1、4、12月空仓期
     if g.avoid_jan_apr_dec and is_avoid_period(context):
@@ -432,6 +618,8 @@ def filter_stocks_by_b_s(context,stock_list):
     返回b_s>0的股票
     """
     date= context.current_dt.strftime("%Y-%m-%d")
+    if AUCTION_BOOK_AVAILABLE:
+        return filter_by_bs(stock_list, date)
     
     valid_stocks = []  # 符合条件的股票列表
     auction_data = {}   # 存储股票对应的b_s值
@@ -485,12 +673,14 @@ def today_is_between(context):
             return False
             
 ##获取成分股并过滤ST股##               
-def get_st(context):
+def get_st(context, date=None):
+    # 数据日期，默认昨日（收盘后预热时传入今日）
+    date = date or context.previous_date
     # 获取成分股指数
-    stocks = get_index_stocks('399101.XSHE', date=context.previous_date)
+    stocks = get_index_stocks('399101.XSHE', date=date)
     
     # 过滤ST股
-    st_data = get_extras('is_st', stocks, count=1, end_date=context.previous_date)
+    st_data = get_extras('is_st', stocks, count=1, end_date=date)
     st_data = st_data.T
     st_data.columns = ['is_st']
     # 保留非ST股
@@ -555,10 +745,16 @@ def get_hl_stock(initial_list, date):
     return hl_list
 
 ##筛选昨日不涨停的股票##
-def rzq_list(context,initial_list): 
+def rzq_list(context,initial_list,date=None): 
     # 文本日期
-    date = context.previous_date #昨日
+    date = date or context.previous_date #昨日
     date = transform_date(date, 'str')
+    if LIMIT_STATE_AVAILABLE:
+        # 第0位为昨日、第1位为前日：昨日有成交且不涨停，前日涨停
+        traded = limit_bits(initial_list, TRADED, date)
+        limit_up = limit_bits(initial_list, LIMIT_UP, date)
+        keep = (traded & ~limit_up & (limit_up >> np.uint64(1)) & np.uint64(1)) != 0
+        return [stock for stock, k in zip(initial_list, keep) if k]
     date_1=get_shifted_date(date, -1, 'T')#前日
     date_2=get_shifted_date(date, -2, 'T')#大前日
     # 昨日不涨停
@@ -570,8 +766,8 @@ def rzq_list(context,initial_list):
     return zb_list
     
 ##技术指标筛选##
-def filter_stocks(context, stocks):
-    yesterday = context.previous_date
+def filter_stocks(context, stocks, date=None):
+    yesterday = date or context.previous_date
     df = get_price(
         stocks,
         count=g.ma_period + 1,  # 使用全局参数
@@ -580,6 +776,9 @@ def filter_stocks(context, stocks):
         end_date=yesterday,
         panel=False
     ).reset_index()
+    if PRICE_PANEL_AVAILABLE:
+        panel = PricePanel.from_frame(df, ['close', 'low', 'volume'])
+        return rzq_technical_filter(panel, g.ma_period, g.volume_ratio_threshold)
     
     # 按股票分组处理
     valid_stocks = []
@@ -615,7 +814,8 @@ def filter_stocks(context, stocks):
             
 
 ##国九条筛选##
-def GJT_filter_stocks(stocks):
+def GJT_filter_stocks(stocks, context=None, date=None):
+    # date: 财务数据日期（收盘预热与盘前备选都用候选池的数据日期），None 时为 context.current_dt 的前一天
     # 国九更新：过滤近一年净利润为负且营业收入小于1亿的
     # 国九更新：过滤近一年期末净资产为负的 (经查询没有为负数的，所以直接pass这条)
     q = query(
@@ -633,7 +833,7 @@ def GJT_filter_stocks(stocks):
         indicator.roe > g.min_roe,  # 使用全局参数
         indicator.roa > g.min_roa,  # 使用全局参数
     )
-    df = get_fundamentals(q)
+    df = cached_fundamentals(q, date=date, context=context)
 
     final_list=list(df.code)
             
@@ -645,6 +845,13 @@ def check_dieting(context):
     # 初始化跌停股票列表
     if not hasattr(g, 'dieting_stocks'):
         g.dieting_stocks = []
+
+    # 有触发器库时改为事件驱动：只在价格穿越跌停价时回调，不再逐只轮询持仓
+    if TRIGGER_AVAILABLE:
+        if getattr(g, 'dieting_armed_date', None) != context.current_dt.date():
+            arm_dieting_triggers(context)
+        on_trigger_bar(context)
+        return
         
     if len(g.dieting_stocks) == 0:
         # 检查是否有新的跌停股票
@@ -673,39 +880,7 @@ def check_dieting(context):
             
         # 如果跌停打开且当前价高于跌停价
         if (current_data[stock].last_price > current_data[stock].low_limit):
-            # 获取股票名称和持仓信息
-            try:
-                stock_name = get_security_info(stock).display_name
-            except:
-                stock_name = stock
-            cost_price = position.avg_cost
-            current_price = current_data[stock].last_price
-            
-            # 避免除零错误
-            if cost_price > 0:
-                profit_rate = (current_price / cost_price - 1) * 100
-                log.info(f"跌停打开，止损卖出：{stock_name}({stock}) | 成本价：{cost_price:.2f}元 | 现价：{current_price:.2f}元 | 盈亏：{profit_rate:+.2f}%")
-            
-            # 执行卖出
-            order_target(stock, 0)
-            
-            # 记录跌停卖出交易到通知摘要
-            trade_info = {
-                'action': '卖出',
-                'stock': stock,
-                'stock_name': stock_name,
-                'avg_cost': cost_price,
-                'current_price': current_price,
-                'profit_pct': profit_rate,
-                'reason': '跌停打开止损',
-                'notified': False,  # 标记未通知
-                'timestamp': context.current_dt.strftime('%H:%M:%S')
-            }
-            g.daily_trading_summary['trades'].append(trade_info)
-            
-            
-            # 记录跌停卖出信息，统一在最后发送通知
-            
+            sell_dieting_stock(context, stock)
             to_remove.append(stock)
     
     # 发送交易通知（只有实际发生跌停卖出操作时才发送）
@@ -717,6 +892,68 @@ def check_dieting(context):
         if stock in g.dieting_stocks:
             g.dieting_stocks.remove(stock)
 
+def arm_dieting_triggers(context):
+    """每日首根bar为可卖持仓登记跌停触发器（当日买入的持仓T+1不可卖，无需盘中补登）"""
+    g.dieting_armed_date = context.current_dt.date()
+    g.dieting_stocks = []
+    reset_triggers()
+    for stock, position in context.portfolio.positions.items():
+        if position.closeable_amount > 0:
+            register_trigger(stock, '<=', 'low_limit', on_hit_low_limit, name='跌停')
+
+def on_hit_low_limit(context, stock, hit):
+    """触及跌停：加入监控列表，改为等待跌停打开"""
+    if stock not in g.dieting_stocks:
+        g.dieting_stocks.append(stock)
+    register_trigger(stock, '>', 'low_limit', on_open_low_limit, name='跌停打开')
+
+def on_open_low_limit(context, stock, hit):
+    """跌停打开：止损卖出"""
+    if stock in g.dieting_stocks:
+        g.dieting_stocks.remove(stock)
+    if stock not in context.portfolio.positions:
+        return
+    if context.portfolio.positions[stock].closeable_amount <= 0:
+        return
+    sell_dieting_stock(context, stock)
+    if NOTIFICATION_AVAILABLE and NOTIFICATION_CONFIG['enabled'] and NOTIFICATION_CONFIG['trading_notification']:
+        send_trading_notification(context)
+
+def sell_dieting_stock(context, stock):
+    """跌停打开止损卖出，并记录到通知摘要"""
+    position = context.portfolio.positions[stock]
+    current_data = get_current_data()
+    # 获取股票名称和持仓信息
+    try:
+        stock_name = get_security_info(stock).display_name
+    except:
+        stock_name = stock
+    cost_price = position.avg_cost
+    current_price = current_data[stock].last_price
+    
+    # 避免除零错误
+    profit_rate = 0
+    if cost_price > 0:
+        profit_rate = (current_price / cost_price - 1) * 100
+        log.info(f"跌停打开，止损卖出：{stock_name}({stock}) | 成本价：{cost_price:.2f}元 | 现价：{current_price:.2f}元 | 盈亏：{profit_rate:+.2f}%")
+    
+    # 执行卖出
+    order_target(stock, 0)
+    
+    # 记录跌停卖出交易到通知摘要
+    trade_info = {
+        'action': '卖出',
+        'stock': stock,
+        'stock_name': stock_name,
+        'avg_cost': cost_price,
+        'current_price': current_price,
+        'profit_pct': profit_rate,
+        'reason': '跌停打开止损',
+        'notified': False,  # 标记未通知
+        'timestamp': context.current_dt.strftime('%H:%M:%S')
+    }
+    g.daily_trading_summary['trades'].append(trade_info)
+
 # 收盘后打印日期分隔线
 def print_date_separator(context):
     log.info("=" * 60)
@@ -17,13 +17,37 @@ except ImportError:
     NOTIFICATION_AVAILABLE = False
     log.warning("通知库未找到，将跳过通知功能")
 
+# 导入宽表筛选库（候选的5日量价一次取出，机构信号整表计算）
+try:
+    from price_panel_lib import *
+    PRICE_PANEL_AVAILABLE = True
+except ImportError:
+    PRICE_PANEL_AVAILABLE = False
+
+# 导入均线确认库（整批计算MA与现价，同一回调内技术确认和开仓共用）
+try:
+    from ma_confirm_lib import *
+    MA_CONFIRM_AVAILABLE = True
+except ImportError:
+    MA_CONFIRM_AVAILABLE = False
+
+# 导入基本面快照（同一天的 get_fundamentals 共用一份按表取回的快照，过滤/排序在本地计算）
+try:
+    from fundamentals_snapshot_lib import *
+    FUNDAMENTALS_SNAPSHOT_AVAILABLE = True
+except ImportError:
+    FUNDAMENTALS_SNAPSHOT_AVAILABLE = False
+
+    def cached_fundamentals(q, date=None, context=None):
+        return get_fundamentals(q, date=date)
+
 # 策略配置 - 混合优化版
 STRATEGY_CONFIG = {
     'basic_filter': {
         'enabled': True,
         'universe_index': "399101.XSHE",  # 中小板
         'buy_stock_count': 3,            # 固定持仓数量
-        'candidate_multiplier': 3,        # 候选股票倍数
+        'candidate_multiplier': 3,        # 候选股票倍数（机构信号为整表计算，调大不增加逐只取数）
         'exclude_st': True,
         'exclude_suspended': True,
         'exclude_limit_up': True,
@@ -177,7 +201,7 @@ def run_basic_filter(context):
             g.buy_stock_count * config['candidate_multiplier']
         )
         
-        check_out_lists = list(get_fundamentals(q).code)
+        check_out_lists = list(cached_fundamentals(q, context=context).code)
         log.info("按市值排序后候选股票: %d 只" % len(check_out_lists))
         
         # 过滤三停及ST股票
@@ -223,36 +247,39 @@ def run_institutional_signal_scoring(context, candidates):
     config = g.config['institutional_signal']
     
     try:
-        stock_scores = []
+        if PRICE_PANEL_AVAILABLE:
+            stock_scores = score_institutional_signals(candidates, config)
+        else:
+            stock_scores = []
         
-        for stock in candidates:
-            try:
-                # 获取最近5日数据
-                hist = get_price(stock, count=5, frequency='daily', 
-                               fields=['close', 'volume', 'high', 'low'])
+            for stock in candidates:
+                try:
+                    # 获取最近5日数据
+                    hist = get_price(stock, count=5, frequency='daily', 
+                                   fields=['close', 'volume', 'high', 'low'])
                 
-                if len(hist) < 5:
-                    continue
+                    if len(hist) < 5:
+                        continue
                 
-                # 计算各项指标
-                volume_ratio = hist['volume'][-1] / hist['volume'][-5:].mean()
-                price_change = (hist['close'][-1] - hist['close'][-5]) / hist['close'][-5]
+                    # 计算各项指标
+                    volume_ratio = hist['volume'][-1] / hist['volume'][-5:].mean()
+                    price_change = (hist['close'][-1] - hist['close'][-5]) / hist['close'][-5]
                 
-                # 计算连续上涨天数
-                positive_days = 0
-                for i in range(1, len(hist)):
-                    if hist['close'][i] > hist['close'][i-1]:
-                        positive_days += 1
+                    # 计算连续上涨天数
+                    positive_days = 0
+                    for i in range(1, len(hist)):
+                        if hist['close'][i] > hist['close'][i-1]:
+                            positive_days += 1
                 
-                # 计算综合评分
-                score = calculate_institutional_score(volume_ratio, price_change, positive_days, config)
+                    # 计算综合评分
+                    score = calculate_institutional_score(volume_ratio, price_change, positive_days, config)
                 
-                if score > 0:
-                    stock_scores.append((stock, score))
-                    log.info("股票 %s 机构信号评分: %.2f" % (stock, score))
+                    if score > 0:
+                        stock_scores.append((stock, score))
+                        log.info("股票 %s 机构信号评分: %.2f" % (stock, score))
                     
-            except Exception as e:
-                continue
+                except Exception as e:
+                    continue
         
         # 按评分排序
         stock_scores.sort(key=lambda x: x[1], reverse=True)
@@ -304,6 +331,62 @@ def calculate_institutional_score(volume_ratio, price_change, positive_days, con
     
     return score
 
+def institutional_signal_panel(candidates):
+    """
+    候选的最近5日量价一次取出，返回与 candidates 对齐的
+    (量比, 5日涨幅, 上涨天数, 是否有5日数据) 数组
+    """
+    panel = price_panel(candidates, None, 5, ['close', 'volume', 'high', 'low']).compact().reindex(candidates)
+    close, volume = panel['close'], panel['volume']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        volume_ratio = volume[-1] / volume[-5:].mean(axis=0)
+        price_change = (close[-1] - close[-5]) / close[-5]
+        positive_days = (close[1:] > close[:-1]).sum(axis=0)
+    return volume_ratio, price_change, positive_days, panel.rows >= 5
+
+def institutional_scores(volume_ratio, price_change, positive_days, config):
+    """
+    calculate_institutional_score 的数组版本，阈值取自 config
+    """
+    with np.errstate(invalid='ignore'):
+        volume_score = np.select(
+            [(volume_ratio >= config['volume_ratio_min']) & (volume_ratio <= config['volume_ratio_max']),
+             volume_ratio > config['volume_ratio_max'],
+             volume_ratio >= 1.0],
+            [40, 20, 10], 0)
+        price_score = np.select(
+            [(price_change >= config['price_change_min']) & (price_change <= config['price_change_max']),
+             price_change > config['price_change_max'],
+             price_change >= 0],
+            [40, 20, 10], 0)
+    days_score = np.select([positive_days >= config['consecutive_days'], positive_days >= 1], [20, 10], 0)
+    return volume_score + price_score + days_score
+
+def score_institutional_signals(candidates, config):
+    """
+    机构信号评分（宽表版本），返回评分大于0的 [(股票, 评分), ...]，评分相同按候选顺序
+    """
+    if not candidates:
+        return []
+    volume_ratio, price_change, positive_days, ok = institutional_signal_panel(candidates)
+    scores = institutional_scores(volume_ratio, price_change, positive_days, config)
+    idx = np.flatnonzero(ok & (scores > 0))
+    idx = idx[np.argsort(-scores[idx], kind='stable')]
+    return [(candidates[i], int(scores[i])) for i in idx]
+
+def strict_institutional_signals(candidates, config):
+    """
+    严格机构信号（宽表版本）：温和放量、稳步上涨、连续小阳线三项中满足 min_signals 项的股票
+    """
+    if not candidates:
+        return []
+    volume_ratio, price_change, positive_days, ok = institutional_signal_panel(candidates)
+    with np.errstate(invalid='ignore'):
+        mild_volume = (volume_ratio >= config['volume_ratio_min']) & (volume_ratio <= config['volume_ratio_max'])
+        steady_rise = (price_change >= config['price_change_min']) & (price_change <= config['price_change_max'])
+    signals = mild_volume.astype(int) + steady_rise + (positive_days >= config['consecutive_days'])
+    return [candidates[i] for i in np.flatnonzero(ok & (signals >= config['min_signals']))]
+
 def run_fallback_selection(context, candidates):
     """
     备选方案 - 当机构信号筛选无结果时使用
@@ -316,7 +399,7 @@ def run_fallback_selection(context, candidates):
             valuation.code.in_(candidates)
         ).order_by(valuation.circulating_market_cap.asc())
         
-        df = get_fundamentals(q)
+        df = cached_fundamentals(q, context=context)
         if len(df) == 0:
             return candidates[:g.buy_stock_count]
         
@@ -338,48 +421,51 @@ def run_institutional_signal_strict(context, candidates):
     config = g.config['institutional_signal']
     
     try:
-        selected_stocks = []
+        if PRICE_PANEL_AVAILABLE:
+            selected_stocks = strict_institutional_signals(candidates, config)
+        else:
+            selected_stocks = []
         
-        for stock in candidates:
-            try:
-                # 获取最近5日数据
-                hist = get_price(stock, count=5, frequency='daily', 
-                               fields=['close', 'volume', 'high', 'low'])
+            for stock in candidates:
+                try:
+                    # 获取最近5日数据
+                    hist = get_price(stock, count=5, frequency='daily', 
+                                   fields=['close', 'volume', 'high', 'low'])
                 
-                if len(hist) < 5:
-                    continue
+                    if len(hist) < 5:
+                        continue
                 
-                # 计算量价指标
-                volume_ratio = hist['volume'][-1] / hist['volume'][-5:].mean()
-                price_change = (hist['close'][-1] - hist['close'][-5]) / hist['close'][-5]
+                    # 计算量价指标
+                    volume_ratio = hist['volume'][-1] / hist['volume'][-5:].mean()
+                    price_change = (hist['close'][-1] - hist['close'][-5]) / hist['close'][-5]
                 
-                # 判断机构建仓信号
-                institutional_signals = []
+                    # 判断机构建仓信号
+                    institutional_signals = []
                 
-                # 温和放量
-                if config['volume_ratio_min'] <= volume_ratio <= config['volume_ratio_max']:
-                    institutional_signals.append("温和放量")
+                    # 温和放量
+                    if config['volume_ratio_min'] <= volume_ratio <= config['volume_ratio_max']:
+                        institutional_signals.append("温和放量")
                 
-                # 稳步上涨
-                if config['price_change_min'] <= price_change <= config['price_change_max']:
-                    institutional_signals.append("稳步上涨")
+                    # 稳步上涨
+                    if config['price_change_min'] <= price_change <= config['price_change_max']:
+                        institutional_signals.append("稳步上涨")
                 
-                # 连续小阳线
-                positive_days = 0
-                for i in range(1, len(hist)):
-                    if hist['close'][i] > hist['close'][i-1]:
-                        positive_days += 1
+                    # 连续小阳线
+                    positive_days = 0
+                    for i in range(1, len(hist)):
+                        if hist['close'][i] > hist['close'][i-1]:
+                            positive_days += 1
                 
-                if positive_days >= config['consecutive_days']:
-                    institutional_signals.append("连续小阳线")
+                    if positive_days >= config['consecutive_days']:
+                        institutional_signals.append("连续小阳线")
                 
-                # 综合评分
-                if len(institutional_signals) >= config['min_signals']:
-                    selected_stocks.append(stock)
-                    log.info("股票 %s 满足机构信号: %s" % (stock, institutional_signals))
+                    # 综合评分
+                    if len(institutional_signals) >= config['min_signals']:
+                        selected_stocks.append(stock)
+                        log.info("股票 %s 满足机构信号: %s" % (stock, institutional_signals))
                     
-            except Exception as e:
-                continue
+                except Exception as e:
+                    continue
         
         log.info("机构建仓信号筛选: 从 %d 只股票中筛选出 %d 只候选股票" % (len(candidates), len(selected_stocks)))
         return selected_stocks
@@ -398,6 +484,11 @@ def run_technical_confirmation(context, candidates):
         return candidates
     
     try:
+        if MA_CONFIRM_AVAILABLE:
+            selected_stocks = ma_confirm(context, candidates, g.ma_period)
+            log.info("技术面确认: 从 %d 只股票中筛选出 %d 只候选股票" % (len(candidates), len(selected_stocks)))
+            return selected_stocks
+        
         selected_stocks = []
         
         for stock in candidates:
@@ -466,6 +557,8 @@ def adjust_position(context, buy_stocks):
         position_count = len(context.portfolio.positions)
         if g.buy_stock_count > position_count:
             value = context.portfolio.cash / (g.buy_stock_count - position_count)
+            if MA_CONFIRM_AVAILABLE:
+                prefetch_ma(context, buy_stocks, g.ma_period)
             
             for stock in buy_stocks:
                 if context.portfolio.positions[stock].total_amount == 0:
@@ -481,6 +574,13 @@ def open_position(context, security, value):
     开仓逻辑 - 使用strategy.py的逻辑
     """
     try:
+        if MA_CONFIRM_AVAILABLE:
+            # 当前价站上相应平均线后，才进行买入（技术确认/调仓前已整批算好）
+            if not ma_confirmed(context, security, g.ma_period):
+                return False
+            order = order_target_value(security, value)
+            return order != None and order.filled > 0
+        
         now = context.current_dt
         end_time = now.strftime("%Y-%m-%d %H:%M:%S")
         
@@ -14,6 +14,47 @@ import numpy as np
 import pandas as pd
 from scipy.optimize import minimize
 
+# 导入委托轧差库(同一窗口内各子策略对同一证券的买卖只下净额委托)
+try:
+    from order_netting_lib import *
+    ORDER_NETTING_AVAILABLE = True
+except ImportError:
+    ORDER_NETTING_AVAILABLE = False
+
+    def order_netted(func):
+        return func
+
+# 导入持仓核对引擎(子策略账本与账户持仓逐分钟核对, 送股/成交未记账/手工交易分类修正)
+try:
+    from position_reconcile_lib import *
+    POSITION_RECONCILE_AVAILABLE = True
+except ImportError:
+    POSITION_RECONCILE_AVAILABLE = False
+
+# 导入涨跌停状态位图(近几日涨停过的判断改为位运算, 每天只增量拉取一天)
+try:
+    from limit_state_lib import *
+    LIMIT_STATE_AVAILABLE = True
+except ImportError:
+    LIMIT_STATE_AVAILABLE = False
+
+# 导入基本面快照(同一天的 get_fundamentals 共用一份按表取回的快照, 过滤/排序在本地计算)
+try:
+    from fundamentals_snapshot_lib import *
+    FUNDAMENTALS_SNAPSHOT_AVAILABLE = True
+except ImportError:
+    FUNDAMENTALS_SNAPSHOT_AVAILABLE = False
+
+    def cached_fundamentals(q, date=None, context=None):
+        return get_fundamentals(q, date=date)
+
+# 导入季度财务数组(多季度财报按 季度×股票×字段 存放, 只在有新财报时增量更新, 加权利润率/波动率整表计算)
+try:
+    from quarterly_fundamentals_lib import *
+    QUARTERLY_STORE_AVAILABLE = True
+except ImportError:
+    QUARTERLY_STORE_AVAILABLE = False
+
 """--------------------------------- 初始化函数，设定基准等等 ------------------------------"""
 
 
@@ -55,20 +96,29 @@ def initialize(context):
 
     # 策略变量
     g.jsg_signal = True
+    # 子策略调仓放在同一时间窗口内, 同一证券的买卖轧差后只下净额委托
+    g.net_adjust_window = True
+    net_window = g.net_adjust_window and ORDER_NETTING_AVAILABLE
 
     # 子策略执行计划
+    if net_window:
+        # 同一时间的 run_monthly/run_weekly 先于 run_daily 执行, 不能靠注册顺序包住窗口,
+        # 改为一个 run_daily 任务在窗口内按原顺序调用当天到期的调仓
+        run_daily(netted_adjust, "11:00")
     if g.portfolio_value_proportion[0] > 0:  # 搅屎棍策略
-        run_weekly(jsg_adjust, 1, "11:00")
+        net_window or run_weekly(jsg_adjust, 1, "11:00")
         run_daily(jsg_check, "14:50")
     if g.portfolio_value_proportion[1] > 0:  # 全天候策略
-        run_monthly(all_day_adjust, 1, "11:01")
+        net_window or run_monthly(all_day_adjust, 1, "11:01")
     if g.portfolio_value_proportion[2] > 0:
-        run_monthly(simple_roa_adjust, 1, "11:02")  # 简单ROA策略
+        net_window or run_monthly(simple_roa_adjust, 1, "11:02")  # 简单ROA策略
         run_daily(simple_roa_check, "14:52")
     if g.portfolio_value_proportion[3] > 0:
-        run_weekly(weak_cyc_adjust, 1, "11:03")  # 弱周期价投策略
+        net_window or run_weekly(weak_cyc_adjust, 1, "11:03")  # 弱周期价投策略
     if g.portfolio_value_proportion[4] > 0:
-        run_daily(etf_rotation_adjust, "11:04")  # 核心资产轮动策略
+        net_window or run_daily(etf_rotation_adjust, "11:04")  # 核心资产轮动策略
+    if POSITION_RECONCILE_AVAILABLE:
+        run_daily(reconcile_positions, "every_bar")  # 注册在调仓之后, 同一分钟内先调仓再核对
 
     # # 子策略执行计划
     # if g.portfolio_value_proportion[0] > 0:  # 搅屎棍策略
@@ -92,6 +142,9 @@ def initialize(context):
 
 
 def process_initialize(context):
+    if POSITION_RECONCILE_AVAILABLE:
+        # 子策略账本换成按代码排序的数组账本(兼容模拟盘 g 中恢复的字典账本)
+        g.positions = as_ledgers(g.positions)
     g.strategys["搅屎棍策略"] = JSG(context, index=0, name="搅屎棍策略")
     g.strategys["全天候策略"] = AllDay(context, index=1, name="全天候策略")
     g.strategys["简单ROA策略"] = SimpleROA(context, index=2, name="简单ROA策略")
@@ -102,21 +155,65 @@ def process_initialize(context):
 """--------------------------------- 任务调用函数 ------------------------------"""
 
 
+# 子策略调仓放在同一轧差窗口内: 按原 11:00-11:04 的顺序调用当天到期的调仓, 结束时统一下净额委托
+# 每周/每月第一个交易日与 run_weekly/run_monthly(..., 1) 一致
+@order_netted
+def netted_adjust(context):
+    today, previous = context.current_dt.date(), context.previous_date
+    week_start = today.isocalendar()[:2] != previous.isocalendar()[:2]
+    month_start = (today.year, today.month) != (previous.year, previous.month)
+    if g.portfolio_value_proportion[0] > 0 and week_start:
+        jsg_adjust(context)
+    if g.portfolio_value_proportion[1] > 0 and month_start:
+        all_day_adjust(context)
+    if g.portfolio_value_proportion[2] > 0 and month_start:
+        simple_roa_adjust(context)
+    if g.portfolio_value_proportion[3] > 0 and week_start:
+        weak_cyc_adjust(context)
+    if g.portfolio_value_proportion[4] > 0:
+        etf_rotation_adjust(context)
+
+
+# 可用现金(含轧差窗口内尚未下单的净卖出所得)
+def get_available_cash(context):
+    cash = context.portfolio.available_cash
+    if ORDER_NETTING_AVAILABLE:
+        cash += netting_pending_cash()
+    return cash
+
+
+# 货币ETF下单(轧差库可用时登记为不属于任何子策略的意图)
+def order_fill_stock(amount):
+    if ORDER_NETTING_AVAILABLE:
+        add_amount_intent(g.fill_stock, None, amount)
+    else:
+        order(g.fill_stock, amount)
+
+
+# 每分钟核对子策略账本: 送股、部分成交后撤单、手工交易导致的差异按账户持仓修正账本
+def reconcile_positions(context):
+    reconcile_ledgers(context, g.positions, ignore=[g.fill_stock])
+
+
 # 尾盘处理
+@order_netted
 def end_trade(context):
     current_data = get_current_data()
 
-    keys = [key for d in g.positions.values() if isinstance(d, dict) for key in d.keys()]
-    for stock in context.portfolio.positions:
-        if stock not in keys and stock != g.fill_stock and current_data[stock].last_price < current_data[
-            stock].high_limit:
+    if POSITION_RECONCILE_AVAILABLE:
+        unowned = unowned_positions(reconcile_ledgers(context, g.positions, ignore=[g.fill_stock]))
+    else:
+        keys = [key for d in g.positions.values() if isinstance(d, dict) for key in d.keys()]
+        unowned = [stock for stock in context.portfolio.positions if stock not in keys and stock != g.fill_stock]
+    for stock in unowned:
+        if current_data[stock].last_price < current_data[stock].high_limit:
             if order_target_value(stock, 0):
                 log.info(f"卖出{stock}因送股未记录在持仓中")
 
     # 买入货币ETF
-    amount = int(context.portfolio.available_cash / current_data[g.fill_stock].last_price)
+    amount = int(get_available_cash(context) / current_data[g.fill_stock].last_price) // 100 * 100
     if amount >= 100:
-        order(g.fill_stock, amount)
+        order_fill_stock(amount)
         log.info(f"剩余买入 货币ETF: {amount}")
 
 
@@ -127,34 +224,43 @@ def get_cash(context, value):
     current_data = get_current_data()
     amount = math.ceil(value / current_data[g.fill_stock].last_price / 100) * 100
     position = context.portfolio.positions[g.fill_stock].closeable_amount
-    if amount >= 100:
-        order(g.fill_stock, -min(amount, position))
+    if ORDER_NETTING_AVAILABLE:
+        position += min(netting_pending_amount(g.fill_stock), 0)  # 扣除窗口内已登记的卖出
+    if amount >= 100 and position > 0:
+        order_fill_stock(-min(amount, position))
 
 
+@order_netted
 def jsg_check(context):
     g.strategys["搅屎棍策略"].check()
 
 
+@order_netted
 def jsg_adjust(context):
     g.strategys["搅屎棍策略"].adjust()
 
 
+@order_netted
 def all_day_adjust(context):
     g.strategys["全天候策略"].adjust()
 
 
+@order_netted
 def simple_roa_adjust(context):
     g.strategys["简单ROA策略"].adjust()
 
 
+@order_netted
 def simple_roa_check(context):
     g.strategys["简单ROA策略"].check()
 
 
+@order_netted
 def weak_cyc_adjust(context):
     g.strategys["弱周期价投策略"].adjust()
 
 
+@order_netted
 def etf_rotation_adjust(context):
     g.strategys["核心资产轮动策略"].adjust()
 
@@ -224,8 +330,11 @@ class Strategy:
     def get_total_value(self):
         if not g.positions[self.index]:
             return 0
-        return sum(
-            self.context.portfolio.positions[key].price * value for key, value in g.positions[self.index].items())
+        positions = self.context.portfolio.positions
+        current_data = get_current_data()
+        # 轧差窗口内登记的买入尚未成交时账户中还没有该持仓, 按最新价估值
+        return sum((positions[key].price if key in positions else current_data[key].last_price) * value
+                   for key, value in g.positions[self.index].items())
 
     # 卖出非连板股票，并且返回成功卖出的股票列表
     def _check(self):
@@ -233,7 +342,11 @@ class Strategy:
         self.hold_list = list(g.positions[self.index].keys())
         stocks = []
         # 获取昨日涨停、前日涨停昨日跌停列表
-        if self.hold_list != []:
+        if self.hold_list != [] and LIMIT_STATE_AVAILABLE:
+            for stock in limit_up_stocks(self.hold_list, 3, self.context.previous_date):
+                if self.order_target_value_(stock, 0):  # 全部卖出
+                    stocks.append(stock)
+        elif self.hold_list != []:
             df = get_price(
                 self.hold_list,
                 end_date=self.context.previous_date,
@@ -290,9 +403,10 @@ class Strategy:
             price = current_data[stock].last_price
             value = g.positions[self.index].get(stock, 0) * price
             if target - value > self.min_volume and target - value > price * 100:
-                if target - value > portfolio.available_cash:
-                    get_cash(self.context, target - value - portfolio.available_cash)
-                if portfolio.available_cash > price * 100 and portfolio.available_cash > self.min_volume:
+                if target - value > get_available_cash(self.context):
+                    get_cash(self.context, target - value - get_available_cash(self.context))
+                available_cash = get_available_cash(self.context)
+                if available_cash > price * 100 and available_cash > self.min_volume:
                     self.order_target_value_(stock, target)
 
     # 可用现金等比例买入
@@ -312,15 +426,18 @@ class Strategy:
         position_value = self.get_total_value()
 
         # 可用现金:当前现金 + 货币ETF市值
-        available_cash = portfolio.available_cash + (
-            portfolio.positions[g.fill_stock].value if g.fill_stock in portfolio.positions else 0)
+        fill_value = portfolio.positions[g.fill_stock].value if g.fill_stock in portfolio.positions else 0
+        if ORDER_NETTING_AVAILABLE:
+            # 窗口内已登记卖出的货币ETF已计入可用现金
+            fill_value += netting_pending_amount(g.fill_stock) * get_current_data()[g.fill_stock].last_price
+        available_cash = get_available_cash(self.context) + fill_value
 
         # 买入股票的总市值
         value = max(0, min(target_value - position_value, available_cash))
 
         # 卖出部分货币ETF获取现金
-        if value > portfolio.available_cash:
-            get_cash(self.context, value - portfolio.available_cash)
+        if value > get_available_cash(self.context):
+            get_cash(self.context, value - get_available_cash(self.context))
 
         # 等价值买入每一个未买入的标的
         for security in target:
@@ -354,6 +471,13 @@ class Strategy:
             print(f"{security} {security_name}: 当天买入不可卖出")
             return False
 
+        if adjustment != 0 and ORDER_NETTING_AVAILABLE:
+            # 先按意图更新账本, 轧差下单后按实际分摊数量修正
+            self._set_position(security, current_position + adjustment)
+            add_amount_intent(security, self.index, adjustment,
+                              self._on_netted_fill(security, adjustment, target_position, value))
+            return True
+
         if adjustment != 0:
             o = order(security, adjustment)
             if o:
@@ -363,30 +487,57 @@ class Strategy:
                 if target_position == 0:
                     g.positions[self.index].pop(security, None)
                 self.hold_list = list(g.positions[self.index].keys())
-
-                # 格式化股票名称显示（固定长度对齐）
-                stock_show = f"{security} {security_name[:8]}: "
-                stock_show = stock_show.ljust(20)
-                if "ETF" in stock_show:
-                    stock_show += "  "
-
-                if o.is_buy:
-                    print(f"🟠🟠🟠🟠{stock_show}  "
-                          f"目标数量{target_position:<7}  "
-                          f"买入价格{o.price:<7.2f}  "
-                          f"买入数量{o.amount:<7}   "
-                          f"价值{o.price * o.amount:.2f}")
-                else:
-                    print(f"{'🟣🟣🟣🟣' if value == 0 else '🟢🟢🟢🟢'}{stock_show}  "
-                          f"卖出价格{o.price:<7.2f}  "
-                          f"成本价格{o.avg_cost:<7.2f}   "
-                          f"卖出数量{o.amount:<7}   "
-                          f"盈亏{(o.price - o.avg_cost) * o.amount:.2f}"
-                          f"( {(o.price - o.avg_cost) / o.avg_cost * 100:.2f}% )")
-
+                self._print_order(security, o, o.amount, target_position, value)
                 return True
         return False
 
+    # 更新子策略账本中的持仓数量
+    def _set_position(self, security, amount):
+        if amount > 0:
+            g.positions[self.index][security] = amount
+        else:
+            g.positions[self.index].pop(security, None)
+        self.hold_list = list(g.positions[self.index].keys())
+
+    # 轧差下单后的分摊回调: 修正账本并打印本子策略分到的成交
+    def _on_netted_fill(self, security, adjustment, target_position, value):
+        def on_fill(filled, o):
+            if filled != adjustment:
+                self._set_position(security, g.positions[self.index].get(security, 0) + filled - adjustment)
+            if filled != 0:
+                self._print_order(security, o, abs(filled), target_position, value, buy=filled > 0)
+        return on_fill
+
+    # 打印成交(o 为 None 时表示与其他子策略内部对冲, 按最新价显示)
+    def _print_order(self, security, o, amount, target_position, value, buy=None):
+        # 格式化股票名称显示（固定长度对齐）
+        stock_show = f"{security} {self.get_stock_name(security)[:8]}: "
+        stock_show = stock_show.ljust(20)
+        if "ETF" in stock_show:
+            stock_show += "  "
+
+        price = o.price if o else get_current_data()[security].last_price
+        is_buy = o.is_buy if buy is None else buy
+        if is_buy:
+            print(f"🟠🟠🟠🟠{stock_show}  "
+                  f"目标数量{target_position:<7}  "
+                  f"买入价格{price:<7.2f}  "
+                  f"买入数量{amount:<7}   "
+                  f"价值{price * amount:.2f}")
+        else:
+            if o and not o.is_buy:
+                avg_cost = o.avg_cost
+            elif security in self.context.portfolio.positions:
+                avg_cost = self.context.portfolio.positions[security].avg_cost
+            else:
+                avg_cost = price
+            print(f"{'🟣🟣🟣🟣' if value == 0 else '🟢🟢🟢🟢'}{stock_show}  "
+                  f"卖出价格{price:<7.2f}  "
+                  f"成本价格{avg_cost:<7.2f}   "
+                  f"卖出数量{amount:<7}   "
+                  f"盈亏{(price - avg_cost) * amount:.2f}"
+                  f"( {(price - avg_cost) / avg_cost * 100:.2f}% )")
+
     # 基础过滤(过滤科创北交、ST、停牌、次新股)
     def filter_basic_stock(self, stock_list):
 
@@ -415,6 +566,8 @@ class Strategy:
 
     # 过滤近几日涨停过的股票
     def filter_limitup_stock(self, stock_list, days):
+        if LIMIT_STATE_AVAILABLE:
+            return filter_limit_up(stock_list, days, self.context.previous_date)
         df = get_price(
             stock_list,
             end_date=self.context.previous_date,
@@ -487,7 +640,7 @@ class JSG(Strategy):
         stocks = self.filter_basic_stock(stocks)
         stocks = self.filter_limitup_stock(stocks, 5)  # 检查最近5日涨停
         stocks = (
-            get_fundamentals(
+            cached_fundamentals(
                 query(
                     valuation.code,
                 )
@@ -495,7 +648,8 @@ class JSG(Strategy):
                     valuation.code.in_(stocks),
                     indicator.adjusted_profit > 0,
                 )
-                .order_by(valuation.market_cap.asc())
+                .order_by(valuation.market_cap.asc()),
+                context=self.context,
             )
             .head(20)
             .code
@@ -565,13 +719,14 @@ class SimpleROA(Strategy):
         stocks = get_all_securities("stock", date=self.context.previous_date).index.tolist()
         stocks = self.filter_basic_stock(stocks)
         stocks = list(
-            get_fundamentals(
+            cached_fundamentals(
                 query(valuation.code, indicator.roa).filter(
                     valuation.code.in_(stocks),
                     valuation.pb_ratio > 0,
                     valuation.pb_ratio < 1,  # 破净股：PB<1
                     indicator.adjusted_profit > 0,  # 盈利：扣非净利润>0
-                )
+                ),
+                context=self.context,
             )
             .sort_values(by="roa", ascending=False)  # 按ROA降序排序
             .head(10)  # 取ROA最高的10只
@@ -626,7 +781,7 @@ class WeakCyc(Strategy):
 
         # 获取市值相关数据
         q = query(valuation.code, valuation.market_cap, valuation.pe_ratio).filter(valuation.code.in_(list(df.index)))
-        cap = get_fundamentals(q, date=time1).set_index("code")
+        cap = cached_fundamentals(q, date=time1).set_index("code")
 
         # 计算股息率, 股利支付率
         df = pd.concat([df, cap], axis=1, sort=False)
@@ -641,6 +796,20 @@ class WeakCyc(Strategy):
         if not stocks:
             return []
 
+        if QUARTERLY_STORE_AVAILABLE:
+            codes, w = quarterly_window(
+                stocks,
+                [income.operating_revenue, indicator.net_profit_margin, indicator.gross_profit_margin],
+                self.context.previous_date,
+                4 * year,
+            )
+            revenue = w["operating_revenue"]
+            weighted_net = weighted_mean(revenue, w["net_profit_margin"])
+            weighted_gross = weighted_mean(revenue, w["gross_profit_margin"])
+            with np.errstate(invalid="ignore"):
+                keep = (weighted_net > net_profit_margin) & (weighted_gross > gross_profit_margin)
+            return [code for code, ok in zip(codes, keep) if ok]
+
         df = get_history_fundamentals(
             stocks,
             fields=[income.operating_revenue, indicator.net_profit_margin, indicator.gross_profit_margin],
@@ -670,6 +839,10 @@ class WeakCyc(Strategy):
     # 获取净利润波动率(近几年的净利润标准差)
     def get_profit_vol(self, stocks, year):
 
+        if QUARTERLY_STORE_AVAILABLE:
+            codes, w = quarterly_window(stocks, [income.net_profit], self.context.previous_date, 4 * year)
+            return pd.DataFrame({"code": codes, "volatility": growth_volatility(w["net_profit"], 4)})
+
         df = get_history_fundamentals(
             stocks,
             fields=[income.net_profit],
@@ -687,7 +860,7 @@ class WeakCyc(Strategy):
         stocks = get_industry_stocks("801160")
         # 基本面过滤
         stocks = self.filter_basic_stock(stocks)
-        df = get_fundamentals(
+        df = cached_fundamentals(
             query(valuation.code, valuation.pe_ratio).filter(
                 valuation.code.in_(stocks),
                 # 现金流
@@ -697,7 +870,8 @@ class WeakCyc(Strategy):
                 balance.total_liability / balance.total_assets < 0.8,
                 # 市值
                 valuation.market_cap > 200,
-            )
+            ),
+            context=self.context,
         )
 
         stocks = self.filter_dividend(list(df.code), 3, 0.02, 0.4)
@@ -720,7 +894,7 @@ class WeakCyc(Strategy):
         stocks = get_industry_stocks("801170")
         # 基本面过滤
         stocks = self.filter_basic_stock(stocks)
-        df = get_fundamentals(
+        df = cached_fundamentals(
             query(valuation.code, valuation.pe_ratio, indicator.roa).filter(
                 valuation.code.in_(stocks),
                 # 现金流
@@ -730,7 +904,8 @@ class WeakCyc(Strategy):
                 balance.total_liability / balance.total_assets < 0.6,
                 # 市值
                 valuation.market_cap > 200,
-            )
+            ),
+            context=self.context,
         )
         stocks = self.filter_dividend(list(df.code), 3, 0.02, 0.3)
         stocks = self.filter_profit(stocks, 1, 20, 30)
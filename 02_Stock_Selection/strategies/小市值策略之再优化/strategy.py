@@ -12,6 +12,13 @@
 from jqdata import *
 from jqlib.technical_analysis import *
 
+# 导入均线确认库(整批计算MA与现价, 同一回调内筛选和开仓共用)
+try:
+    from ma_confirm_lib import *
+    MA_CONFIRM_AVAILABLE = True
+except ImportError:
+    MA_CONFIRM_AVAILABLE = False
+
 
 # 初始化函数，设定基准等等
 def initialize(context):
@@ -101,6 +108,13 @@ def order_target_value_(security, value):
 # 报单失败或者报单成功但被取消（此时成交量等于0），返回False
 def open_position(context, security, value):
     
+    if MA_CONFIRM_AVAILABLE:
+        # 当前价站上相应平均线后，才进行买入（调仓前已整批算好）
+        if not ma_confirmed(context, security, g.ma_period):
+            return False
+        order = order_target_value_(security, value)
+        return order != None and order.filled > 0
+    
     now = context.current_dt
     # 使用当前时间作为结束时间，避免未来数据错误
     end_time = now.strftime("%Y-%m-%d %H:%M:%S")
@@ -171,6 +185,8 @@ def adjust_position(context, buy_stocks):
 	position_count = len(context.portfolio.positions)
 	if g.buy_stock_count > position_count:
 		value = context.portfolio.cash / (g.buy_stock_count - position_count)
+		if MA_CONFIRM_AVAILABLE:
+			prefetch_ma(context, buy_stocks, g.ma_period)
 		
 		for stock in buy_stocks:
 			if context.portfolio.positions[stock].total_amount == 0:
@@ -181,6 +197,8 @@ def adjust_position(context, buy_stocks):
 
 # 过滤符合MA条件的股票
 def filter_ma_stock(context,stock_list):
+    if MA_CONFIRM_AVAILABLE:
+        return ma_confirm(context, stock_list, g.ma_period)
     ma_stock_list = []
     now = context.current_dt
     end_time = now.strftime("%Y-%m-%d %H:%M:%S")
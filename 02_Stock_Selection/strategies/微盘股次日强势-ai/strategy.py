@@ -4,6 +4,43 @@ import numpy as np
 import pandas as pd
 from datetime import timedelta
 
+# 导入持仓风控引擎（整本持仓向量化判定止盈止损）
+try:
+    from position_risk_lib import *
+    RISK_ENGINE_AVAILABLE = True
+except ImportError:
+    RISK_ENGINE_AVAILABLE = False
+
+# 导入盘中分钟线缓存（突破参考价只增量拉取新bar）
+try:
+    from intraday_bar_cache_lib import *
+    BAR_CACHE_AVAILABLE = True
+except ImportError:
+    BAR_CACHE_AVAILABLE = False
+
+# 导入盘前预热库（收盘后生成次日基础股票池）
+try:
+    from universe_warmup_lib import *
+    WARMUP_AVAILABLE = True
+except ImportError:
+    WARMUP_AVAILABLE = False
+
+# 导入涨跌停状态位图（昨日接近涨停的判断改为位运算，先于逐只取K线过滤）
+try:
+    from limit_state_lib import *
+    LIMIT_STATE_AVAILABLE = True
+except ImportError:
+    LIMIT_STATE_AVAILABLE = False
+
+# 导入宽表筛选库（全池一次取K线，候选条件与打分整表计算）
+try:
+    from price_panel_lib import *
+    PRICE_PANEL_AVAILABLE = True
+except ImportError:
+    PRICE_PANEL_AVAILABLE = False
+
+SCREEN_LOOKBACK = 15  # 宽表筛选取的交易日数（停牌压缩后需要至少7根有成交的K线）
+
 """
 微盘股 次日强势捕捉策略
 核心：昨日涨停 + 放量 + 强势K线 + 主力净流入 -> 次日择时买入
@@ -55,71 +92,47 @@ def initialize(context):
     run_daily(every_minute, time='every_bar')
     # 3) 收盘后：整理与记录
     run_daily(after_trading_end, time='15:30')
+    # 4) 收盘后：预热次日基础股票池（ST/上市天数/流通市值/成交额）
+    if WARMUP_AVAILABLE:
+        run_daily(warm_up_pool, time='15:35')
 
     # 运行变量
     g.watchlist = []           # 盘前挑选的候选（按分数排序）
     g.breakout_price = {}      # 当日突破价缓存（code->float）
     g.pos_info = {}            # 持仓信息：入场价、最高价、入场日
     g.today = None
+    if RISK_ENGINE_AVAILABLE:
+        # 风控簿：入场价/最高价/止盈止损价按持仓对齐存成数组
+        g.risk_book = PositionRiskBook(tp=g.TP, sl=g.SL, trail=g.TRAIL, max_hold_days=g.MAX_HOLD_DAYS)
 
 
 def before_market_open(context):
     g.today = context.current_dt.date()
-    # 1) 生成初步股票池：全A（剔除ST）
-    all_stocks = list(get_all_securities(['stock'], date=g.today).index)
-    is_st = get_extras('is_st', all_stocks, end_date=g.today, count=1).iloc[0]
-    pool = [s for s in all_stocks if not is_st.get(s, True)]
-
-    # 可选：剔除科创板 688 开头
-    if g.EXCLUDE_KECHUANG:
-        pool = [s for s in pool if not s.startswith('688')]
-
-    # 可选：剔除创业板 300 开头
-    if g.EXCLUDE_CHUANGYE:
-        pool = [s for s in pool if not s.startswith('300')]
-
-    # 2) 上市天数 ≥ MIN_LIST_DAYS
-    pool = [s for s in pool if (g.today - get_security_info(s).start_date).days >= g.MIN_LIST_DAYS]
-
-    if len(pool) == 0:
-        g.watchlist = []
-        return
-
-    # 3) 微盘筛选（流通市值区间）
-    val = get_valuation(pool, end_date=str(g.today), count=1,
-                        fields=['code', 'day', 'circulating_market_cap', 'market_cap'])
-    if val is None or val.empty:
-        g.watchlist = []
-        return
-
-    val = val.drop_duplicates(subset=['code'], keep='last').set_index('code')
-    pool = val[(val['circulating_market_cap'] >= g.CIRC_MCAP_LOW) &
-            (val['circulating_market_cap'] <= g.CIRC_MCAP_HIGH)].index.tolist()
-
-    if len(pool) == 0:
-        g.watchlist = []
-        return
-
-    # 4) 近10日平均成交额下限，规避流动性过差
-    try:
-        bars = get_bars(pool, count=10, unit='1d', fields=['code', 'money'], include_now=False, df=True)
-        avg_turn = bars.groupby('code')['money'].mean()
-        pool = avg_turn[avg_turn >= g.MIN_10D_AVG_TURNOVER].index.tolist()
-    except:
-        pass
+    # 1)~4) 基础股票池：优先使用收盘后预热结果
+    artifact = load_warmup('micro_cap', g.today) if WARMUP_AVAILABLE else None
+    if artifact is not None:
+        pool = artifact['universes']['pool']
+    else:
+        pool = _build_pool(g.today, context.previous_date)
+    # 股票池按上一交易日数据生成，今日起生效的ST在开盘前按当日状态再剔除一次
+    if len(pool) > 0:
+        is_st = get_extras('is_st', pool, end_date=g.today, count=1).iloc[0]
+        pool = [s for s in pool if not is_st.get(s, True)]
 
     if len(pool) == 0:
         g.watchlist = []
         return
 
     # 5) 基于昨日数据生成候选（涨停 + 放量 + 强K线 + 主力净流入）
-    candidates = _select_candidates(context, pool)
-    if not candidates:
-        g.watchlist = []
-        return
-
     # 6) 打分排序，取前若干的扩展池（比如前 30，用于盘中择时挑前 g.MAX_HOLDINGS）
-    scored = _score_candidates(context, candidates)
+    if PRICE_PANEL_AVAILABLE:
+        scored = _screen_candidates(context, pool)
+    else:
+        candidates = _select_candidates(context, pool)
+        if not candidates:
+            g.watchlist = []
+            return
+        scored = _score_candidates(context, candidates)
     g.watchlist = [c for c, _ in scored[:max(g.MAX_HOLDINGS*6, 30)]]  # 备选更大，便于盘中过滤
     log.info('候选数量: %d' % len(g.watchlist))
 
@@ -129,8 +142,9 @@ def every_minute(context):
     dt = context.current_dt
     hhmm = dt.strftime('%H:%M')
 
-    # 1) 记录当日开盘后前N分钟最高价（用于突破入场）
-    _update_intraday_breakout_ref(context)
+    # 1) 记录当日开盘后前N分钟最高价（用于突破入场，只在 BUY_TIME 使用，之后不再拉取分钟线）
+    if hhmm <= g.BUY_TIME:
+        _update_intraday_breakout_ref(context)
 
     # 2) 在 BUY_TIME 执行买入逻辑（只在该分钟触发一次）
     if hhmm == g.BUY_TIME:
@@ -140,6 +154,15 @@ def every_minute(context):
     _manage_positions_intraday(context)
 
 
+def warm_up_pool(context):
+    """收盘后预热：用今日收盘数据算好下一交易日的基础股票池"""
+    today = context.current_dt.date()
+    for_date = next_trade_date(today)
+    if for_date is None:
+        return
+    save_warmup('micro_cap', for_date, {'pool': _build_pool(for_date, today)}, data_date=today)
+
+
 def after_trading_end(context):
     # 清理非持仓的缓存
     held = set(context.portfolio.long_positions.keys())
@@ -157,6 +180,55 @@ def after_trading_end(context):
 
 # ------------------------ 选股与打分 ------------------------
 
+def _build_pool(trade_date, data_date):
+    """
+    基础股票池：全A剔除ST、上市天数、流通市值区间、近10日平均成交额
+    trade_date: 股票池适用的交易日（用于上市天数）
+    data_date: 数据截止日（上一交易日收盘）
+    """
+    # 1) 生成初步股票池：全A（剔除ST）
+    all_stocks = list(get_all_securities(['stock'], date=data_date).index)
+    is_st = get_extras('is_st', all_stocks, end_date=data_date, count=1).iloc[0]
+    pool = [s for s in all_stocks if not is_st.get(s, True)]
+
+    # 可选：剔除科创板 688 开头
+    if g.EXCLUDE_KECHUANG:
+        pool = [s for s in pool if not s.startswith('688')]
+
+    # 可选：剔除创业板 300 开头
+    if g.EXCLUDE_CHUANGYE:
+        pool = [s for s in pool if not s.startswith('300')]
+
+    # 2) 上市天数 ≥ MIN_LIST_DAYS
+    pool = [s for s in pool if (trade_date - get_security_info(s).start_date).days >= g.MIN_LIST_DAYS]
+
+    if len(pool) == 0:
+        return []
+
+    # 3) 微盘筛选（流通市值区间）
+    val = get_valuation(pool, end_date=str(data_date), count=1,
+                        fields=['code', 'day', 'circulating_market_cap', 'market_cap'])
+    if val is None or val.empty:
+        return []
+
+    val = val.drop_duplicates(subset=['code'], keep='last').set_index('code')
+    pool = val[(val['circulating_market_cap'] >= g.CIRC_MCAP_LOW) &
+            (val['circulating_market_cap'] <= g.CIRC_MCAP_HIGH)].index.tolist()
+
+    if len(pool) == 0:
+        return []
+
+    # 4) 近10日平均成交额下限，规避流动性过差
+    try:
+        bars = get_price(pool, end_date=data_date, count=10, frequency='daily',
+                         fields=['money'], panel=False)
+        avg_turn = bars.groupby('code')['money'].mean()
+        pool = avg_turn[avg_turn >= g.MIN_10D_AVG_TURNOVER].index.tolist()
+    except:
+        pass
+    return pool
+
+
 def _select_candidates(context, pool):
     """
     返回满足基本条件的候选股列表（昨日涨停 + 放量 + K线强 + 主力净流入）
@@ -171,6 +243,13 @@ def _select_candidates(context, pool):
     except:
         money_flow = pd.DataFrame()
 
+    if LIMIT_STATE_AVAILABLE:
+        # 先按位图去掉昨日未接近涨停的股票，逐只取K线只剩昨日强势股（昨日停牌的仍按K线判断）
+        near_up = limit_bits(pool, NEAR_UP, prev_date)
+        traded = limit_bits(pool, TRADED, prev_date)
+        keep = ((near_up | ~traded) & np.uint64(1)) != 0
+        pool = [s for s, k in zip(pool, keep) if k]
+
     for s in pool:
         # 取6根K线（便于算5日均量、形态等）
         try:
@@ -301,6 +380,70 @@ def _score_candidates(context, candidates):
     return list(ranked.items())
 
 
+def _money_flow_main(codes, prev_date):
+    """昨日主力净占比，返回 (是否有资金流数据, 主力净占比) 两个与 codes 对齐的数组"""
+    try:
+        money_flow = get_money_flow(list(codes), end_date=str(prev_date), count=1)
+        money_flow = money_flow.sort_values('date').drop_duplicates(['sec_code'], keep='last').set_index('sec_code')
+        net = money_flow['net_pct_main'].reindex(codes)
+        return net.index.isin(money_flow.index), net.values.astype(float)
+    except:
+        return np.zeros(len(codes), dtype=bool), np.full(len(codes), np.nan)
+
+
+def _screen_candidates(context, pool):
+    """
+    _select_candidates + _score_candidates 的宽表版本：全池一次取K线、一次取资金流，
+    条件与打分都是整表数组运算，返回 [(code, score), ...] 降序
+    """
+    prev_date = context.previous_date
+    panel = price_panel(pool, prev_date, SCREEN_LOOKBACK,
+                        ['open', 'close', 'high', 'low', 'volume', 'high_limit'],
+                        fill_paused=False, skip_paused=False).compact()
+    if len(panel) == 0:
+        return []
+    o, c, h, l = panel['open'][-7:], panel['close'][-7:], panel['high'][-7:], panel['low'][-7:]
+    v, hl = panel['volume'][-7:], panel['high_limit'][-7:]
+    has_flow, net_pct_main = _money_flow_main(panel.codes, prev_date)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # 昨日相对过去5日均量、K线实体与区间
+        vol_ratio = v[-1] / (v[-6:-1].mean(axis=0) + g.EPS)
+        body = c[-1] - o[-1]
+        rng = h[-1] - l[-1] + g.EPS
+        breakout_high = h[-6:-1][-g.BREAK_MAX_LOOKBACK:].max(axis=0)
+        ok = ((panel.rows >= 6)
+              & ~(c[-1] < hl[-1] * 0.997)          # 1) 涨停判定（接近涨停价）
+              & ~(vol_ratio < g.VOL_RATIO_TH)      # 2) 量能放大
+              & (body > 0)                         # 3) 长阳 + 强实体占比 + 突破前高
+              & ~(body / rng < 0.6)
+              & ~(c[-1] <= breakout_high)
+              & (~has_flow | (net_pct_main > 0.0))  # 4) 主力净占比（有数据时须为正）
+              & (panel.rows >= 7))                 # 打分需要7根K线
+
+        idx = np.flatnonzero(ok)
+        if len(idx) == 0:
+            return []
+        mom3 = c[-1, idx] / c[-4, idx] - 1.0
+        pattern = (0.7 * np.maximum(body[idx], 0.0) / rng[idx] +
+                   0.3 * (np.minimum(o[-1, idx], c[-1, idx]) - l[-1, idx]) / rng[idx])
+        flow = np.where(has_flow[idx] & ~np.isnan(net_pct_main[idx]), net_pct_main[idx], 0.0)
+
+    def _z(x):
+        s = x.std(ddof=1) if len(x) > 1 else 0.0
+        if s < 1e-8:
+            return x * 0
+        return (x - x.mean()) / s
+
+    wsum = g.W_VOL + g.W_FLOW + g.W_MOM + g.W_PATTERN
+    score = (g.W_VOL * _z(vol_ratio[idx]) +
+             g.W_FLOW * _z(flow) +
+             g.W_MOM * _z(mom3) +
+             g.W_PATTERN * _z(pattern)) / (wsum + 1e-9)
+    order = np.argsort(-score, kind='stable')
+    return [(panel.codes[idx[i]], float(score[i])) for i in order]
+
+
 # ------------------------ 盘中买入与风控 ------------------------
 
 def _update_intraday_breakout_ref(context):
@@ -310,6 +453,12 @@ def _update_intraday_breakout_ref(context):
     codes = [c for c in g.watchlist if c not in held]
     if not codes:
         return
+    if BAR_CACHE_AVAILABLE:
+        # 只拉取上次之后的新bar，开盘以来最高价 O(1) 读取；include_now=True 保证包含当前bar
+        update_bar_cache(context, codes, include_now=True)
+        for c in codes:
+            g.breakout_price[c] = max(g.breakout_price.get(c, 0.0), bar_day_high(c))
+        return
     try:
         # 从开盘至当前分钟（含）取分钟K线，统计最高价
         now = context.current_dt
@@ -389,6 +538,8 @@ def _try_open_positions(context):
             'highest': current_data[c].last_price,
             'entry_date': g.today
         }
+        if RISK_ENGINE_AVAILABLE:
+            g.risk_book.upsert(c, current_data[c].last_price, g.today)
         log.info('买入: %s, 目标资金: %.0f' % (c, per_val))
 
 
@@ -402,6 +553,12 @@ def _manage_positions_intraday(context):
     now = context.current_dt
     hhmm = now.strftime('%H:%M')
 
+    if RISK_ENGINE_AVAILABLE:
+        # 整本持仓一次向量判定（持有天数上限同样只在14:50之后判定）
+        g.risk_book.sync(context)
+        _close_positions(g.risk_book.evaluate(context, check_time=hhmm >= '14:50'))
+        return
+
     current_data = get_current_data()
     to_close = []
 
@@ -443,11 +600,17 @@ def _manage_positions_intraday(context):
             if hold_days >= g.MAX_HOLD_DAYS:
                 to_close.append((c, 'TIME'))
 
-    # 执行平仓
+    _close_positions(to_close)
+
+
+def _close_positions(to_close):
+    """执行平仓并清理缓存，to_close 为 [(code, reason), ...]"""
     for c, reason in to_close:
         order_target_value(c, 0)
         if c in g.pos_info:
             del g.pos_info[c]
         if c in g.breakout_price:
             del g.breakout_price[c]
+        if RISK_ENGINE_AVAILABLE:
+            g.risk_book.remove(c)
         log.info('卖出: %s, 原因: %s' % (c, reason))
\ No newline at end of file
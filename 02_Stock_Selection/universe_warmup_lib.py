@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+聚宽盘前预热库 - 收盘后生成次日候选股票池
+ST、上市天数、市值、成交额、国九条、涨停形态等过滤只依赖上一交易日收盘后的数据，
+收盘后算好并保存为紧凑的产物，次日盘前/竞价回调只做依赖盘中数据的过滤（开盘价、竞价等）
+
+功能模块：
+1. 产物读写
+   - save_warmup(name, for_date, universes, meta=None)  # 保存某个交易日要用的股票池
+   - load_warmup(name, for_date)  # 读取；日期不匹配或不存在时返回 None
+
+2. 日期工具
+   - next_trade_date(date)  # date 之后的下一个交易日
+
+产物格式（JSON，紧凑分隔符）：
+{"for_date": "2024-01-03", "data_date": "2024-01-02", "universes": {"pool": [...]}, "meta": {...}}
+
+存储说明：
+- 进程内缓存一份，回测中直接命中
+- 同时通过 write_file 写入研究目录 warmup/<name>.json，模拟盘重启后仍可读取
+  （write_file/read_file 不可用时只保留进程内缓存）
+
+使用说明：
+1. 将本文件放在聚宽研究根目录
+2. 在策略中导入：from universe_warmup_lib import *
+3. run_daily(warm_up, time='15:30') 中计算并 save_warmup；盘前 load_warmup 命中则跳过重算
+"""
+
+# 聚宽API导入
+try:
+    from kuanke.user_space_api import *
+except:
+    pass
+
+import json
+import datetime as dt
+
+import numpy as np
+
+
+class UniverseWarmupLib:
+    """
+    盘前预热产物存储
+    """
+
+    def __init__(self, directory='warmup'):
+        """
+        Args:
+            directory: 研究目录下的产物子目录
+        """
+        self.directory = directory
+        self._cache = {}  # name -> 产物字典
+
+    def _path(self, name):
+        return f"{self.directory}/{name}.json"
+
+    def save(self, name, for_date, universes, data_date=None, meta=None):
+        """
+        保存预热产物
+
+        Args:
+            name: 产物名称（一个策略一个名称）
+            for_date: 产物适用的交易日
+            universes: {池名称: 代码列表}
+            data_date: 计算所用数据的截止日期
+            meta: 其他需要带到次日的小字段（计数等）
+
+        Returns:
+            dict: 保存的产物
+        """
+        artifact = {
+            'for_date': str(for_date),
+            'data_date': str(data_date) if data_date is not None else None,
+            'universes': {k: list(v) for k, v in universes.items()},
+            'meta': meta or {},
+        }
+        self._cache[name] = artifact
+        try:
+            write_file(self._path(name), json.dumps(artifact, separators=(',', ':')))
+        except Exception as e:
+            log.warning(f"预热产物写入文件失败 {name}: {e}")
+        sizes = ', '.join(f"{k}={len(v)}" for k, v in artifact['universes'].items())
+        log.info(f"预热产物已保存 {name} -> {for_date}: {sizes}")
+        return artifact
+
+    def load(self, name, for_date):
+        """
+        读取预热产物
+
+        Args:
+            name: 产物名称
+            for_date: 需要的交易日
+
+        Returns:
+            dict: 产物；不存在或日期不匹配时返回 None
+        """
+        artifact = self._cache.get(name)
+        if artifact is None:
+            try:
+                content = read_file(self._path(name))
+                if content:
+                    if isinstance(content, bytes):
+                        content = content.decode('utf-8')
+                    artifact = json.loads(content)
+                    self._cache[name] = artifact
+            except Exception:
+                artifact = None
+        if artifact is None or artifact.get('for_date') != str(for_date):
+            return None
+        return artifact
+
+    @staticmethod
+    def next_trade_date(date):
+        """
+        date 之后的下一个交易日
+        """
+        if isinstance(date, dt.datetime):
+            date = date.date()
+        days = get_all_trade_days()
+        i = int(np.searchsorted(days, date, side='right'))
+        return days[i] if i < len(days) else None
+
+
+# 创建全局预热实例
+universe_warmup = UniverseWarmupLib()
+
+# ==================== 导出函数 ====================
+
+def save_warmup(name, for_date, universes, data_date=None, meta=None):
+    """保存某个交易日要用的预热股票池"""
+    return universe_warmup.save(name, for_date, universes, data_date, meta)
+
+def load_warmup(name, for_date):
+    """读取预热股票池，日期不匹配或不存在时返回 None"""
+    return universe_warmup.load(name, for_date)
+
+def next_trade_date(date):
+    """date 之后的下一个交易日"""
+    return universe_warmup.next_trade_date(date)
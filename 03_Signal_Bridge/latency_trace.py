@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+信号桥 - 端到端延迟追踪
+在委托意图产生时分配追踪ID，随信号经过信号桥、QMT监听、下单执行器，
+每一跳记录一个时间戳，事后汇总每一跳的 p50/p99 延迟
+
+功能模块：
+1. 记录（聚宽端 / QMT端各写各的追踪文件）
+   - trace_id = new_trace()  # 分配追踪ID并记录 'intent'
+   - trace_hop(trace_id, 'order')  # 记录一跳
+   - configure_trace(directory, prefix)  # 追踪文件目录与前缀，默认 traces/jq-YYYYMMDD.trc
+   - flush_trace(context)  # 聚宽端：把缓存的跳点一次写入研究目录（redis_batched 回调结束时自动调用）
+
+2. 汇总
+   - python latency_trace.py traces/  # 合并目录下全部追踪文件，按追踪ID串联，输出每一跳 p50/p99
+
+跳点（按顺序）：
+    intent   策略决定下单（三马 open_position / close_position，追踪ID随委托意图发布到 Redis）
+    order    聚宽下单函数返回
+    publish  写入信号桥（段文件追加 / Redis 管道写入）
+    pickup   QMT端监听程序读到信号
+    submit   执行器调用 order_stock_async
+    ack      柜台确认委托
+    fill     全部成交
+
+文件格式：每条 17 字节（小端）trace_id u64 | hop u8 | ts_ns i64，只追加
+
+注意：
+- 聚宽与本地机器的时钟偏差会计入 publish -> pickup 这一跳
+- 聚宽端 write_file 是远程调用，跳点先缓存在内存，回调结束时按 context.current_dt 的交易日一次写入
+  （缓存满 flush_every 条时提前写入），不在下单路径上逐条写文件
+"""
+
+import os
+import sys
+import time
+import struct
+import unicodedata
+import datetime as dt
+
+import numpy as np
+
+# 聚宽环境下通过 write_file 写入研究目录
+try:
+    from kuanke.user_space_api import write_file
+    _JQ = True
+except Exception:
+    _JQ = False
+
+HOPS = ('intent', 'order', 'publish', 'pickup', 'submit', 'ack', 'fill')
+HOP_CODES = {name: i for i, name in enumerate(HOPS)}
+RECORD = struct.Struct('<QBq')
+DTYPE = np.dtype([('trace_id', '<u8'), ('hop', 'u1'), ('ts_ns', '<i8')])
+
+
+def now_ns():
+    """当前时间（纳秒），兼容没有 time.time_ns 的 Python 3.6"""
+    return int(time.time() * 1e9)
+
+
+class TraceWriter:
+    """
+    追踪记录写入：每个交易日一个文件，只追加
+    """
+
+    def __init__(self, directory='traces', prefix='jq', use_jq_file=_JQ, enabled=True, flush_every=1024):
+        """
+        Args:
+            directory: 追踪文件目录
+            prefix: 文件名前缀（区分聚宽端 jq 与 QMT 端 qmt）
+            use_jq_file: 通过聚宽 write_file 写入研究目录（跳点缓存到 flush 时写入）
+            enabled: 是否记录
+            flush_every: 聚宽端缓存的跳点数达到该值时提前写入
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.use_jq_file = use_jq_file
+        self.enabled = enabled
+        self._ms = 0
+        self._counter = 0
+        self.flush_every = flush_every
+        self._day = None
+        self._fd = None
+        self._buffer = []        # 聚宽端缓存的跳点记录
+        self._buffer_day = None  # 最近一次 flush 的交易日
+
+    def new_id(self):
+        """
+        分配追踪ID：毫秒时间戳 << 20 | 毫秒内计数，单进程内唯一
+        """
+        ms = int(time.time() * 1000)
+        if ms != self._ms:
+            self._ms, self._counter = ms, 0
+        self._counter += 1
+        return (ms << 20) | (self._counter & 0xFFFFF)
+
+    def _path(self, day):
+        return f"{self.directory}/{self.prefix}-{day.strftime('%Y%m%d')}.trc"
+
+    def hop(self, trace_id, hop, ts_ns=None):
+        """
+        记录一跳
+
+        Args:
+            trace_id: 追踪ID（0 表示未追踪，直接忽略）
+            hop: 跳点名称，见 HOPS
+            ts_ns: 时间戳（纳秒），默认当前时间
+        """
+        if not self.enabled or not trace_id:
+            return
+        ts_ns = now_ns() if ts_ns is None else ts_ns
+        data = RECORD.pack(trace_id, HOP_CODES[hop], ts_ns)
+        if self.use_jq_file:
+            self._buffer.append(data)
+            if len(self._buffer) >= self.flush_every:
+                self.flush()
+            return
+        day = dt.date.today()
+        try:
+            if day != self._day:
+                self.close()
+                os.makedirs(self.directory, exist_ok=True)
+                self._fd = os.open(self._path(day), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                self._day = day
+            os.write(self._fd, data)
+        except Exception as e:
+            # 追踪失败不影响交易
+            self.enabled = False
+            print(f"延迟追踪写入失败，已关闭: {e}")
+
+    def flush(self, day=None):
+        """
+        聚宽端：把缓存的跳点一次写入 day（交易日，默认沿用上次的交易日）的追踪文件
+        """
+        if day is not None:
+            self._buffer_day = day
+        if not self._buffer:
+            return
+        data, self._buffer = b''.join(self._buffer), []
+        try:
+            write_file(self._path(self._buffer_day or dt.date.today()), data, append=True)
+        except Exception as e:
+            self.enabled = False
+            print(f"延迟追踪写入失败，已关闭: {e}")
+
+    def close(self):
+        self.flush()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._day = None
+
+
+# 创建全局追踪实例
+tracer = TraceWriter()
+
+# ==================== 导出函数 ====================
+
+def configure_trace(directory='traces', prefix='jq', enabled=True):
+    """设置追踪文件目录、前缀与开关"""
+    tracer.close()
+    tracer.directory = directory
+    tracer.prefix = prefix
+    tracer.enabled = enabled
+
+def new_trace(hop='intent'):
+    """分配追踪ID并记录第一跳，返回追踪ID"""
+    trace_id = tracer.new_id()
+    tracer.hop(trace_id, hop)
+    return trace_id
+
+def trace_hop(trace_id, hop, ts_ns=None):
+    """记录一跳"""
+    tracer.hop(trace_id, hop, ts_ns)
+
+def flush_trace(context=None):
+    """聚宽端：把缓存的跳点写入 context.current_dt 所在交易日的追踪文件"""
+    tracer.flush(context.current_dt.date() if context is not None else None)
+
+
+# ==================== 汇总 ====================
+
+def load_traces(paths):
+    """
+    读取追踪文件（文件或目录），返回结构化数组 (trace_id, hop, ts_ns)
+    """
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            files += [os.path.join(p, f) for f in sorted(os.listdir(p)) if f.endswith('.trc')]
+        else:
+            files.append(p)
+    chunks = []
+    for f in files:
+        with open(f, 'rb') as fh:
+            data = fh.read()
+        n = len(data) // RECORD.size
+        chunks.append(np.frombuffer(data[:n * RECORD.size], dtype=DTYPE))
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=DTYPE)
+
+
+def summarize(records):
+    """
+    按追踪ID串联，统计相邻跳点间延迟与首尾延迟
+
+    Returns:
+        list: [(跳段名称, 样本数, p50毫秒, p99毫秒), ...]
+    """
+    if len(records) == 0:
+        return []
+    # 同一追踪同一跳点取最早时间
+    order = np.lexsort((records['ts_ns'], records['hop'], records['trace_id']))
+    r = records[order]
+    first = np.ones(len(r), dtype=bool)
+    first[1:] = (r['trace_id'][1:] != r['trace_id'][:-1]) | (r['hop'][1:] != r['hop'][:-1])
+    r = r[first]
+
+    # 相邻跳点：同一追踪内按跳点顺序的前后两条
+    same = r['trace_id'][1:] == r['trace_id'][:-1]
+    a, b = r[:-1][same], r[1:][same]
+    rows = []
+    for ha, hb in sorted(set(zip(a['hop'].tolist(), b['hop'].tolist()))):
+        m = (a['hop'] == ha) & (b['hop'] == hb)
+        ms = (b['ts_ns'][m] - a['ts_ns'][m]) / 1e6
+        rows.append((f"{HOPS[ha]} -> {HOPS[hb]}", int(m.sum()),
+                     float(np.percentile(ms, 50)), float(np.percentile(ms, 99))))
+
+    # 首尾：每个追踪的第一跳到最后一跳
+    starts = np.flatnonzero(np.r_[True, ~same])
+    ends = np.r_[starts[1:] - 1, len(r) - 1]
+    multi = ends > starts
+    if multi.any():
+        s, e = r[starts[multi]], r[ends[multi]]
+        for ha, hb in sorted(set(zip(s['hop'].tolist(), e['hop'].tolist()))):
+            m = (s['hop'] == ha) & (e['hop'] == hb)
+            if hb - ha < 2:
+                continue
+            ms = (e['ts_ns'][m] - s['ts_ns'][m]) / 1e6
+            rows.append((f"{HOPS[ha]} => {HOPS[hb]}（全程）", int(m.sum()),
+                         float(np.percentile(ms, 50)), float(np.percentile(ms, 99))))
+    return rows
+
+
+def _ljust(text, width):
+    """按显示宽度左对齐（中文占两格）"""
+    shown = sum(2 if unicodedata.east_asian_width(c) in 'WF' else 1 for c in text)
+    return text + ' ' * max(width - shown, 0)
+
+
+def print_summary(paths):
+    records = load_traces(paths)
+    rows = summarize(records)
+    print(f"追踪记录 {len(records)} 条，追踪ID {len(np.unique(records['trace_id']))} 个")
+    print(f"{_ljust('跳段', 28)}{'样本':>6}{'p50(ms)':>12}{'p99(ms)':>12}")
+    for name, n, p50, p99 in rows:
+        print(f"{_ljust(name, 28)}{n:>8}{p50:>12.2f}{p99:>12.2f}")
+    return rows
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("用法: python latency_trace.py <追踪文件或目录> [...]")
+    else:
+        print_summary(sys.argv[1:])
@@ -0,0 +1,659 @@
+# -*- coding: utf-8 -*-
+"""
+信号桥 - Redis 协议的委托意图通道
+与 三马/strategy9_4.py 中预留的 nredistrade 接口保持一致：setup_redis_trade(context, 'strategy1')，
+委托意图写入 Redis Stream，QMT 端以消费组方式读取并确认
+
+功能模块：
+1. 发布端（聚宽实盘环境）
+   - setup_redis_trade(context, 'strategy1', host, port)  # 建立连接，未调用时发布为空操作
+   - publish_order_intent(context, security, value)  # 下单后发布一条委托意图
+   - @redis_batched  # 装饰定时任务：回调内的意图缓存起来，回调结束时一次管道写入
+
+2. 消费端（QMT）
+   - RedisIntentConsumer(client, stream, group, consumer)
+   - 启动时先重放本消费者已投递未确认的意图（XREADGROUP ... 0），再读取新意图（>）
+   - 执行成功后 XACK；崩溃重启从最后确认的位置继续
+
+3. 本地替身与基准
+   - FakeRedisServer()  # 进程内的 Redis 协议服务端，支持 PING/XADD/XGROUP/XREADGROUP/XACK/XLEN/XPENDING/DEL
+   - python redis_channel.py --bench  # 离线测量端到端延迟与吞吐
+
+实现说明：
+- 只依赖标准库，自带最小 RESP 客户端，可直接连接真实 Redis（>= 5.0）
+- 意图字段：strategy, day, epoch, seq, code, side, value, qty, reason, ts_ns, trace_id（方向、原因代码与 signal_log 相同）
+- seq 在发布端进程内从 1 递增，epoch 为发布端启动时间（秒），(day, strategy, epoch, seq) 在交易日内唯一
+- 带追踪ID的意图在管道写入后记录 'publish' 跳点（见 latency_trace.py）
+- 发布失败（断线、超时）只打印日志，不影响策略回调；意图保留在缓存中，下次写入时按原顺序重发
+- 连接出错后丢弃该连接（未读的回复不再错位），下一条命令时重新连接
+"""
+
+import os
+import sys
+import time
+import socket
+import threading
+import functools
+import bisect
+import socketserver
+from collections import OrderedDict
+
+try:
+    from signal_log import REASON_CODES, SIDE_BUY, SIDE_SELL, SIDE_TARGET
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from signal_log import REASON_CODES, SIDE_BUY, SIDE_SELL, SIDE_TARGET
+
+# 延迟追踪（可选）
+try:
+    from latency_trace import tracer
+except ImportError:
+    tracer = None
+
+
+class RedisError(Exception):
+    """Redis 返回的错误"""
+
+
+# ==================== RESP 协议 ====================
+
+def encode_command(*args):
+    """编码一条命令为 RESP 数组"""
+    out = [b'*%d\r\n' % len(args)]
+    for a in args:
+        if not isinstance(a, bytes):
+            a = str(a).encode('utf-8')
+        out.append(b'$%d\r\n%s\r\n' % (len(a), a))
+    return b''.join(out)
+
+
+def read_reply(f):
+    """从缓冲读取器解析一个 RESP 回复（错误回复以 RedisError 实例返回）"""
+    line = f.readline()
+    if not line:
+        raise ConnectionError('连接已关闭')
+    kind, body = line[:1], line[1:-2]
+    if kind == b'+':
+        return body.decode('utf-8')
+    if kind == b'-':
+        return RedisError(body.decode('utf-8'))
+    if kind == b':':
+        return int(body)
+    if kind == b'$':
+        n = int(body)
+        if n < 0:
+            return None
+        data = f.read(n + 2)
+        return data[:-2]
+    if kind == b'*':
+        n = int(body)
+        if n < 0:
+            return None
+        return [read_reply(f) for _ in range(n)]
+    raise RedisError(f'无法解析的回复: {line!r}')
+
+
+class RespClient:
+    """
+    最小 RESP 客户端：单条命令与管道批量命令
+    """
+
+    def __init__(self, host='127.0.0.1', port=6379, timeout=5.0):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.sock = None
+        self.rfile = None
+        self._connect()
+
+    def _connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile('rb')
+
+    def execute(self, *args):
+        """执行一条命令"""
+        return self.pipeline([args])[0]
+
+    def pipeline(self, commands, raise_on_error=True):
+        """
+        一次写出多条命令再依次读取回复
+
+        Args:
+            commands: 命令参数元组列表
+            raise_on_error: 任一回复为错误时抛出
+        """
+        if not commands:
+            return []
+        if self.sock is None:
+            self._connect()
+        try:
+            self.sock.sendall(b''.join(encode_command(*c) for c in commands))
+            replies = [read_reply(self.rfile) for _ in commands]
+        except Exception:
+            # 回复可能只读了一部分，连接不能再用
+            self.close()
+            raise
+        if raise_on_error:
+            for r in replies:
+                if isinstance(r, RedisError):
+                    raise r
+        return replies
+
+    def close(self):
+        if self.sock is not None:
+            self.rfile.close()
+            self.sock.close()
+        self.sock = self.rfile = None
+
+
+# ==================== 意图编码 ====================
+
+def encode_intent(strategy, seq, code, side, value=0.0, qty=0, reason=0, ts_ns=None, trace_id=0, day=None,
+                  epoch=0):
+    """委托意图 -> XADD 字段列表（day 为交易日 YYYYMMDD，默认取 ts_ns 的日期）"""
+    if isinstance(reason, str):
+        reason = REASON_CODES[reason]
+    if ts_ns is None:
+        ts_ns = int(time.time() * 1e9)
+    if day is None:
+        day = int(time.strftime('%Y%m%d', time.localtime(ts_ns / 1e9)))
+    fields = ['strategy', strategy, 'day', day, 'epoch', epoch, 'seq', seq, 'code', code, 'side', side,
+              'value', repr(float(value)), 'qty', int(qty), 'reason', reason, 'ts_ns', ts_ns]
+    if trace_id:
+        fields += ['trace_id', int(trace_id)]
+    return fields
+
+
+def decode_intent(fields):
+    """XREADGROUP 返回的字段列表 -> 意图字典"""
+    raw = {fields[i].decode('utf-8'): fields[i + 1].decode('utf-8') for i in range(0, len(fields), 2)}
+    return {
+        'strategy': raw['strategy'],
+        'day': int(raw['day']),
+        'epoch': int(raw['epoch']),
+        'seq': int(raw['seq']),
+        'code': raw['code'],
+        'side': int(raw['side']),
+        'value': float(raw['value']),
+        'qty': int(raw['qty']),
+        'reason': int(raw['reason']),
+        'ts_ns': int(raw['ts_ns']),
+        'trace_id': int(raw.get('trace_id', 0)),
+    }
+
+
+class RedisIntentPublisher:
+    """
+    委托意图发布端：批次内缓存，flush 时一次管道写入
+    """
+
+    def __init__(self, client, strategy, stream='jq:intents', maxlen=100000):
+        """
+        Args:
+            client: RespClient
+            strategy: 策略名称（对应 setup_redis_trade 的第二个参数）
+            stream: Redis Stream 键名
+            maxlen: Stream 近似保留长度
+        """
+        self.client = client
+        self.strategy = strategy
+        self.stream = stream
+        self.maxlen = maxlen
+        self.seq = 0
+        self.epoch = int(time.time())   # 进程重启后 seq 从 1 重新开始，用 epoch 区分
+        self._pending = []     # [(XADD 命令, 追踪ID)]，写入成功后才移除
+        self._depth = 0
+        self.failures = 0      # 写入失败次数
+
+    def publish(self, code, side, value=0.0, qty=0, reason=0, ts_ns=None, trace_id=0, day=None):
+        """
+        发布一条意图；批次内只缓存，批次外立即写入
+
+        Returns:
+            str: 批次外返回 Stream id（写入失败时为 None），批次内返回 None
+        """
+        self.seq += 1
+        self._pending.append((('XADD', self.stream, 'MAXLEN', '~', self.maxlen, '*',
+                               *encode_intent(self.strategy, self.seq, code, side, value, qty, reason, ts_ns,
+                                              trace_id, day, self.epoch)), trace_id))
+        if self._depth == 0:
+            ids = self.flush()
+            return ids[-1] if ids else None
+        return None
+
+    def flush(self):
+        """
+        管道写入缓存的意图；连接失败时保留缓存，下次写入时重发
+
+        Returns:
+            list: 本次写入成功的 Stream id 列表
+        """
+        if not self._pending:
+            return []
+        batch = list(self._pending)
+        try:
+            replies = self.client.pipeline([c for c, _ in batch], raise_on_error=False)
+        except Exception as e:
+            self.failures += 1
+            print(f"委托意图写入 Redis 失败，{len(batch)} 条保留到下次重发: {type(e).__name__}: {e}")
+            return []
+        del self._pending[:len(batch)]
+        ids = []
+        for (command, trace_id), reply in zip(batch, replies):
+            if isinstance(reply, RedisError):
+                # 服务端拒绝的命令重发也不会成功，丢弃
+                print(f"委托意图被 Redis 拒绝 {command[6:]}: {reply}")
+                continue
+            ids.append(reply.decode('utf-8'))
+            if tracer is not None and trace_id:
+                tracer.hop(trace_id, 'publish')
+        return ids
+
+    def begin(self):
+        """开始批次（可嵌套）"""
+        self._depth += 1
+
+    def end(self):
+        """结束批次，最外层结束时写入"""
+        self._depth -= 1
+        if self._depth == 0:
+            return self.flush()
+        return []
+
+
+class RedisIntentConsumer:
+    """
+    委托意图消费端：消费组读取，执行成功后确认
+    """
+
+    def __init__(self, client, stream='jq:intents', group='qmt', consumer='qmt-1'):
+        """
+        Args:
+            client: RespClient
+            stream: Redis Stream 键名
+            group: 消费组名称
+            consumer: 本消费者名称（重启后保持不变才能重放未确认的意图）
+        """
+        self.client = client
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer
+        self._replay_from = '0'   # 重放本消费者未确认意图的游标，重放完成后置 None
+        self.ensure_group()
+
+    def ensure_group(self):
+        """创建消费组（已存在时忽略）"""
+        try:
+            self.client.execute('XGROUP', 'CREATE', self.stream, self.group, '0', 'MKSTREAM')
+        except RedisError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def read(self, count=100, block_ms=1000):
+        """
+        读取一批意图：先重放已投递未确认的，再读取新的
+
+        Returns:
+            list: [(stream_id, intent), ...]
+        """
+        if self._replay_from is not None:
+            reply = self.client.execute('XREADGROUP', 'GROUP', self.group, self.consumer, 'COUNT', count,
+                                        'STREAMS', self.stream, self._replay_from)
+            entries = reply[0][1] if reply else []
+            if entries:
+                self._replay_from = entries[-1][0].decode('utf-8')
+                return [(i.decode('utf-8'), decode_intent(f)) for i, f in entries]
+            self._replay_from = None
+        reply = self.client.execute('XREADGROUP', 'GROUP', self.group, self.consumer, 'COUNT', count,
+                                    'BLOCK', block_ms, 'STREAMS', self.stream, '>')
+        if not reply:
+            return []
+        return [(i.decode('utf-8'), decode_intent(f)) for i, f in reply[0][1]]
+
+    def ack(self, ids):
+        """确认一批意图"""
+        if not ids:
+            return 0
+        return self.client.execute('XACK', self.stream, self.group, *ids)
+
+    def run(self, handler, stop=None, count=100, block_ms=200):
+        """
+        持续消费：handler(intent) 不抛异常即确认；抛出异常的意图保持未确认，下次启动时重放
+        """
+        while not (stop and stop.is_set()):
+            done = []
+            try:
+                entries = self.read(count, block_ms)
+            except (OSError, ConnectionError) as e:
+                # 断线：下次读取时重连，并从头重放本消费者未确认的意图
+                print(f"读取意图失败，稍后重连: {e}")
+                self._replay_from = '0'
+                time.sleep(block_ms / 1000)
+                continue
+            for sid, intent in entries:
+                if tracer is not None:
+                    tracer.hop(intent['trace_id'], 'pickup')
+                try:
+                    handler(intent)
+                    done.append(sid)
+                except Exception as e:
+                    print(f"意图处理失败 {sid} {intent}: {e}")
+            try:
+                self.ack(done)
+            except (OSError, ConnectionError) as e:
+                # 未确认的意图重连后重放
+                print(f"确认意图失败: {e}")
+                self._replay_from = '0'
+
+
+# ==================== 进程内 Redis 替身 ====================
+
+class FakeRedisServer:
+    """
+    进程内的 Redis 协议服务端，只实现意图通道用到的 Stream 命令
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.streams = {}    # key -> [(id_tuple, fields)]
+        self.ids = {}        # key -> [id_tuple]，与 streams 对齐，二分查找起点
+        self.last_id = {}    # key -> 最后生成的 id_tuple
+        self.groups = {}     # (key, group) -> {'last': id_tuple, 'pending': OrderedDict(id_tuple -> consumer)}
+        self.cond = threading.Condition()
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                while True:
+                    try:
+                        args = read_reply(self.rfile)
+                    except (ConnectionError, OSError):
+                        return
+                    self.wfile.write(server.dispatch(args))
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # ---------- 回复编码 ----------
+
+    @classmethod
+    def _encode(cls, value):
+        if value is None:
+            return b'*-1\r\n'
+        if isinstance(value, RedisError):
+            return b'-%s\r\n' % str(value).encode('utf-8')
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, str):
+            return b'+%s\r\n' % value.encode('utf-8')
+        if isinstance(value, bytes):
+            return b'$%d\r\n%s\r\n' % (len(value), value)
+        return b'*%d\r\n' % len(value) + b''.join(cls._encode(v) for v in value)
+
+    @staticmethod
+    def _parse_id(s):
+        s = s.decode('utf-8') if isinstance(s, bytes) else s
+        ms, _, seq = s.partition('-')
+        return int(ms), int(seq or 0)
+
+    @staticmethod
+    def _fmt_id(t):
+        return b'%d-%d' % t
+
+    # ---------- 命令 ----------
+
+    def dispatch(self, args):
+        cmd = args[0].upper().decode('utf-8')
+        try:
+            with self.cond:
+                if cmd == 'XREADGROUP':
+                    return self._encode(self._xreadgroup(args[1:]))
+                handler = getattr(self, '_' + cmd.lower(), None)
+                if handler is None:
+                    return self._encode(RedisError(f"ERR unknown command '{cmd}'"))
+                return self._encode(handler(args[1:]))
+        except RedisError as e:
+            return self._encode(e)
+
+    def _ping(self, args):
+        return 'PONG'
+
+    def _del(self, args):
+        n = 0
+        for k in args:
+            n += self.streams.pop(k, None) is not None
+            self.ids.pop(k, None)
+            for g in [g for g in self.groups if g[0] == k]:
+                del self.groups[g]
+        return n
+
+    def _xlen(self, args):
+        return len(self.streams.get(args[0], []))
+
+    def _xadd(self, args):
+        key, i = args[0], 1
+        maxlen = None
+        if args[i].upper() == b'MAXLEN':
+            i += 1
+            if args[i] in (b'~', b'='):
+                i += 1
+            maxlen = int(args[i])
+            i += 1
+        if args[i] != b'*':
+            raise RedisError('ERR only auto-generated ids are supported')
+        fields = list(args[i + 1:])
+        ms = int(time.time() * 1000)
+        last = self.last_id.get(key, (0, 0))
+        new = (ms, 0) if ms > last[0] else (last[0], last[1] + 1)
+        self.last_id[key] = new
+        entries = self.streams.setdefault(key, [])
+        ids = self.ids.setdefault(key, [])
+        entries.append((new, fields))
+        ids.append(new)
+        if maxlen is not None and len(entries) > maxlen:
+            del entries[:len(entries) - maxlen]
+            del ids[:len(ids) - maxlen]
+        self.cond.notify_all()
+        return self._fmt_id(new)
+
+    def _xgroup(self, args):
+        sub, key, group, start = args[0].upper(), args[1], args[2], args[3]
+        if sub != b'CREATE':
+            raise RedisError('ERR only XGROUP CREATE is supported')
+        if key not in self.streams:
+            if b'MKSTREAM' not in [a.upper() for a in args[4:]]:
+                raise RedisError('ERR The XGROUP subcommand requires the key to exist')
+            self.streams[key] = []
+            self.ids[key] = []
+        if (key, group) in self.groups:
+            raise RedisError('BUSYGROUP Consumer Group name already exists')
+        last = self.last_id.get(key, (0, 0)) if start == b'$' else self._parse_id(start)
+        self.groups[(key, group)] = {'last': last, 'pending': OrderedDict()}
+        return 'OK'
+
+    def _xreadgroup(self, args):
+        group, consumer = args[1], args[2]
+        count, block, i = None, None, 3
+        while args[i].upper() != b'STREAMS':
+            opt = args[i].upper()
+            if opt == b'COUNT':
+                count = int(args[i + 1])
+            elif opt == b'BLOCK':
+                block = int(args[i + 1])
+            i += 2
+        key, start = args[i + 1], args[i + 2]
+        state = self.groups.get((key, group))
+        if state is None:
+            raise RedisError('NOGROUP No such key or consumer group')
+        entries = self.streams.get(key, [])
+        ids = self.ids.get(key, [])
+
+        if start != b'>':
+            # 重放本消费者已投递未确认的条目
+            after = self._parse_id(start)
+            out = []
+            for sid, c in state['pending'].items():
+                if c == consumer and sid > after:
+                    i = bisect.bisect_left(ids, sid)
+                    out.append((sid, entries[i][1] if i < len(ids) and ids[i] == sid else []))
+                    if count and len(out) >= count:
+                        break
+            return [[key, [[self._fmt_id(s), f] for s, f in out]]]
+
+        deadline = None if block is None else time.monotonic() + block / 1000.0
+        while True:
+            i = bisect.bisect_right(ids, state['last'])
+            new = entries[i:i + count] if count else entries[i:]
+            if new:
+                break
+            if block is None:
+                return None
+            remaining = deadline - time.monotonic() if block else None
+            if remaining is not None and remaining <= 0:
+                return None
+            self.cond.wait(remaining)
+            entries = self.streams.get(key, [])
+            ids = self.ids.get(key, [])
+        state['last'] = new[-1][0]
+        for sid, _ in new:
+            state['pending'][sid] = consumer
+        return [[key, [[self._fmt_id(s), f] for s, f in new]]]
+
+    def _xack(self, args):
+        key, group = args[0], args[1]
+        state = self.groups.get((key, group))
+        if state is None:
+            return 0
+        n = 0
+        for s in args[2:]:
+            n += state['pending'].pop(self._parse_id(s), None) is not None
+        return n
+
+    def _xpending(self, args):
+        state = self.groups.get((args[0], args[1]))
+        pending = state['pending'] if state else {}
+        if not pending:
+            return [0, None, None, None]
+        sids = list(pending)
+        per = {}
+        for c in pending.values():
+            per[c] = per.get(c, 0) + 1
+        return [len(sids), self._fmt_id(sids[0]), self._fmt_id(sids[-1]),
+                [[c, str(n).encode()] for c, n in per.items()]]
+
+
+# ==================== nredistrade 兼容接口 ====================
+
+_publisher = None
+
+
+def setup_redis_trade(context, strategy, host='127.0.0.1', port=6379, stream='jq:intents'):
+    """
+    建立委托意图发布通道（与 nredistrade 的 setup_redis_trade(context, name) 调用方式一致）
+
+    Args:
+        context: 聚宽上下文对象
+        strategy: 策略名称
+        host/port: Redis 地址
+        stream: Redis Stream 键名
+    """
+    global _publisher
+    _publisher = RedisIntentPublisher(RespClient(host, port), strategy, stream)
+    return _publisher
+
+
+def publish_order_intent(context, security, value, order=None, reason=0, trace_id=0):
+    """
+    发布一条目标市值委托意图（未调用 setup_redis_trade 时为空操作）
+
+    Args:
+        context: 聚宽上下文对象
+        security: 证券代码
+        value: 目标市值（order_target_value 语义）
+        order: 聚宽返回的订单对象（目标市值语义下不传委托数量，由 QMT 端按持仓计算差额）
+        reason: 原因代码
+        trace_id: 延迟追踪ID（new_trace() 的返回值，0 表示不追踪）
+    """
+    if _publisher is None:
+        return None
+    try:
+        return _publisher.publish(security, SIDE_TARGET, value, 0, reason, trace_id=trace_id,
+                                  day=int(context.current_dt.strftime('%Y%m%d')))
+    except Exception as e:
+        # 委托已经下出，发布失败不能中断策略回调
+        print(f"委托意图发布失败 {security}: {type(e).__name__}: {e}")
+        return None
+
+
+def redis_batched(func):
+    """
+    定时任务装饰器：回调内发布的意图在回调结束时一次管道写入，缓存的追踪跳点一并写出
+    """
+    @functools.wraps(func)
+    def wrapper(context, *args, **kwargs):
+        if _publisher is not None:
+            _publisher.begin()
+        try:
+            return func(context, *args, **kwargs)
+        finally:
+            if _publisher is not None:
+                _publisher.end()
+            if tracer is not None:
+                tracer.flush(context.current_dt.date())
+    return wrapper
+
+
+# ==================== 离线基准 ====================
+
+def benchmark(count=20000, batch=20):
+    """
+    进程内替身上的端到端基准：发布端每 batch 条一次管道写入，消费端读取并确认
+    """
+    server = FakeRedisServer().start()
+    pub = RedisIntentPublisher(RespClient(server.host, server.port), 'bench')
+    consumer = RedisIntentConsumer(RespClient(server.host, server.port), group='bench')
+    latencies = []
+    stop = threading.Event()
+
+    def handle(intent):
+        latencies.append((time.time() * 1e9 - intent['ts_ns']) / 1e6)
+        if len(latencies) >= count:
+            stop.set()
+
+    t = threading.Thread(target=consumer.run, args=(handle, stop), daemon=True)
+    t.start()
+    started = time.perf_counter()
+    for i in range(0, count, batch):
+        pub.begin()
+        for j in range(i, min(i + batch, count)):
+            pub.publish('000001.XSHE', SIDE_BUY if j % 2 else SIDE_SELL, 10000, 100, 'open')
+        pub.end()
+    stop.wait(30)
+    elapsed = time.perf_counter() - started
+    t.join(timeout=1)
+    pending = consumer.client.execute('XPENDING', consumer.stream, consumer.group)[0]
+    server.stop()
+
+    latencies.sort()
+    n = len(latencies)
+    print(f"意图 {count} 条，批大小 {batch}，收到 {n} 条，未确认 {pending} 条")
+    if n:
+        print(f"吞吐 {n / elapsed:,.0f} 条/秒，端到端延迟 p50 {latencies[n // 2]:.2f}ms，"
+              f"p99 {latencies[min(n - 1, int(n * 0.99))]:.2f}ms")
+    return latencies
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        for b in (1, 20, 100):
+            benchmark(batch=b)
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+信号桥 - 追加写入的定长二进制信号日志
+聚宽端把交易信号写成定长、带校验的二进制记录，经文件同步工具（坚果云/OneDrive）传到 QMT 端，
+QMT 端按偏移量增量读取，不解析任何自由文本
+
+功能模块：
+1. 写入端（聚宽 / 本地）
+   - SignalLogWriter(directory).append(strategy_id, code, side, value, qty, reason)  # 返回序号
+   - with writer.callback('rebalance', context.current_dt): ...  # 回调内的信号带 (回调ID, 意图序号)
+
+2. 读取端（QMT）
+   - SignalLogReader(directory).poll()  # 返回上次之后新写入的完整记录
+
+文件格式：
+- 每个交易日一个段文件：signals-YYYYMMDD.seg
+- 段头 16 字节：magic 'JQSB' | 版本 u16 | 记录长度 u16 | 交易日 u32(YYYYMMDD) | 保留 u32
+- 记录 68 字节（小端），crc32 覆盖记录中 crc 之前的全部字节：
+    seq u64 | ts_ns i64 | strategy_id u16 | reason u16 | side i8 | 填充1 | intent u16 | code 12s | value f64 |
+    qty i64 | trace_id u64 | callback u32 | crc32 u32
+  intent 为回调内意图序号，trace_id 为延迟追踪ID（见 latency_trace.py），callback 为回调ID
+
+幂等键：
+- 同一回调重跑（模拟盘重启重放当前分钟）时序号会变，但 (策略, 交易日, 回调, 意图序号) 不变
+- 回调ID = crc32(回调名@信号时间 HHMMSS)，意图序号为回调内第几条信号（从1开始）
+- intent_key(rec) 把 (策略, 回调, 意图序号) 编成 u64，与交易日一起作为 QMT 端去重键；
+  不在回调内写出的信号（callback=0）退化为按 (交易日, 序号) 去重
+
+读取规则：
+- 只返回完整且校验通过的记录；尾部不完整的字节留到下次读取（同步工具可能只同步了一半）
+- 校验失败的记录若已不是文件末尾（后面还有数据），视为损坏并跳过，否则等待下次重试
+- 写入端重启时先处理上次崩溃留下的不完整尾部，之后追加的记录仍按整条对齐
+- 新交易日的段文件出现后，读完旧段剩余记录再切换
+
+使用说明：
+1. 聚宽端：将本文件放在聚宽研究根目录，SignalLogWriter(directory, use_jq_file=True)
+   通过 write_file(append=True) 写入研究目录，由同步工具同步到本地
+2. QMT端：SignalLogReader(同步目录).poll() 轮询或配合 04_QMT_Trading 中的监听程序使用
+"""
+
+import os
+import time
+import struct
+import zlib
+import datetime as dt
+from contextlib import contextmanager
+
+# 聚宽环境下通过 read_file/write_file 读写研究目录
+try:
+    from kuanke.user_space_api import read_file, write_file
+except Exception:
+    pass
+
+MAGIC = b'JQSB'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHHII')
+BODY = struct.Struct('<QqHHbxH12sdqQI')
+CRC = struct.Struct('<I')
+RECORD_SIZE = BODY.size + CRC.size
+
+# 方向
+SIDE_BUY = 1
+SIDE_SELL = -1
+SIDE_TARGET = 0  # 调整到目标市值/数量（order_target_value 语义）
+SIDE_WEIGHT = 2  # 调整到目标权重（value 为占子账户总值的比例，QMT端按各账户权益换算）
+
+# 原因代码
+REASON_CODES = {
+    'open': 1,          # 开仓
+    'close': 2,         # 平仓
+    'rebalance': 3,     # 调仓
+    'stop_loss': 4,     # 止损
+    'take_profit': 5,   # 止盈
+    'trail': 6,         # 移动止损
+    'time': 7,          # 持有到期
+    'limit_open': 8,    # 涨跌停打开
+    'defense': 9,       # 防御清仓
+}
+REASON_NAMES = {v: k for k, v in REASON_CODES.items()}
+
+
+def segment_name(day):
+    """交易日 -> 段文件名"""
+    return f"signals-{day.strftime('%Y%m%d')}.seg"
+
+
+def segment_day(name):
+    """段文件名 -> 交易日整数 YYYYMMDD（不是段文件返回 None）"""
+    if not (name.startswith('signals-') and name.endswith('.seg')):
+        return None
+    try:
+        return int(name[8:16])
+    except ValueError:
+        return None
+
+
+def callback_id(name, ts):
+    """回调名 + 信号时间（时分秒） -> 非零 u32 回调ID，同一回调重跑得到相同的ID"""
+    return zlib.crc32(f"{name}@{ts.strftime('%H%M%S')}".encode('utf-8')) & 0xffffffff or 1
+
+
+def intent_key(rec):
+    """
+    记录 -> 交易日内的幂等键（u64）
+
+    回调内的信号：strategy_id(15位) | callback(32位) | intent(16位)
+    其他信号：最高位置1 | 序号
+    """
+    if rec.get('callback'):
+        return ((rec['strategy_id'] & 0x7fff) << 48) | (rec['callback'] << 16) | rec['intent']
+    return (1 << 63) | rec['seq']
+
+
+def encode_header(day):
+    """生成段头"""
+    return HEADER.pack(MAGIC, VERSION, RECORD_SIZE, int(day.strftime('%Y%m%d')), 0)
+
+
+def encode_record(seq, ts_ns, strategy_id, code, side, value=0.0, qty=0, reason=0, trace_id=0,
+                  callback=0, intent=0):
+    """
+    编码一条信号记录
+
+    Returns:
+        bytes: RECORD_SIZE 字节
+    """
+    if isinstance(reason, str):
+        reason = REASON_CODES[reason]
+    body = BODY.pack(seq, ts_ns, strategy_id, reason, side, intent, code.encode('ascii')[:12],
+                     float(value), int(qty), int(trace_id), callback)
+    return body + CRC.pack(zlib.crc32(body) & 0xffffffff)
+
+
+def decode_record(buf, offset=0):
+    """
+    解码一条信号记录
+
+    Returns:
+        dict: 记录字段；校验失败返回 None
+    """
+    body = bytes(buf[offset:offset + BODY.size])
+    (crc,) = CRC.unpack_from(buf, offset + BODY.size)
+    if zlib.crc32(body) & 0xffffffff != crc:
+        return None
+    seq, ts_ns, strategy_id, reason, side, intent, code, value, qty, trace_id, callback = BODY.unpack(body)
+    return {
+        'seq': seq,
+        'ts_ns': ts_ns,
+        'strategy_id': strategy_id,
+        'reason': reason,
+        'side': side,
+        'code': code.rstrip(b'\0').decode('ascii'),
+        'value': value,
+        'qty': qty,
+        'trace_id': trace_id,
+        'callback': callback,
+        'intent': intent,
+    }
+
+
+class SignalLogWriter:
+    """
+    信号日志写入端：按交易日滚动段文件，序号在段内从1递增
+    """
+
+    def __init__(self, directory, use_jq_file=False):
+        """
+        Args:
+            directory: 段文件目录
+            use_jq_file: 在聚宽中通过 read_file/write_file 读写研究目录
+        """
+        self.directory = directory
+        self.use_jq_file = use_jq_file
+        self.day = None
+        self.path = None
+        self.seq = 0
+        self.callback_id = 0     # 当前回调ID，0 表示不在回调内
+        self.intent = 0          # 当前回调内已写出的意图数
+        self._fd = None
+
+    def _read_existing(self, path):
+        if self.use_jq_file:
+            try:
+                return read_file(path) or b''
+            except Exception:
+                return b''
+        if not os.path.exists(path):
+            return b''
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _write(self, data):
+        if self.use_jq_file:
+            write_file(self.path, data, append=True)
+            return
+        os.write(self._fd, data)
+
+    def _open(self, day):
+        """
+        切换到 day 的段文件，已存在时从最后一条有效记录续写序号
+
+        上次写到一半崩溃时段尾可能留有不完整的段头或记录：本地文件截断到最后一条完整记录；
+        聚宽研究目录只能追加，不完整的记录补零到整条（读取端按校验失败跳过），不完整的段头整体重写
+        """
+        self.close()
+        self.day = day
+        self.path = os.path.join(self.directory, segment_name(day))
+        existing = self._read_existing(self.path)
+        if len(existing) < HEADER.size:
+            whole = 0
+        else:
+            magic, version, size, _, _ = HEADER.unpack_from(existing)
+            if magic != MAGIC or version != VERSION or size != RECORD_SIZE:
+                raise ValueError(f"不支持的信号段文件: {self.path} (version={version}, size={size})")
+            whole = len(existing) - (len(existing) - HEADER.size) % RECORD_SIZE
+        if self.use_jq_file:
+            if 0 < len(existing) < HEADER.size:
+                write_file(self.path, b'', append=False)
+            elif whole < len(existing):
+                self._write(b'\0' * (RECORD_SIZE - (len(existing) - whole)))
+                whole += RECORD_SIZE
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            if whole < len(existing):
+                os.ftruncate(self._fd, whole)
+        self.seq = 0
+        if whole == 0:
+            self._write(encode_header(day))
+            return
+        n = (len(existing) - HEADER.size) // RECORD_SIZE
+        for i in range(n - 1, -1, -1):
+            rec = decode_record(existing, HEADER.size + i * RECORD_SIZE)
+            if rec is not None:
+                self.seq = rec['seq']
+                break
+
+    def begin_callback(self, name, ts=None):
+        """
+        开始一个回调：之后写出的信号带相同的回调ID和递增的意图序号
+
+        Args:
+            name: 回调名称（同一时间运行的不同回调需不同）
+            ts: 回调时间（datetime，聚宽中为 context.current_dt），默认当前时间
+        """
+        self.callback_id = callback_id(name, ts or dt.datetime.now())
+        self.intent = 0
+
+    def end_callback(self):
+        self.callback_id = 0
+        self.intent = 0
+
+    @contextmanager
+    def callback(self, name, ts=None):
+        """with writer.callback(name, context.current_dt): writer.append(...)"""
+        self.begin_callback(name, ts)
+        try:
+            yield self
+        finally:
+            self.end_callback()
+
+    def append(self, strategy_id, code, side, value=0.0, qty=0, reason=0, ts=None, day=None, trace_id=0):
+        """
+        追加一条信号
+
+        Args:
+            strategy_id: 策略编号（u16）
+            code: 证券代码，如 '000001.XSHE'
+            side: SIDE_BUY / SIDE_SELL / SIDE_TARGET / SIDE_WEIGHT
+            value: 目标市值或金额
+            qty: 目标数量或委托数量
+            reason: 原因代码（整数或 REASON_CODES 中的名称）
+            ts: 信号时间（datetime），默认当前时间
+            day: 交易日（date），默认取 ts 的日期
+            trace_id: 延迟追踪ID
+
+        Returns:
+            int: 本条记录的序号
+        """
+        ts = ts or dt.datetime.now()
+        day = day or ts.date()
+        if day != self.day:
+            self._open(day)
+        self.seq += 1
+        if self.callback_id:
+            self.intent += 1
+        ts_ns = int(time.mktime(ts.timetuple())) * 1000000000 + ts.microsecond * 1000
+        self._write(encode_record(self.seq, ts_ns, strategy_id, code, side, value, qty, reason, trace_id,
+                                  self.callback_id, self.intent))
+        return self.seq
+
+    def close(self):
+        """关闭当前段文件"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class SignalLogReader:
+    """
+    信号日志读取端：记录每个段的读取偏移量，只返回新写入的完整记录
+    """
+
+    def __init__(self, directory, start_day=None):
+        """
+        Args:
+            directory: 段文件目录（同步工具的本地目录）
+            start_day: 从哪个交易日开始读（date），默认今天
+        """
+        self.directory = directory
+        self.day = int((start_day or dt.date.today()).strftime('%Y%m%d'))
+        self.offset = 0          # 当前段已消费的字节偏移
+        self.corrupt = 0         # 跳过的损坏记录数
+
+    def _segments(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        days = sorted(d for d in (segment_day(n) for n in names) if d is not None and d >= self.day)
+        return days
+
+    def _path(self, day):
+        return os.path.join(self.directory, f"signals-{day}.seg")
+
+    def _read_segment(self, day):
+        """从当前偏移读取 day 段的新记录"""
+        path = self._path(day)
+        try:
+            with open(path, 'rb') as f:
+                if self.offset == 0:
+                    header = f.read(HEADER.size)
+                    if len(header) < HEADER.size:
+                        return []
+                    magic, version, size, _, _ = HEADER.unpack(header)
+                    if magic != MAGIC or version != VERSION or size != RECORD_SIZE:
+                        raise ValueError(f"不支持的信号段文件: {path} (version={version}, size={size})")
+                    self.offset = HEADER.size
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+
+        records = []
+        pos = 0
+        size = RECORD_SIZE
+        while pos + size <= len(data):
+            rec = decode_record(data, pos)
+            if rec is None:
+                # 不是最后一条：确定损坏，跳过；是最后一条：可能同步未完成，下次重试
+                if pos + 2 * size <= len(data):
+                    self.corrupt += 1
+                    pos += size
+                    continue
+                break
+            rec['offset'] = self.offset + pos
+            records.append(rec)
+            pos += size
+        self.offset += pos
+        return records
+
+    def poll(self):
+        """
+        读取新记录；当前段读完且出现更新的段时切换到新段
+
+        Returns:
+            list: 记录字典列表，每条附带 'day'（YYYYMMDD）与 'offset'（记录在段内的字节偏移）
+        """
+        out = []
+        while True:
+            for rec in self._read_segment(self.day):
+                rec['day'] = self.day
+                out.append(rec)
+            newer = [d for d in self._segments() if d > self.day]
+            if not newer:
+                return out
+            # 旧段已读到末尾（不完整的尾部记录在换日后不会再补齐）
+            self.day = newer[0]
+            self.offset = 0
+
+    def position(self):
+        """当前读取位置 (交易日, 偏移)，用于持久化后恢复"""
+        return self.day, self.offset
+
+    def seek(self, day, offset):
+        """恢复读取位置"""
+        self.day = int(day)
+        self.offset = int(offset)
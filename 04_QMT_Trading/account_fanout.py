@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+QMT端多账户分发 - 子账户目标权重按各实盘账户权益换算后并行下单
+聚宽策略用 set_subportfolios 把资金分成多个子账户，实盘中每个子账户对应一个（或多个）QMT资金账号。
+聚宽端在调仓后写出子账户的目标权重（SIDE_WEIGHT，value 为占子账户总值的比例），
+本模块把同一批权重换算成每个账号的目标市值，各账号并行执行，互不影响
+
+功能模块：
+1. 收集与分批
+   - fanout.submit_threadsafe(record)  # 作为 SignalWatcher 的执行回调
+   - 同一次同步到达的记录在 coalesce 秒内合并为一批，按 strategy_id（子账户序号）分组
+   - 各批依次执行：上一批执行期间到达的记录在其完成后作为下一批，不与之并行（保证先卖后买与按账号合计）
+
+2. 换算与并行执行
+   - 按账号分组，每个账号一个任务：查询总资产 -> 逐证券合计共用该账号的各子账户目标市值 -> 先卖后买
+   - 子账户的目标市值 = 权重 * 总资产 * 分配比例（SIDE_TARGET 为其目标市值），
+     各子账户最近一次的权重/目标保存在内存中，某个子账户调仓时不会覆盖其他子账户在同一证券上的份额
+   - 各账号之间 asyncio.gather 并行，账号数增加不拉长关键路径
+   - 单个账号查询失败、下单异常或超时只影响该账号，记录在报告中
+   - SIDE_BUY/SELL 按股数增减，原样分发给映射的全部账号
+   - 重启后某个子账户重新发出权重之前，其在共用证券上的份额按 0 计
+
+3. 逐账号核对报告
+   - 本批完成后查询账户持仓，与本地记录核对，并给出目标权重与实际权重的偏离（均相对账号总资产）
+   - format_report(reports) 输出文本报告
+   - on_done(record) 在记录映射的全部账号都执行成功后调用（例如 IntentJournal.ack），
+     有账号失败的记录不确认，监听程序重启后重放（权重信号按目标换算，重放是幂等的）
+
+本地演示：
+    python account_fanout.py --demo    # fake_xtquant 替身，1/4/8 个账号分别计时，其中一个账号故意失败
+
+使用说明：
+    fanout = AccountFanout({'a': AccountExecutor(...), 'b': AccountExecutor(...)},
+                           mapping={0: ['a'], 1: [('b', 1.0)]})
+    await fanout.start()
+    watcher = SignalWatcher(目录, executor=fanout.submit_threadsafe)
+"""
+
+import time
+import asyncio
+import logging
+import argparse
+
+from qmt_executor import AccountExecutor, to_qmt_code
+from signal_log import SIDE_WEIGHT, SIDE_TARGET
+
+try:
+    from xtquant import xtconstant
+except ImportError:
+    from fake_xtquant import xtconstant
+
+logger = logging.getLogger('account_fanout')
+
+
+class AccountFanout:
+    """
+    子账户权重 -> 多个资金账号的并行分发
+    """
+
+    def __init__(self, accounts, mapping, coalesce=0.05, account_timeout=60.0, drift_tolerance=0.02,
+                 on_done=None):
+        """
+        Args:
+            accounts: {账号名称: AccountExecutor}
+            mapping: {strategy_id: [账号名称 或 (账号名称, 分配比例), ...]}
+                     分配比例为该子账户占用账号总资产的比例，默认 1.0（账号专用于该子账户）
+            coalesce: 合并同一批记录的等待秒数
+            account_timeout: 单个账号执行一批的超时秒数
+            drift_tolerance: 核对报告中实际权重偏离目标超过该值才列出
+            on_done: 记录在全部映射账号执行成功后的回调 on_done(record)
+        """
+        self.accounts = accounts
+        self.mapping = {sid: [a if isinstance(a, tuple) else (a, 1.0) for a in names]
+                        for sid, names in mapping.items()}
+        self.coalesce = coalesce
+        self.account_timeout = account_timeout
+        self.drift_tolerance = drift_tolerance
+        self.on_done = on_done
+        self.holdings = {}          # strategy_id -> {QMT代码: 最近一次的权重/目标记录}
+        self.loop = None
+        self.batches = 0
+        self.reports = []           # 最近一批的报告
+        self._pending = []
+        self._flush_handle = None
+        self._flushing = None       # 唯一的执行任务，处理完全部待执行记录后结束
+        self._lock = None
+
+    async def start(self):
+        """在当前事件循环中注册各账号的回调"""
+        self.loop = asyncio.get_event_loop()
+        self._lock = asyncio.Lock()
+        for account in self.accounts.values():
+            account.attach(self.loop)
+
+    # ==================== 收集 ====================
+
+    def submit_threadsafe(self, record):
+        """从其他线程（SignalWatcher 回调）提交记录"""
+        self.loop.call_soon_threadsafe(self.submit, record)
+
+    def submit(self, record):
+        """在事件循环线程中提交记录，coalesce 秒后合并执行"""
+        self._pending.append(record)
+        if self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(self.coalesce, self._schedule_flush)
+
+    def _schedule_flush(self):
+        self._flush_handle = None
+        # 已有批次在执行时由它在结束后接着处理新记录
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.ensure_future(self._flush_pending())
+
+    async def _flush_pending(self):
+        while self._pending:
+            await self.flush()
+
+    async def drain(self):
+        """等待已提交的记录全部执行完毕"""
+        while self._pending or self._flush_handle is not None or \
+                (self._flushing is not None and not self._flushing.done()):
+            await asyncio.sleep(self.coalesce / 2 or 0.001)
+
+    # ==================== 执行 ====================
+
+    async def flush(self):
+        """
+        执行当前批次（与其他批次互斥）
+
+        Returns:
+            list: 各账号报告
+        """
+        async with self._lock:
+            return await self._flush()
+
+    async def _flush(self):
+        records, self._pending = self._pending, []
+        if not records:
+            return []
+        by_account = {}
+        for rec in records:
+            targets = self.mapping.get(rec['strategy_id'])
+            if not targets:
+                logger.warning(f"子账户 {rec['strategy_id']} 未映射资金账号，丢弃 {rec['code']}")
+                continue
+            if rec['side'] in (SIDE_WEIGHT, SIDE_TARGET):
+                self.holdings.setdefault(rec['strategy_id'], {})[to_qmt_code(rec['code'])] = rec
+            for name, _ in targets:
+                by_account.setdefault(name, []).append(rec)
+
+        started = time.perf_counter()
+        jobs = [self._run_account(name, recs) for name, recs in by_account.items()]
+        reports = await asyncio.gather(*jobs)
+        if self.on_done is not None:
+            failed = {r['account'] for r in reports if r['status'] != 'ok'}
+            for rec in records:
+                targets = self.mapping.get(rec['strategy_id'])
+                if targets and not failed.intersection(name for name, _ in targets):
+                    self.on_done(rec)
+        self.batches += 1
+        self.reports = list(reports)
+        logger.info(f"分发第 {self.batches} 批：记录 {len(records)} 条，账号 {len(reports)} 个，"
+                    f"用时 {(time.perf_counter() - started) * 1000:.0f}ms")
+        return self.reports
+
+    async def _run_account(self, name, records):
+        """单个账号执行一批；任何异常都只记录在该账号的报告中"""
+        report = {'account': name, 'status': 'ok', 'error': None, 'equity': None,
+                  'orders': 0, 'filled': 0, 'rejected': 0, 'elapsed_ms': 0.0, 'diffs': {}, 'drift': {}}
+        started = time.perf_counter()
+        try:
+            account = self.accounts[name]
+            targets = await asyncio.wait_for(self._execute(name, account, records, report), self.account_timeout)
+            report['diffs'] = await account.reconcile()
+            report['drift'] = self._drift(account, targets, report['equity'])
+        except asyncio.TimeoutError:
+            report['status'], report['error'] = 'timeout', f"超过 {self.account_timeout:.0f}s 未完成"
+        except Exception as e:
+            report['status'], report['error'] = 'failed', f"{type(e).__name__}: {e}"
+            logger.error(f"[{name}] 分发失败: {report['error']}")
+        report['elapsed_ms'] = (time.perf_counter() - started) * 1000
+        return report
+
+    async def _execute(self, name, account, records, report):
+        """
+        执行一个账号的全部记录
+
+        Returns:
+            dict: {QMT代码: 合计目标市值}
+        """
+        loop = asyncio.get_event_loop()
+        asset = await loop.run_in_executor(None, account.trader.query_stock_asset, account.account)
+        equity = report['equity'] = float(asset.total_asset)
+
+        # 本批涉及的证券按共用该账号的全部子账户合计目标市值，每只证券一笔目标信号
+        merged = {}
+        signals = []
+        for rec in records:
+            if rec['side'] in (SIDE_WEIGHT, SIDE_TARGET):
+                merged[to_qmt_code(rec['code'])] = rec
+            else:
+                signals.append(rec)
+        targets = {code: self._target_value(name, account, code, equity) for code in merged}
+        for code, rec in merged.items():
+            # 合并后的信号沿用本批该证券最后一条记录的委托备注与追踪ID
+            signals.append(dict(rec, side=SIDE_TARGET, value=targets[code], qty=0))
+
+        # 先卖后买：卖出释放的资金供买入使用
+        sells, buys = [], []
+        for s in signals:
+            planned = account.plan(s)
+            if planned is not None:
+                (sells if planned[1] == xtconstant.STOCK_SELL else buys).append(s)
+        for group in (sells, buys):
+            states = await asyncio.gather(*[account.submit(s) for s in group])
+            for state in states:
+                if state is None:
+                    continue
+                report['orders'] += 1
+                report['filled'] += state.status == 'filled'
+                report['rejected'] += state.status == 'rejected'
+        return targets
+
+    def _target_value(self, name, account, code, equity):
+        """共用账号 name 的各子账户在 code 上的目标市值之和"""
+        total = 0.0
+        for sid, targets in self.mapping.items():
+            for target, ratio in targets:
+                rec = self.holdings.get(sid, {}).get(code) if target == name else None
+                if rec is None:
+                    continue
+                if rec['side'] == SIDE_WEIGHT:
+                    total += max(rec['value'], 0.0) * equity * ratio
+                elif rec['qty'] > 0:
+                    total += rec['qty'] * account.price_func(code)
+                else:
+                    total += max(rec['value'], 0.0)
+        return total
+
+    def _drift(self, account, targets, equity):
+        """目标权重与实际权重的偏离 {QMT代码: (目标, 实际)}，均相对账号总资产"""
+        if not equity:
+            return {}
+        drift = {}
+        for code, value in targets.items():
+            target = value / equity
+            actual = account.positions.get(code, 0) * account.price_func(code) / equity
+            if abs(actual - target) > self.drift_tolerance:
+                drift[code] = (target, actual)
+        return drift
+
+
+def format_report(reports):
+    """逐账号核对报告文本"""
+    lines = []
+    for r in reports:
+        equity = f"{r['equity']:,.0f}" if r['equity'] is not None else '-'
+        lines.append(f"[{r['account']}] {r['status']} 权益 {equity} 委托 {r['orders']} 成交 {r['filled']} "
+                     f"废单 {r['rejected']} 用时 {r['elapsed_ms']:.0f}ms")
+        if r['error']:
+            lines.append(f"  错误: {r['error']}")
+        for code, (local, actual) in r['diffs'].items():
+            lines.append(f"  持仓差异 {code}: 本地 {local} 账户 {actual}")
+        for code, (target, actual) in r['drift'].items():
+            lines.append(f"  权重偏离 {code}: 目标 {target:.2%} 实际 {actual:.2%}")
+    return '\n'.join(lines)
+
+
+# ==================== 本地演示 ====================
+
+class _BrokenTrader:
+    """查询资产时抛异常的账号，演示失败隔离"""
+
+    def __init__(self, trader):
+        self._trader = trader
+
+    def __getattr__(self, name):
+        return getattr(self._trader, name)
+
+    def query_stock_asset(self, account):
+        raise ConnectionError('模拟账号断线')
+
+
+async def demo(account_counts=(1, 4, 8)):
+    """
+    两个子账户的权重分发到多个账号，比较不同账号数下一批的完成时间
+    """
+    from fake_xtquant import XtQuantTrader, StockAccount
+
+    prices = {'513100.SH': 1.5, '518880.SH': 5.0, '510300.SH': 4.0, '159915.SZ': 2.0}
+    weights = [
+        {'strategy_id': 0, 'code': '513100.XSHG', 'value': 0.0},
+        {'strategy_id': 0, 'code': '518880.XSHG', 'value': 0.98},
+        {'strategy_id': 1, 'code': '510300.XSHG', 'value': 0.6},
+        {'strategy_id': 1, 'code': '159915.XSHE', 'value': 0.35},
+    ]
+    for n in account_counts:
+        accounts, traders, mapping = {}, [], {0: [], 1: []}
+        for i in range(n):
+            trader = XtQuantTrader('', i, price_func=prices.get, cash=2e5 * (i + 1),
+                                   positions={'513100.SH': 20000}, ack_latency=0.005, fill_latency=0.02)
+            trader.start()
+            traders.append(trader)
+            if n > 1 and i == n - 1:
+                trader = _BrokenTrader(trader)
+            name = f"acct{i}"
+            accounts[name] = AccountExecutor(name, trader, StockAccount(name), prices.get, rate=50)
+            mapping[i % 2].append(name)
+        if n == 1:
+            # 只有一个账号时两个子账户按 9:1 共用
+            mapping = {0: [('acct0', 0.9)], 1: [('acct0', 0.1)]}
+        fanout = AccountFanout(accounts, mapping)
+        await fanout.start()
+        for seq, w in enumerate(weights, 1):
+            fanout.submit(dict(w, day=20240102, seq=seq, side=SIDE_WEIGHT, qty=0, reason=3, ts_ns=0, trace_id=0))
+        started = time.perf_counter()
+        await fanout.drain()
+        print(f"账号 {n} 个，一批完成 {(time.perf_counter() - started) * 1000:.0f}ms")
+        print(format_report(fanout.reports))
+        for t in traders:
+            t.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(description='QMT 多账户分发')
+    parser.add_argument('--demo', action='store_true', help='本地演示')
+    args = parser.parse_args()
+    if args.demo:
+        asyncio.run(demo())
+    else:
+        parser.print_help()
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+进程内 xtquant 交易接口替身 - 本地压测与联调用
+接口名称、常量取值、回调方式与 xtquant.xttrader 保持一致，
+委托在后台线程中按设定的延迟确认、成交，回调从后台线程发出（与 QMT 客户端一致）
+
+功能模块：
+1. xtconstant  # 委托方向、报价类型、委托状态常量
+2. StockAccount(account_id)  # 资金账号
+3. XtQuantTrader(path, session_id)  # 交易对象
+   - register_callback / start / connect / subscribe / stop
+   - order_stock_async / cancel_order_stock_async
+   - query_stock_positions / query_stock_asset / query_stock_orders
+
+模拟规则：
+- 下单后 ack_latency 秒回调 on_order_stock_async_response 并推送"已报"状态
+- 再过 fill_latency 秒按 price_func(code) 成交；partial_ratio 概率先部分成交一半
+- reject_ratio 概率废单（on_order_error）；卖出超过可用数量直接废单
+- 当日买入计入持仓但不计入可用数量（T+1）
+
+使用说明：
+    from fake_xtquant import XtQuantTrader, StockAccount, xtconstant
+    trader = XtQuantTrader('', 1, price_func=lambda code: 10.0, cash=1e6)
+"""
+
+import heapq
+import random
+import threading
+import time
+
+
+class xtconstant:
+    """xtquant.xtconstant 中用到的常量"""
+    STOCK_BUY = 23
+    STOCK_SELL = 24
+
+    FIX_PRICE = 11
+    LATEST_PRICE = 5
+
+    ORDER_UNREPORTED = 48
+    ORDER_WAIT_REPORTING = 49
+    ORDER_REPORTED = 50
+    ORDER_REPORTED_CANCEL = 51
+    ORDER_PARTSUCC_CANCEL = 52
+    ORDER_PART_CANCEL = 53
+    ORDER_CANCELED = 54
+    ORDER_PART_SUCC = 55
+    ORDER_SUCCEEDED = 56
+    ORDER_JUNK = 57
+
+
+class StockAccount:
+    def __init__(self, account_id, account_type='STOCK'):
+        self.account_id = account_id
+        self.account_type = account_type
+
+
+class _Record:
+    """xttype 中各回报对象的通用替身（按关键字参数设置属性）"""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.__dict__})"
+
+
+class XtOrderResponse(_Record):
+    pass
+
+
+class XtOrder(_Record):
+    pass
+
+
+class XtTrade(_Record):
+    pass
+
+
+class XtOrderError(_Record):
+    pass
+
+
+class XtCancelError(_Record):
+    pass
+
+
+class XtPosition(_Record):
+    pass
+
+
+class XtAsset(_Record):
+    pass
+
+
+class XtQuantTraderCallback:
+    """回调基类，与 xtquant.xttrader.XtQuantTraderCallback 方法名一致"""
+
+    def on_disconnected(self):
+        pass
+
+    def on_order_stock_async_response(self, response):
+        pass
+
+    def on_stock_order(self, order):
+        pass
+
+    def on_stock_trade(self, trade):
+        pass
+
+    def on_order_error(self, order_error):
+        pass
+
+    def on_cancel_error(self, cancel_error):
+        pass
+
+
+class XtQuantTrader:
+    """
+    交易对象替身
+    """
+
+    def __init__(self, path, session_id, price_func=None, cash=1e7, positions=None,
+                 ack_latency=0.002, fill_latency=0.01, partial_ratio=0.0, reject_ratio=0.0, seed=None):
+        """
+        Args:
+            path: QMT userdata 路径（替身中不使用）
+            session_id: 会话编号
+            price_func: 成交价函数 price_func(stock_code)，默认 10.0
+            cash: 初始可用资金
+            positions: 初始持仓 {stock_code: volume}（均可用）
+            ack_latency: 下单到确认的延迟秒数
+            fill_latency: 确认到成交的延迟秒数
+            partial_ratio: 先部分成交的概率
+            reject_ratio: 废单概率
+        """
+        self.session_id = session_id
+        self.price_func = price_func or (lambda code: 10.0)
+        self.cash = float(cash)
+        self.volume = dict(positions or {})
+        self.can_use = dict(positions or {})
+        self.cost = {c: self.price_func(c) for c in self.volume}
+        self.ack_latency = ack_latency
+        self.fill_latency = fill_latency
+        self.partial_ratio = partial_ratio
+        self.reject_ratio = reject_ratio
+        self.random = random.Random(seed)
+        self.callback = None
+        self.orders = {}
+        self._seq = 0
+        self._order_id = 1000
+        self._events = []      # 小顶堆 (到期时间, 序号, 函数, 参数)
+        self._n = 0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._running = False
+        self._thread = None
+
+    # ==================== 连接 ====================
+
+    def register_callback(self, callback):
+        self.callback = callback
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def connect(self):
+        return 0
+
+    def subscribe(self, account):
+        return 0
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=1)
+
+    # ==================== 事件循环 ====================
+
+    def _schedule(self, delay, func, *args):
+        with self._cond:
+            self._n += 1
+            heapq.heappush(self._events, (time.monotonic() + delay, self._n, func, args))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and (not self._events or self._events[0][0] > time.monotonic()):
+                    timeout = self._events[0][0] - time.monotonic() if self._events else None
+                    self._cond.wait(timeout)
+                if not self._running:
+                    return
+                _, _, func, args = heapq.heappop(self._events)
+            func(*args)
+
+    # ==================== 委托 ====================
+
+    def order_stock_async(self, account, stock_code, order_type, order_volume, price_type, price,
+                          strategy_name='', order_remark=''):
+        with self._lock:
+            self._seq += 1
+            self._order_id += 1
+            seq, order_id = self._seq, self._order_id
+            self.orders[order_id] = XtOrder(
+                account_id=account.account_id, stock_code=stock_code, order_id=order_id,
+                order_type=order_type, order_volume=int(order_volume), price_type=price_type, price=price,
+                traded_volume=0, traded_price=0.0, order_status=xtconstant.ORDER_UNREPORTED,
+                strategy_name=strategy_name, order_remark=order_remark)
+        self._schedule(self.ack_latency, self._ack, seq, order_id)
+        return seq
+
+    def cancel_order_stock_async(self, account, order_id):
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        self._schedule(self.ack_latency, self._cancel, order_id)
+        return seq
+
+    def _ack(self, seq, order_id):
+        o = self.orders[order_id]
+        cb = self.callback
+        cb and cb.on_order_stock_async_response(XtOrderResponse(
+            account_id=o.account_id, order_id=order_id, seq=seq,
+            strategy_name=o.strategy_name, order_remark=o.order_remark))
+        with self._lock:
+            reject = self.random.random() < self.reject_ratio
+            if o.order_type == xtconstant.STOCK_SELL and o.order_volume > self.can_use.get(o.stock_code, 0):
+                reject = True
+            if o.order_type == xtconstant.STOCK_BUY and \
+                    o.order_volume * self.price_func(o.stock_code) > self.cash:
+                reject = True
+            o.order_status = xtconstant.ORDER_JUNK if reject else xtconstant.ORDER_REPORTED
+            if not reject and o.order_type == xtconstant.STOCK_SELL:
+                self.can_use[o.stock_code] -= o.order_volume  # 卖出冻结
+        if reject:
+            cb and cb.on_order_error(XtOrderError(
+                account_id=o.account_id, order_id=order_id, error_id=-61, error_msg='模拟废单',
+                strategy_name=o.strategy_name, order_remark=o.order_remark))
+            cb and cb.on_stock_order(o)
+            return
+        cb and cb.on_stock_order(o)
+        if self.random.random() < self.partial_ratio and o.order_volume >= 200:
+            self._schedule(self.fill_latency, self._fill, order_id, o.order_volume // 200 * 100)
+        self._schedule(self.fill_latency * 2, self._fill, order_id, None)
+
+    def _fill(self, order_id, volume):
+        o = self.orders[order_id]
+        with self._lock:
+            if o.order_status not in (xtconstant.ORDER_REPORTED, xtconstant.ORDER_PART_SUCC):
+                return
+            volume = o.order_volume - o.traded_volume if volume is None else volume
+            if volume <= 0:
+                return
+            price = float(self.price_func(o.stock_code))
+            code = o.stock_code
+            if o.order_type == xtconstant.STOCK_BUY:
+                held = self.volume.get(code, 0)
+                self.cost[code] = (self.cost.get(code, 0.0) * held + price * volume) / (held + volume)
+                self.volume[code] = held + volume
+                self.cash -= price * volume
+            else:
+                self.volume[code] = self.volume.get(code, 0) - volume
+                self.cash += price * volume
+            o.traded_price = (o.traded_price * o.traded_volume + price * volume) / (o.traded_volume + volume)
+            o.traded_volume += volume
+            o.order_status = xtconstant.ORDER_SUCCEEDED if o.traded_volume >= o.order_volume \
+                else xtconstant.ORDER_PART_SUCC
+        cb = self.callback
+        if cb:
+            cb.on_stock_trade(XtTrade(
+                account_id=o.account_id, stock_code=code, order_id=order_id, order_type=o.order_type,
+                traded_volume=volume, traded_price=price, traded_amount=price * volume,
+                strategy_name=o.strategy_name, order_remark=o.order_remark))
+            cb.on_stock_order(o)
+
+    def _cancel(self, order_id):
+        o = self.orders.get(order_id)
+        cb = self.callback
+        with self._lock:
+            ok = o is not None and o.order_status in (xtconstant.ORDER_REPORTED, xtconstant.ORDER_PART_SUCC)
+            if ok:
+                o.order_status = xtconstant.ORDER_PART_CANCEL if o.traded_volume else xtconstant.ORDER_CANCELED
+                if o.order_type == xtconstant.STOCK_SELL:
+                    self.can_use[o.stock_code] += o.order_volume - o.traded_volume  # 解冻
+        if not ok:
+            cb and cb.on_cancel_error(XtCancelError(order_id=order_id, error_id=-1, error_msg='不可撤单'))
+            return
+        cb and cb.on_stock_order(o)
+
+    # ==================== 查询 ====================
+
+    def query_stock_positions(self, account):
+        with self._lock:
+            return [XtPosition(account_id=account.account_id, stock_code=c, volume=v,
+                               can_use_volume=self.can_use.get(c, 0), avg_price=self.cost.get(c, 0.0))
+                    for c, v in self.volume.items() if v]
+
+    def query_stock_asset(self, account):
+        with self._lock:
+            market = sum(v * self.price_func(c) for c, v in self.volume.items())
+            return XtAsset(account_id=account.account_id, cash=self.cash, market_value=market,
+                           total_asset=self.cash + market)
+
+    def query_stock_orders(self, account, cancelable_only=False):
+        with self._lock:
+            orders = list(self.orders.values())
+        if cancelable_only:
+            orders = [o for o in orders if o.order_status in (xtconstant.ORDER_REPORTED, xtconstant.ORDER_PART_SUCC)]
+        return orders
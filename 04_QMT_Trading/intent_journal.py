@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+QMT端意图日志 - 按幂等键持久化去重，崩溃后只重放未确认的意图
+聚宽模拟盘重启会重跑当前回调（序号变了、意图没变），同步工具可能整体重新投递段文件，
+监听程序重启后内存中的已分发序号也会丢失。本模块在本地记录每个交易日已确认的幂等键和
+可安全恢复的读取位置，保证同一意图只下一次单
+
+功能模块：
+1. 每日去重索引 DedupIndex
+   - 已确认的幂等键（signal_log.intent_key）追加写入 acked-YYYYMMDD.idx（每个键 8 字节）
+   - 内存中为有序 uint64 数组 + 未合并的尾部集合，查询为二分查找，尾部满 merge_every 个再合并
+   - 启动时整个文件一次读入 numpy 数组并排序，不逐条解析
+
+2. 在途与检查点 IntentJournal
+   - begin(rec)：分发前登记为在途（记录段内偏移）
+   - ack(rec)：执行完成后写入去重索引，移出在途
+   - 检查点 = 最早在途意图的位置，没有在途时为读取端当前位置；原子写入 checkpoint 文件
+   - seen(rec)：已确认或在途的意图直接丢弃
+
+3. 崩溃恢复
+   - SignalWatcher(journal=...) 启动时从检查点续读：检查点之前的记录都已确认，
+     之后的记录中已确认的按索引跳过，未确认的重新分发，读取量只与检查点之后的新记录有关
+   - 执行器重启后查询当日委托备注，已报到柜台的意图不会再次下单（见 qmt_executor.order_key）
+
+命令行：
+    python intent_journal.py 信号目录 日志目录      # 列出检查点之后未确认的意图（不下单）
+    python intent_journal.py --demo                 # 模拟回调重跑、整体重投与监听程序崩溃
+
+使用说明：
+    journal = IntentJournal(r'D:\\qmt_journal')
+    executor = QmtExecutor(accounts, on_done=journal.ack)
+    watcher = SignalWatcher(r'D:\\Nutstore\\signals', executor=executor.submit_threadsafe, journal=journal)
+"""
+
+import os
+import sys
+import struct
+import logging
+import argparse
+import threading
+
+import numpy as np
+
+try:
+    from signal_log import SignalLogReader, intent_key
+except ImportError:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '03_Signal_Bridge'))
+    from signal_log import SignalLogReader, intent_key
+
+logger = logging.getLogger('intent_journal')
+
+KEY = struct.Struct('<Q')
+
+
+class DedupIndex:
+    """
+    单个交易日的已确认幂等键
+    """
+
+    def __init__(self, path, merge_every=1024, fsync=False):
+        """
+        Args:
+            path: 索引文件路径
+            merge_every: 尾部集合达到该大小时合并进有序数组
+            fsync: 每次追加后 fsync（防断电；进程崩溃不需要）
+        """
+        self.path = path
+        self.merge_every = merge_every
+        self.fsync = fsync
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.tail = set()
+        self._fd = None
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+            # 只追加的文件在崩溃时最多留下不完整的最后一个键
+            n = len(data) // KEY.size
+            self.keys = np.unique(np.frombuffer(data[:n * KEY.size], dtype='<u8'))
+
+    def __contains__(self, key):
+        if key in self.tail:
+            return True
+        i = np.searchsorted(self.keys, np.uint64(key))
+        return i < len(self.keys) and self.keys[i] == key
+
+    def __len__(self):
+        return len(self.keys) + len(self.tail)
+
+    def add(self, key):
+        """
+        记录一个键
+
+        Returns:
+            bool: 是否为新键
+        """
+        if key in self:
+            return False
+        if self._fd is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.write(self._fd, KEY.pack(key))
+        if self.fsync:
+            os.fsync(self._fd)
+        self.tail.add(key)
+        if len(self.tail) >= self.merge_every:
+            self.merge()
+        return True
+
+    def merge(self):
+        """尾部合并进有序数组"""
+        if self.tail:
+            self.keys = np.union1d(self.keys, np.fromiter(self.tail, dtype=np.uint64, count=len(self.tail)))
+            self.tail = set()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class IntentJournal:
+    """
+    意图日志：每日去重索引 + 在途登记 + 读取检查点
+    """
+
+    def __init__(self, directory, merge_every=1024, fsync=False, keep_days=3):
+        """
+        Args:
+            directory: 日志目录（本地磁盘，不要放在同步目录中）
+            merge_every: 去重索引尾部合并阈值
+            fsync: 索引与检查点写入后 fsync
+            keep_days: 内存中保留最近几个交易日的索引
+        """
+        self.directory = directory
+        self.merge_every = merge_every
+        self.fsync = fsync
+        self.keep_days = keep_days
+        self.indexes = {}         # 交易日 -> DedupIndex
+        self.inflight = {}        # (交易日, 幂等键) -> (交易日, 段内偏移)
+        self.read_pos = None      # 读取端当前位置 (交易日, 偏移)
+        self.saved = self._load_checkpoint()
+        self.acked = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    # ==================== 去重 ====================
+
+    def _index(self, day):
+        index = self.indexes.get(day)
+        if index is None:
+            path = os.path.join(self.directory, f"acked-{day}.idx")
+            index = self.indexes[day] = DedupIndex(path, self.merge_every, self.fsync)
+            for old in sorted(self.indexes)[:-self.keep_days]:
+                self.indexes.pop(old).close()
+        return index
+
+    def seen(self, rec):
+        """意图已确认或在途"""
+        key = intent_key(rec)
+        with self._lock:
+            return (rec['day'], key) in self.inflight or key in self._index(rec['day'])
+
+    def begin(self, rec):
+        """分发前登记为在途"""
+        with self._lock:
+            self.inflight[(rec['day'], intent_key(rec))] = (rec['day'], rec.get('offset', 0))
+
+    def ack(self, rec, *_):
+        """
+        意图执行完成（成交、撤单、废单或无需下单）后确认；可直接作为执行器的 on_done 回调
+        """
+        key = intent_key(rec)
+        with self._lock:
+            self._index(rec['day']).add(key)
+            self.inflight.pop((rec['day'], key), None)
+            self.acked += 1
+            self._save_checkpoint()
+
+    # ==================== 检查点 ====================
+
+    def note_read(self, day, offset):
+        """读取端每次读取后报告当前位置"""
+        with self._lock:
+            self.read_pos = (int(day), int(offset))
+            self._save_checkpoint()
+
+    def checkpoint(self):
+        """可安全恢复的读取位置：最早在途意图，没有在途时为读取端位置"""
+        if self.inflight:
+            return min(self.inflight.values())
+        return self.read_pos
+
+    def _checkpoint_path(self):
+        return os.path.join(self.directory, 'checkpoint')
+
+    def _load_checkpoint(self):
+        try:
+            with open(self._checkpoint_path(), 'r') as f:
+                day, offset = f.read().split()
+            return int(day), int(offset)
+        except (OSError, ValueError):
+            return None
+
+    def _save_checkpoint(self):
+        pos = self.checkpoint()
+        if pos is None or pos == self.saved:
+            return
+        tmp = self._checkpoint_path() + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(f"{pos[0]} {pos[1]}")
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, self._checkpoint_path())
+        self.saved = pos
+
+    def restore(self, reader):
+        """
+        把读取端定位到上次保存的检查点
+
+        Returns:
+            tuple: 检查点 (交易日, 偏移)，没有检查点返回 None
+        """
+        if self.saved is not None:
+            reader.seek(*self.saved)
+            self.read_pos = self.saved
+        return self.saved
+
+    def pending(self, reader):
+        """
+        从检查点读到末尾，返回未确认的意图（不登记在途），用于重放前检查
+
+        Returns:
+            tuple: (未确认的记录列表, 读取的记录数)
+        """
+        self.restore(reader)
+        records = reader.poll()
+        return [r for r in records if not self.seen(r)], len(records)
+
+    def close(self):
+        with self._lock:
+            for index in self.indexes.values():
+                index.close()
+            self.indexes = {}
+
+
+# ==================== 本地演示 ====================
+
+def demo(count=2000):
+    """
+    1. 写入 count 条信号，执行器只确认前 80%，模拟监听程序崩溃
+    2. 聚宽回调重跑：同一回调的前 10 条以新序号再次写出
+    3. 重启监听程序：从检查点续读，只重放未确认的意图，重跑的意图按幂等键丢弃
+    4. 聚宽端写到一半崩溃：段尾留下半条记录，写入端重启后截断再续写，新记录全部可读
+    """
+    import time
+    import shutil
+    import tempfile
+    import datetime as dt
+    from signal_log import SignalLogWriter, SIDE_TARGET, RECORD_SIZE
+    from signal_watcher import SignalWatcher
+
+    root = tempfile.mkdtemp(prefix='journal_demo_')
+    signals, journal_dir = os.path.join(root, 'signals'), os.path.join(root, 'journal')
+    today = dt.datetime.now().replace(hour=14, minute=50, second=0, microsecond=0)
+    writer = SignalLogWriter(signals)
+    with writer.callback('rebalance', today):
+        for i in range(count):
+            writer.append(1, f"{600000 + i:06d}.XSHG", SIDE_TARGET, value=10000, ts=today)
+
+    journal = IntentJournal(journal_dir)
+    executed = []
+
+    def crashing(rec):
+        executed.append(rec)
+        if len(executed) <= count * 0.8:
+            journal.ack(rec)
+
+    watcher = SignalWatcher(signals, crashing, start_day=today.date(), use_inotify=False, journal=journal)
+    watcher.dispatch_new()
+    watcher.close()
+    journal.close()
+    print(f"第一次运行：分发 {len(executed)} 条，确认 {journal.acked} 条，检查点 {journal.checkpoint()}")
+
+    # 模拟盘重启重跑同一回调：序号续写，幂等键相同
+    with writer.callback('rebalance', today):
+        for i in range(10):
+            writer.append(1, f"{600000 + i:06d}.XSHG", SIDE_TARGET, value=10000, ts=today)
+    writer.close()
+
+    journal = IntentJournal(journal_dir)
+    replayed = []
+    watcher = SignalWatcher(signals, lambda r: (replayed.append(r), journal.ack(r)), start_day=today.date(),
+                            use_inotify=False, journal=journal)
+    resumed = journal.saved
+    started = time.perf_counter()
+    watcher.dispatch_new()
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"重启后：从 {resumed} 续读 {watcher.scanned} 条，重放 {len(replayed)} 条，"
+          f"丢弃重复 {watcher.duplicates} 条，用时 {elapsed:.1f}ms")
+
+    # 同步工具整体重新投递：从头重读，全部按索引丢弃
+    shutil.copyfile(writer.path, writer.path + '.tmp')
+    os.replace(writer.path + '.tmp', writer.path)
+    watcher.reader.offset = 0
+    before = len(replayed)
+    watcher.dispatch_new()
+    print(f"整体重投：重读 {watcher.scanned} 条，新分发 {len(replayed) - before} 条")
+
+    # 写入端崩溃：最后一条记录只写出一半，重启后续写
+    with open(writer.path, 'ab') as f:
+        f.write(b'\0' * (RECORD_SIZE // 2))
+    writer = SignalLogWriter(signals)
+    with writer.callback('close', today):
+        for i in range(10):
+            writer.append(1, f"{600000 + i:06d}.XSHG", SIDE_TARGET, value=0, ts=today)
+    writer.close()
+    before = len(replayed)
+    watcher.dispatch_new()
+    print(f"写入端崩溃重启：新分发 {len(replayed) - before} 条，损坏记录 {watcher.reader.corrupt} 条")
+    watcher.close()
+    journal.close()
+    shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(description='QMT 意图日志')
+    parser.add_argument('signals', nargs='?', help='信号目录')
+    parser.add_argument('journal', nargs='?', help='日志目录')
+    parser.add_argument('--demo', action='store_true', help='本地演示')
+    args = parser.parse_args()
+    if args.demo:
+        demo()
+    elif args.signals and args.journal:
+        journal = IntentJournal(args.journal)
+        if journal.saved is None:
+            print("没有检查点，监听程序启动时从当日段头开始读取")
+        else:
+            reader = SignalLogReader(args.signals)
+            records, scanned = journal.pending(reader)
+            print(f"检查点 {journal.saved}，之后 {scanned} 条记录中未确认 {len(records)} 条：")
+            for r in records:
+                print(f"  {r['day']} seq={r['seq']} 策略 {r['strategy_id']} {r['code']} "
+                      f"side={r['side']} value={r['value']:.2f} qty={r['qty']}")
+    else:
+        parser.print_help()
@@ -0,0 +1,554 @@
+# -*- coding: utf-8 -*-
+"""
+QMT端异步下单执行器 - 消费信号桥记录并通过 xtquant 并发下单
+信号来自 signal_watcher（文件同步）或 redis_channel（Redis Stream），
+执行器在 asyncio 事件循环中排队、限速、下单，并跟踪每笔委托直到成交/撤单/废单
+
+功能模块：
+1. 信号转委托
+   - SIDE_BUY / SIDE_SELL：按 qty（或 value/最新价）买卖
+   - SIDE_TARGET：按目标市值计算目标股数，与持仓+在途委托的差额下单
+   - 聚宽代码转换为 QMT 代码（000001.XSHE -> 000001.SZ）
+
+2. 并发与限速
+   - 多个工作协程并发下单，每个资金账号一个令牌桶限速（rate 笔/秒，burst 突发）
+   - xtquant 回调在其自身线程中触发，通过 call_soon_threadsafe 转回事件循环
+
+3. 委托状态跟踪
+   - submitted -> acked -> partial -> filled / canceled / rejected
+   - 超过 order_timeout 未完成的委托自动撤单
+   - 记录 下单->确认、下单->成交 延迟直方图
+   - 传入 tracer（latency_trace.TraceWriter）时按信号的 trace_id 记录 submit/ack/fill 跳点
+
+4. 幂等
+   - 委托备注为 order_key(信号)：聚宽回调内的信号用 (交易日, 策略, 回调ID, 意图序号)，回调重跑不变；
+     Redis 意图用 (交易日, 策略, 发布端 epoch, 序号)
+   - attach 时查询当日委托，备注已存在的信号不再下单（崩溃发生在报单之后、确认之前）
+   - 当日已完成的委托备注单独保存，核对清理委托后重复投递的信号也不会再下单
+   - QmtExecutor(on_done=journal.ack) 在委托进入终态或无需下单时确认意图日志（见 intent_journal.py），
+     超时仍未确认的委托不确认，重启后按柜台委托备注判断是否重放
+
+5. 持仓核对
+   - 每 reconcile_interval 秒查询账户持仓，与本地记录（核对时持仓 + 成交回报）比对，
+     无在途委托的证券出现差异时记录日志并以账户持仓为准
+
+本地压测：
+    python qmt_executor.py --load 3000    # 使用 fake_xtquant 替身，按每分钟 3000 笔提交信号
+
+使用说明：
+    executor = QmtExecutor({'main': AccountExecutor('main', trader, StockAccount('账号'), price_func)})
+    watcher = SignalWatcher(目录, executor=executor.submit_threadsafe)
+"""
+
+import time
+import asyncio
+import logging
+import argparse
+
+try:
+    from xtquant.xttrader import XtQuantTraderCallback
+    from xtquant import xtconstant
+except ImportError:
+    from fake_xtquant import XtQuantTraderCallback, xtconstant
+
+from signal_watcher import LatencyHistogram
+from signal_log import SIDE_BUY, SIDE_SELL, SIDE_TARGET
+
+logger = logging.getLogger('qmt_executor')
+
+# 终态
+FINAL_STATES = ('filled', 'canceled', 'rejected')
+_CANCELED = (xtconstant.ORDER_CANCELED, xtconstant.ORDER_PART_CANCEL, xtconstant.ORDER_PARTSUCC_CANCEL)
+
+
+def to_qmt_code(code):
+    """聚宽代码 -> QMT 代码"""
+    return code.replace('.XSHE', '.SZ').replace('.XSHG', '.SH')
+
+
+def order_key(signal):
+    """
+    信号 -> 委托备注，同一意图重复投递得到相同的备注
+    """
+    if 'strategy' in signal:
+        # redis_channel 的意图：seq 在发布端重启后从 1 开始，加 epoch 区分
+        return f"{signal['day']}-{signal['strategy']}-{signal['epoch']:x}-{signal['seq']}"
+    if signal.get('callback'):
+        return f"{signal.get('day', '')}-{signal['strategy_id']}-{signal['callback']:x}-{signal['intent']}"
+    return f"{signal.get('day', '')}-{signal['strategy_id']}-{signal['seq']}"
+
+
+class TokenBucket:
+    """
+    异步令牌桶：每秒补充 rate 个令牌，最多积累 burst 个
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def release(self):
+        """归还一个未使用的令牌"""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class OrderState:
+    """
+    一笔委托的状态
+    """
+
+    def __init__(self, key, signal, code, order_type, volume):
+        self.key = key                # 委托备注，见 order_key
+        self.signal = signal          # 原始信号记录
+        self.code = code              # QMT 代码
+        self.order_type = order_type  # STOCK_BUY / STOCK_SELL
+        self.volume = volume          # 委托股数
+        self.filled = 0               # 已成交股数
+        self.order_id = None
+        self.status = 'submitted'
+        self.error = None
+        self.submitted_at = time.perf_counter()
+        self.acked_at = None
+        self.done = asyncio.get_event_loop().create_future()
+
+    @property
+    def signed_open(self):
+        """未成交部分（买正卖负）"""
+        left = 0 if self.status in FINAL_STATES else self.volume - self.filled
+        return left if self.order_type == xtconstant.STOCK_BUY else -left
+
+    def finish(self, status, error=None):
+        if self.status in FINAL_STATES:
+            return
+        self.status = status
+        self.error = error
+        if not self.done.done():
+            self.done.set_result(status)
+
+    def __repr__(self):
+        return f"OrderState({self.key} {self.code} {self.volume} {self.status} filled={self.filled})"
+
+
+class _Callback(XtQuantTraderCallback):
+    """把 xtquant 回调线程中的事件转回事件循环"""
+
+    def __init__(self, executor, loop):
+        super().__init__()
+        self.executor = executor
+        self.loop = loop
+
+    def _post(self, func, *args):
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def on_order_stock_async_response(self, response):
+        self._post(self.executor.on_response, response)
+
+    def on_stock_order(self, order):
+        self._post(self.executor.on_order, order)
+
+    def on_stock_trade(self, trade):
+        self._post(self.executor.on_trade, trade)
+
+    def on_order_error(self, order_error):
+        self._post(self.executor.on_error, order_error)
+
+    def on_disconnected(self):
+        logger.error("QMT 连接断开")
+
+
+class AccountExecutor:
+    """
+    单个资金账号的下单执行
+    """
+
+    def __init__(self, name, trader, account, price_func, rate=10, burst=None, order_timeout=30.0, lot=100,
+                 strategy_name='jq_bridge', tracer=None):
+        """
+        Args:
+            name: 账号名称（路由用）
+            trader: XtQuantTrader（已 start/connect）或 fake_xtquant 替身
+            account: StockAccount
+            price_func: 最新价函数 price_func(qmt_code)，例如 xtdata.get_full_tick 的 lastPrice
+            rate: 每秒最多下单笔数
+            burst: 令牌桶容量，默认等于 rate
+            order_timeout: 未完成委托的撤单秒数
+            lot: 最小交易单位
+            strategy_name: 委托的策略名称
+            tracer: 延迟追踪写入器，None 表示不追踪
+        """
+        self.name = name
+        self.trader = trader
+        self.account = account
+        self.price_func = price_func
+        self.bucket = None
+        self.rate, self.burst = rate, burst
+        self.order_timeout = order_timeout
+        self.lot = lot
+        self.strategy_name = strategy_name
+        self.tracer = tracer
+        self.positions = {}       # QMT代码 -> 股数（核对结果 + 成交回报）
+        self.orders = {}          # 委托备注 -> OrderState
+        self.by_seq = {}          # 异步下单序号 -> OrderState
+        self.by_id = {}           # order_id -> OrderState
+        self.ack_latency = LatencyHistogram()
+        self.fill_latency = LatencyHistogram()
+        self.counts = {s: 0 for s in FINAL_STATES}
+        self.placed = set()       # 启动时柜台已有的本策略委托备注
+        self.completed = set()    # 当日已进入终态的委托备注（reconcile 清理 orders 后仍可去重）
+        self.completed_day = None
+
+    def attach(self, loop):
+        """在事件循环中注册回调并初始化持仓与当日已报委托"""
+        self.bucket = TokenBucket(self.rate, self.burst)
+        self.trader.register_callback(_Callback(self, loop))
+        self.positions = {p.stock_code: p.volume for p in self.trader.query_stock_positions(self.account)}
+        self.placed = {o.order_remark for o in self.trader.query_stock_orders(self.account)
+                       if o.strategy_name == self.strategy_name}
+
+    # ==================== 信号转委托 ====================
+
+    def in_flight(self, code):
+        """在途委托未成交的净股数"""
+        return sum(o.signed_open for o in self.orders.values() if o.code == code)
+
+    def plan(self, signal):
+        """
+        信号 -> (委托方向, 股数)，无需下单时返回 None
+        """
+        code = to_qmt_code(signal['code'])
+        side = signal['side']
+        if side == SIDE_TARGET:
+            price = self.price_func(code)
+            if signal['value'] <= 0:
+                target = 0
+            elif signal['qty'] > 0:
+                target = signal['qty']
+            else:
+                target = int(signal['value'] / price / self.lot) * self.lot
+            delta = target - self.positions.get(code, 0) - self.in_flight(code)
+        else:
+            volume = signal['qty']
+            if volume <= 0:
+                volume = int(signal['value'] / self.price_func(code) / self.lot) * self.lot
+            delta = volume if side == SIDE_BUY else -volume
+        if delta == 0:
+            return None
+        if delta > 0:
+            delta = delta // self.lot * self.lot
+            return (code, xtconstant.STOCK_BUY, delta) if delta > 0 else None
+        return code, xtconstant.STOCK_SELL, -delta
+
+    async def submit(self, signal):
+        """
+        下单并等待委托进入终态
+
+        Returns:
+            OrderState: 无需下单时返回 None
+        """
+        key = order_key(signal)
+        if signal.get('day') != self.completed_day:
+            self.completed_day = signal.get('day')
+            self.completed = set()
+        if key in self.orders:
+            return self.orders[key]
+        if key in self.completed:
+            logger.info(f"[{self.name}] 委托 {key} 今日已完成，不再重复下单")
+            return None
+        if key in self.placed:
+            logger.info(f"[{self.name}] 委托 {key} 已在柜台，不再重复下单")
+            return None
+        await self.bucket.acquire()
+        # 拿到令牌后再计算委托并登记，中间不再 await：并发的目标仓位信号能看到彼此的在途股数
+        if key in self.orders:
+            self.bucket.release()
+            return self.orders[key]
+        planned = self.plan(signal)
+        if planned is None:
+            self.bucket.release()
+            return None
+        code, order_type, volume = planned
+        state = OrderState(key, signal, code, order_type, volume)
+        self.orders[key] = state
+        self._trace(state, 'submit')
+        seq = self.trader.order_stock_async(self.account, code, order_type, volume, xtconstant.LATEST_PRICE,
+                                            -1, self.strategy_name, key)
+        self.by_seq[seq] = state
+        try:
+            await asyncio.wait_for(asyncio.shield(state.done), self.order_timeout)
+        except asyncio.TimeoutError:
+            if state.order_id is not None:
+                self.trader.cancel_order_stock_async(self.account, state.order_id)
+                try:
+                    await asyncio.wait_for(asyncio.shield(state.done), self.order_timeout)
+                except asyncio.TimeoutError:
+                    pass
+            if state.status not in FINAL_STATES:
+                logger.error(f"委托超时未完成 {state}")
+        return state
+
+    # ==================== 回调（事件循环线程） ====================
+
+    def _trace(self, state, hop):
+        if self.tracer is not None:
+            self.tracer.hop(state.signal.get('trace_id', 0), hop)
+
+    def _state(self, order_id=None, remark=None):
+        state = self.by_id.get(order_id)
+        if state is None and remark:
+            state = self.orders.get(remark)
+            if state is not None and order_id is not None:
+                state.order_id = order_id
+                self.by_id[order_id] = state
+        return state
+
+    def on_response(self, response):
+        state = self.by_seq.pop(response.seq, None) or self._state(remark=response.order_remark)
+        if state is None:
+            return
+        state.order_id = response.order_id
+        self.by_id[response.order_id] = state
+        if state.acked_at is None:
+            state.acked_at = time.perf_counter()
+            state.status = 'acked' if state.status == 'submitted' else state.status
+            self.ack_latency.record((state.acked_at - state.submitted_at) * 1000)
+            self._trace(state, 'ack')
+
+    def on_order(self, order):
+        state = self._state(order.order_id, order.order_remark)
+        if state is None:
+            return
+        if order.order_status == xtconstant.ORDER_JUNK:
+            self._finish(state, 'rejected', getattr(order, 'status_msg', None))
+        elif order.order_status in _CANCELED:
+            self._finish(state, 'canceled')
+        elif order.order_status == xtconstant.ORDER_SUCCEEDED and state.filled >= state.volume:
+            self._finish(state, 'filled')
+
+    def on_trade(self, trade):
+        state = self._state(trade.order_id, trade.order_remark)
+        sign = 1 if trade.order_type == xtconstant.STOCK_BUY else -1
+        self.positions[trade.stock_code] = self.positions.get(trade.stock_code, 0) + sign * trade.traded_volume
+        if state is None:
+            return
+        state.filled += trade.traded_volume
+        if state.filled >= state.volume:
+            self._finish(state, 'filled')
+        elif state.status not in FINAL_STATES:
+            state.status = 'partial'
+
+    def on_error(self, error):
+        state = self._state(error.order_id, error.order_remark)
+        if state is not None:
+            self._finish(state, 'rejected', error.error_msg)
+
+    def _finish(self, state, status, error=None):
+        if state.status in FINAL_STATES:
+            return
+        if status == 'filled':
+            self.fill_latency.record((time.perf_counter() - state.submitted_at) * 1000)
+            self._trace(state, 'fill')
+        state.finish(status, error)
+        self.completed.add(state.key)
+        self.counts[status] += 1
+        if status == 'rejected':
+            logger.warning(f"[{self.name}] 废单 {state.key} {state.code} {state.volume}: {error}")
+
+    # ==================== 持仓核对 ====================
+
+    async def reconcile(self):
+        """
+        查询账户持仓与本地记录比对，无在途委托的差异以账户为准
+
+        Returns:
+            dict: {QMT代码: (本地, 账户)} 差异
+        """
+        loop = asyncio.get_event_loop()
+        positions = await loop.run_in_executor(None, self.trader.query_stock_positions, self.account)
+        broker = {p.stock_code: p.volume for p in positions}
+        busy = {o.code for o in self.orders.values() if o.status not in FINAL_STATES}
+        diffs = {}
+        for code in set(broker) | set(self.positions):
+            if code in busy:
+                continue
+            local, actual = self.positions.get(code, 0), broker.get(code, 0)
+            if local != actual:
+                diffs[code] = (local, actual)
+                self.positions[code] = actual
+        if diffs:
+            logger.warning(f"[{self.name}] 持仓核对差异(本地, 账户): {diffs}")
+        # 清理已完成的委托，只保留在途的
+        self.orders = {k: o for k, o in self.orders.items() if o.status not in FINAL_STATES}
+        self.by_id = {i: o for i, o in self.by_id.items() if o.status not in FINAL_STATES}
+        return diffs
+
+    def summary(self):
+        return (f"[{self.name}] 成交 {self.counts['filled']} 撤单 {self.counts['canceled']} "
+                f"废单 {self.counts['rejected']}\n  下单->确认 {self.ack_latency.summary()}\n"
+                f"  下单->成交 {self.fill_latency.summary()}")
+
+
+class QmtExecutor:
+    """
+    多账号信号执行服务
+    """
+
+    def __init__(self, accounts, route=None, workers=16, reconcile_interval=60.0, on_done=None):
+        """
+        Args:
+            accounts: {账号名称: AccountExecutor}
+            route: 路由函数 route(signal) -> 账号名称，默认第一个账号
+            workers: 并发工作协程数
+            reconcile_interval: 持仓核对间隔秒数
+            on_done: 信号执行完成（委托进入终态或无需下单）后的回调 on_done(signal, state)，
+                     执行异常或超时仍未进入终态时不调用，例如 IntentJournal.ack
+        """
+        self.accounts = accounts
+        self.route = route or (lambda signal: next(iter(accounts)))
+        self.workers = workers
+        self.reconcile_interval = reconcile_interval
+        self.on_done = on_done
+        self.queue = None
+        self.loop = None
+        self.received = 0
+        self.finished = 0
+        self._stop = None
+
+    def submit_threadsafe(self, signal):
+        """从其他线程（例如 SignalWatcher 的回调）提交信号"""
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, signal)
+
+    def submit(self, signal):
+        """在事件循环线程中提交信号"""
+        self.queue.put_nowait(signal)
+
+    async def _worker(self):
+        while True:
+            signal = await self.queue.get()
+            try:
+                self.received += 1
+                account = self.accounts[self.route(signal)]
+                state = await account.submit(signal)
+                # 超时未进入终态的委托可能没有报到柜台，不确认，重启后重放（柜台已有备注的不会重复下单）
+                if self.on_done is not None and (state is None or state.status in FINAL_STATES):
+                    self.on_done(signal, state)
+            except Exception:
+                logger.exception(f"信号执行失败 {signal}")
+            finally:
+                self.finished += 1
+                self.queue.task_done()
+
+    async def _reconciler(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            for account in self.accounts.values():
+                try:
+                    await account.reconcile()
+                except Exception:
+                    logger.exception(f"持仓核对失败 {account.name}")
+
+    async def start(self):
+        """在当前事件循环中启动工作协程"""
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue()
+        for account in self.accounts.values():
+            account.attach(self.loop)
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._reconciler()))
+        self._stop = asyncio.Event()
+
+    async def drain(self):
+        """等待队列中的信号全部执行完毕"""
+        await self.queue.join()
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def run_forever(self):
+        await self.start()
+        await self._stop.wait()
+        await self.stop()
+
+
+# ==================== 本地压测 ====================
+
+async def load_test(per_minute=3000, seconds=10, codes=50, rate=100, ack_latency=0.005, fill_latency=0.02,
+                    partial_ratio=0.1, reject_ratio=0.01, trace_dir=None):
+    """
+    用 fake_xtquant 替身按每分钟 per_minute 笔的速度提交信号，输出吞吐与延迟
+    trace_dir 不为空时为每个信号分配追踪ID，结束后输出每一跳的 p50/p99
+    """
+    from fake_xtquant import XtQuantTrader, StockAccount
+    tracer = None
+    if trace_dir:
+        from latency_trace import TraceWriter, print_summary
+        tracer = TraceWriter(trace_dir, 'qmt', use_jq_file=False)
+
+    names = [f"{600000 + i:06d}.XSHG" for i in range(codes)]
+    prices = {to_qmt_code(c): 10.0 + i * 0.1 for i, c in enumerate(names)}
+    trader = XtQuantTrader('', 1, price_func=prices.get, cash=1e9,
+                           positions={c: 1000000 for c in prices}, ack_latency=ack_latency,
+                           fill_latency=fill_latency, partial_ratio=partial_ratio, reject_ratio=reject_ratio)
+    trader.start()
+    account = AccountExecutor('main', trader, StockAccount('sim'), prices.get, rate=rate, order_timeout=5,
+                              tracer=tracer)
+    executor = QmtExecutor({'main': account}, workers=64, reconcile_interval=1.0)
+    await executor.start()
+
+    total = int(per_minute * seconds / 60)
+    interval = 60.0 / per_minute
+    started = time.perf_counter()
+    for i in range(total):
+        trace_id = 0
+        if tracer is not None:
+            trace_id = tracer.new_id()
+            tracer.hop(trace_id, 'intent')
+        executor.submit({'day': 20240102, 'strategy_id': 1, 'seq': i + 1, 'code': names[i % codes],
+                         'side': SIDE_BUY if i % 2 else SIDE_SELL, 'value': 0.0, 'qty': 100, 'reason': 1,
+                         'ts_ns': time.time_ns(), 'trace_id': trace_id})
+        next_at = started + (i + 1) * interval
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    await executor.drain()
+    elapsed = time.perf_counter() - started
+    diffs = await account.reconcile()
+    await executor.stop()
+    trader.stop()
+
+    print(f"提交 {total} 笔，用时 {elapsed:.1f}s，实际 {executor.finished / elapsed * 60:,.0f} 笔/分钟，"
+          f"核对差异 {len(diffs)} 只")
+    print(account.summary())
+    if tracer is not None:
+        tracer.close()
+        print_summary([trace_dir])
+    return account
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(description='QMT 异步下单执行器')
+    parser.add_argument('--load', type=int, default=0, help='压测：每分钟提交的信号数')
+    parser.add_argument('--seconds', type=int, default=10, help='压测时长（秒）')
+    parser.add_argument('--rate', type=int, default=100, help='每个账号每秒最多下单笔数')
+    parser.add_argument('--trace', default=None, help='压测：追踪文件目录，结束后输出每一跳延迟')
+    args = parser.parse_args()
+    if args.load:
+        asyncio.run(load_test(args.load, args.seconds, rate=args.rate, trace_dir=args.trace))
+    else:
+        parser.print_help()
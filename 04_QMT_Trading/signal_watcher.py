@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+QMT端信号监听 - 监听同步目录中的信号段文件并分发给执行回调
+文件同步工具（坚果云/OneDrive）把聚宽写出的 signals-YYYYMMDD.seg 同步到本地后，
+监听程序在亚秒级内读到新记录，按序号去重后交给执行回调
+
+功能模块：
+1. 文件变化检测
+   - Linux：inotify（IN_CLOSE_WRITE / IN_MODIFY / IN_MOVED_TO / IN_CREATE）
+   - 其他平台或 inotify 不可用：按 poll_interval 轮询段文件的 mtime/size
+
+2. 去重与分发
+   - 每个交易日记录已分发的最大序号，序号不大于它的记录直接丢弃
+     （同步工具以"临时文件 + 重命名"整体替换段文件时，读取端会从头重读）
+   - executor(record) 抛出异常只记录日志，不重复分发，避免重复下单
+   - 传入 journal（intent_journal.IntentJournal）时按幂等键持久化去重：启动时从检查点续读，
+     已确认或在途的意图丢弃，执行完成后由执行器调用 journal.ack(record)
+
+3. 延迟统计
+   - 拾取延迟 = 分发时刻 - 信号时间戳，按固定毫秒分桶统计
+   - watcher.latency.summary() 输出分桶计数与 p50/p99
+
+本地模拟：
+    python signal_watcher.py --demo
+    写入线程按固定频率追加信号，模拟同步线程以"写临时文件 + os.replace"的方式搬运到监听目录
+
+使用说明：
+    from signal_watcher import SignalWatcher
+    watcher = SignalWatcher(r'D:\\Nutstore\\signals', executor=on_signal)
+    watcher.run()
+"""
+
+import os
+import sys
+import time
+import shutil
+import select
+import struct
+import logging
+
+try:
+    from signal_log import SignalLogReader, segment_day
+except ImportError:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '03_Signal_Bridge'))
+    from signal_log import SignalLogReader, segment_day
+
+logger = logging.getLogger('signal_watcher')
+
+# inotify 事件掩码（见 <sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct('iIII')
+
+
+class LatencyHistogram:
+    """
+    固定分桶的延迟直方图（毫秒）
+    """
+
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.samples = 0
+        self.max_ms = 0.0
+
+    def record(self, ms):
+        """记录一个延迟样本（毫秒）"""
+        i = 0
+        while i < len(self.BOUNDS_MS) and ms > self.BOUNDS_MS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.samples += 1
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, q):
+        """按分桶上界估计分位数（毫秒），不超过实际最大值"""
+        if self.samples == 0:
+            return None
+        need = q / 100.0 * self.samples
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= need and c:
+                return min(float(self.BOUNDS_MS[i]), self.max_ms) if i < len(self.BOUNDS_MS) else self.max_ms
+        return self.max_ms
+
+    def summary(self):
+        """文本形式的分桶计数与分位数"""
+        if self.samples == 0:
+            return "暂无样本"
+        lines = [f"样本数 {self.samples}，p50≤{self.percentile(50):.0f}ms，"
+                 f"p99≤{self.percentile(99):.0f}ms，最大 {self.max_ms:.1f}ms"]
+        lower = 0
+        for i, c in enumerate(self.counts):
+            upper = f"{self.BOUNDS_MS[i]}ms" if i < len(self.BOUNDS_MS) else "inf"
+            if c:
+                lines.append(f"  ({lower}, {upper}]: {c}")
+            lower = upper
+        return '\n'.join(lines)
+
+
+class _Inotify:
+    """
+    通过 ctypes 调用 libc 的 inotify，只在 Linux 可用
+    """
+
+    def __init__(self, directory):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 失败')
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f'inotify_add_watch 失败: {directory}')
+
+    def wait(self, timeout):
+        """
+        等待事件
+
+        Returns:
+            list: 发生变化的文件名
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        names = []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        pos = 0
+        while pos + _EVENT.size <= len(data):
+            _, _, _, length = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            names.append(data[pos:pos + length].rstrip(b'\0').decode('utf-8', 'replace'))
+            pos += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SignalWatcher:
+    """
+    信号段文件监听器
+    """
+
+    def __init__(self, directory, executor, start_day=None, poll_interval=0.05, use_inotify=None, tracer=None,
+                 journal=None):
+        """
+        Args:
+            directory: 同步工具的本地信号目录
+            executor: 执行回调 executor(record)，record 为 signal_log 解码后的字典
+            start_day: 从哪个交易日开始读（date），默认今天
+            poll_interval: 轮询间隔秒数（inotify 模式下作为兜底检查间隔）
+            use_inotify: None 自动检测，False 强制轮询
+            tracer: 延迟追踪写入器（latency_trace.TraceWriter），拾取时记录 'pickup' 跳点
+            journal: 意图日志（intent_journal.IntentJournal），None 表示只按内存中的序号去重
+        """
+        self.directory = directory
+        self.executor = executor
+        self.poll_interval = poll_interval
+        self.reader = SignalLogReader(directory, start_day)
+        self.last_seq = {}        # 交易日 -> 已分发的最大序号
+        self.latency = LatencyHistogram()
+        self.tracer = tracer
+        self.journal = journal
+        self.dispatched = 0
+        self.duplicates = 0
+        self.scanned = 0          # 最近一次读取的记录数
+        if journal is not None and journal.restore(self.reader):
+            logger.info(f"从检查点 {journal.saved} 续读，未确认的意图将重新分发")
+        self._stat = {}           # 段文件名 -> (mtime_ns, size, inode)
+        self._inotify = None
+        if use_inotify is not False and sys.platform.startswith('linux'):
+            try:
+                self._inotify = _Inotify(directory)
+            except (OSError, AttributeError) as e:
+                logger.warning(f"inotify 不可用，改用轮询: {e}")
+        self.mode = 'inotify' if self._inotify else 'poll'
+
+    # ==================== 读取与分发 ====================
+
+    def _check_replaced(self):
+        """
+        当前段被整体替换且变短时（同步工具重命名覆盖），从段头重新读取，依靠序号去重
+        """
+        path = os.path.join(self.directory, f"signals-{self.reader.day}.seg")
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size < self.reader.offset:
+            logger.warning(f"信号段 {path} 变短 ({size} < {self.reader.offset})，从头重读")
+            self.reader.offset = 0
+
+    def dispatch_new(self):
+        """
+        读取新记录、去重并分发
+
+        Returns:
+            int: 本次分发的记录数
+        """
+        self._check_replaced()
+        n = 0
+        records = self.reader.poll()
+        self.scanned = len(records)
+        for rec in records:
+            if rec['seq'] <= self.last_seq.get(rec['day'], 0):
+                self.duplicates += 1
+                continue
+            self.last_seq[rec['day']] = rec['seq']
+            if self.journal is not None:
+                if self.journal.seen(rec):
+                    self.duplicates += 1
+                    continue
+                self.journal.begin(rec)
+            self.latency.record((time.time() * 1e9 - rec['ts_ns']) / 1e6)
+            if self.tracer is not None:
+                self.tracer.hop(rec['trace_id'], 'pickup')
+            try:
+                self.executor(rec)
+            except Exception:
+                logger.exception(f"执行回调失败 seq={rec['seq']} code={rec['code']}")
+            self.dispatched += 1
+            n += 1
+        if self.journal is not None:
+            self.journal.note_read(*self.reader.position())
+        return n
+
+    # ==================== 变化检测 ====================
+
+    def _changed_by_stat(self):
+        """轮询模式：比较段文件的 mtime/size/inode"""
+        changed = False
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return False
+        for name in names:
+            day = segment_day(name)
+            if day is None or day < self.reader.day:
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            key = (st.st_mtime_ns, st.st_size, st.st_ino)
+            if self._stat.get(name) != key:
+                self._stat[name] = key
+                changed = True
+        return changed
+
+    def run_once(self, timeout=None):
+        """
+        等待一次变化并分发
+
+        Args:
+            timeout: 最长等待秒数，默认 poll_interval
+
+        Returns:
+            int: 本次分发的记录数
+        """
+        timeout = self.poll_interval if timeout is None else timeout
+        if self._inotify:
+            names = self._inotify.wait(timeout)
+            if any(segment_day(n) is not None for n in names):
+                return self.dispatch_new()
+            # 超时兜底：网络盘/同步工具可能不产生 inotify 事件
+            return self.dispatch_new() if not names else 0
+        if self._changed_by_stat():
+            return self.dispatch_new()
+        time.sleep(timeout)
+        return 0
+
+    def run(self, duration=None, stop=None):
+        """
+        持续监听
+
+        Args:
+            duration: 运行秒数，None 表示一直运行
+            stop: 可选的 threading.Event，置位后退出
+        """
+        logger.info(f"开始监听 {self.directory}（{self.mode} 模式）")
+        end = None if duration is None else time.monotonic() + duration
+        self.dispatch_new()
+        while (end is None or time.monotonic() < end) and not (stop and stop.is_set()):
+            self.run_once()
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+
+
+# ==================== 本地模拟 ====================
+
+def simulate_sync(src, dst, stop, interval=0.02):
+    """
+    模拟同步工具：段文件有变化时写入 dst 下的临时文件，再 os.replace 覆盖目标文件
+    """
+    os.makedirs(dst, exist_ok=True)
+    sizes = {}
+    while not stop.is_set():
+        for name in os.listdir(src):
+            if segment_day(name) is None:
+                continue
+            size = os.path.getsize(os.path.join(src, name))
+            if sizes.get(name) == size:
+                continue
+            sizes[name] = size
+            tmp = os.path.join(dst, f".{name}.sync")
+            shutil.copyfile(os.path.join(src, name), tmp)
+            os.replace(tmp, os.path.join(dst, name))
+        time.sleep(interval)
+
+
+def demo(count=200, rate=100.0, use_inotify=None):
+    """
+    本地演示：写入 -> 模拟同步 -> 监听，输出拾取延迟直方图
+    """
+    import tempfile
+    import threading
+    from signal_log import SignalLogWriter, SIDE_BUY
+
+    root = tempfile.mkdtemp(prefix='signal_demo_')
+    src, dst = os.path.join(root, 'jq'), os.path.join(root, 'qmt')
+    os.makedirs(src)
+    os.makedirs(dst)
+    stop = threading.Event()
+    received = []
+    watcher = SignalWatcher(dst, received.append, use_inotify=use_inotify)
+    threads = [
+        threading.Thread(target=simulate_sync, args=(src, dst, stop), daemon=True),
+        threading.Thread(target=watcher.run, kwargs={'stop': stop}, daemon=True),
+    ]
+    for t in threads:
+        t.start()
+
+    writer = SignalLogWriter(src)
+    for i in range(count):
+        writer.append(1, '000001.XSHE', SIDE_BUY, value=10000, qty=100, reason='open')
+        time.sleep(1.0 / rate)
+    writer.close()
+
+    deadline = time.monotonic() + 5
+    while len(received) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stop.set()
+    for t in threads:
+        t.join(timeout=1)
+    watcher.close()
+    shutil.rmtree(root, ignore_errors=True)
+
+    print(f"模式: {watcher.mode}，写入 {count} 条，分发 {watcher.dispatched} 条，重复丢弃 {watcher.duplicates} 条")
+    print(watcher.latency.summary())
+    return watcher
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if '--demo' in sys.argv:
+        demo(use_inotify=False if '--poll' in sys.argv else None)
+    elif len(sys.argv) > 1:
+        w = SignalWatcher(sys.argv[1], executor=lambda r: logger.info(f"信号 {r}"))
+        try:
+            w.run()
+        except KeyboardInterrupt:
+            print(w.latency.summary())